@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the running payoff accounting of the remote.
+The discount factors of the ticks are computed once, with
+controlOptimalParams.get_discount as TickHistory.get_part_payoff on the
+server, and the sums are updated at each tick in O(1). The cumulative
+payoff is summed sequentially, in the order of the ticks, so it is the same
+float as the np.cumsum of the server.
+"""
+
+# built-in
+import numpy as np
+
+# controlOptimal
+import controlOptimalParams as pms
+
+
+class DiscountTable(object):
+    def __init__(self, tick_duration, nb_ticks):
+        """
+        exp(-r t) for the times of the ticks 0 to nb_ticks, as given by the
+        scheduler (rounded to the millisecond)
+        :param tick_duration: seconds
+        :param nb_ticks:
+        """
+        self.tick_duration = tick_duration
+        self.times = [round(k * tick_duration, 3) for k in range(nb_ticks + 1)]
+        self.factors = pms.get_discount(np.array(self.times)).tolist()
+
+    def get(self, the_time):
+        """
+        :param the_time: seconds
+        :return: exp(-r * the_time), from the table if it is a tick time
+        """
+        index = int(round(the_time / self.tick_duration))
+        if 0 <= index < len(self.times) and self.times[index] == the_time:
+            return self.factors[index]
+        return float(pms.get_discount(the_time))
+
+
+class PayoffAccumulator(object):
+    """
+    The running sums of the part, updated at each tick
+    """
+
+    def __init__(self, discount_table):
+        self.discount_table = discount_table
+        self.nb_ticks = 0
+        self.cumulative_payoff = 0.  # discounted
+        self.undiscounted_payoff = 0.
+        self.extraction_total = 0.
+        self.last_discounted_payoff = 0.
+
+    def add(self, the_time, payoff, extraction):
+        """
+        :param the_time: the time of the tick, seconds
+        :param payoff: the instant payoff (rate per second)
+        :param extraction: the extraction (rate per second)
+        :return: the discounted payoff of the tick
+        """
+        tick_duration = self.discount_table.tick_duration
+        discounted = self.discount_table.get(the_time) * payoff * \
+            tick_duration
+        self.nb_ticks += 1
+        self.cumulative_payoff += discounted
+        self.undiscounted_payoff += payoff * tick_duration
+        self.extraction_total += extraction * tick_duration
+        self.last_discounted_payoff = discounted
+        return discounted
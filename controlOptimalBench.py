@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains benchmarks of the part.
+Usage: python controlOptimalBench.py
+"""
+
+# built-in
+from __future__ import print_function
+import json
+import os
+import subprocess
+import sys
+import timeit
+from twisted.spread import banana, jelly
+
+# controlOptimal
+import controlOptimalParams as pms
+from controlOptimalPayoffCache import get_payoff_surface
+import controlOptimalWire as wire
+
+
+class _Extraction(object):
+    """
+    Same attributes and to_dict as an ExtractionsCO of a tick
+    """
+    COLUMNS = ["id", "repetitions_id", "CO_extraction", "CO_extraction_time",
+               "CO_resource", "CO_benefice", "CO_cost", "CO_payoff",
+               "CO_group_extraction"]
+
+    def __init__(self):
+        self.id = 1234
+        self.repetitions_id = 56
+        self.CO_extraction = 1.27
+        self.CO_extraction_time = 37
+        self.CO_resource = 14.163333333333334
+        self.CO_benefice = 1.7235999999999998
+        self.CO_cost = 0.7212666666666667
+        self.CO_payoff = 1.002333333333333
+        self.CO_group_extraction = 2.54
+
+    def to_dict(self):
+        return {c: getattr(self, c) for c in self.COLUMNS}
+
+
+def bench_wire(number=10000, batch=10):
+    """
+    Bytes per tick and serialization time (jelly + banana, as done by
+    Perspective Broker) of each version of the tick message
+    :param batch: number of ticks sent together with WIRE_BATCH (100 ms
+    ticks refreshed every second)
+    :return: dictionary version -> (bytes, encoding us, decoding us), per tick
+    """
+    extraction = _Extraction()
+    results = {}
+    for version in wire.SUPPORTED_VERSIONS:
+        ticks = batch if version == wire.WIRE_BATCH else 1
+
+        def encode():
+            if version == wire.WIRE_BATCH:
+                return [(wire.encode(version, extraction), 37 + 0.1 * i)
+                        for i in range(ticks)]
+            return wire.encode(version, extraction)
+
+        def decode(message):
+            if version == wire.WIRE_BATCH:
+                return [wire.decode(version, m) for m, _ in message]
+            return wire.decode(version, message)
+
+        jellied = jelly.jelly(encode())
+        size = len(banana.encode(jellied))
+        encoding = timeit.timeit(
+            lambda: banana.encode(jelly.jelly(encode())), number=number)
+        decoding = timeit.timeit(
+            lambda: decode(jelly.unjelly(jellied)), number=number)
+        results[version] = (float(size) / ticks,
+                            encoding / number / ticks * 1e6,
+                            decoding / number / ticks * 1e6)
+    return results
+
+
+def bench_payoff_cache(number=20000):
+    """
+    Time of one infinite payoff of the tick of a remote: exact formula
+    (get_infinite_payoff) and payoff cache, for an extraction of the slider
+    and for an extraction off the grid (exact formula through the cache)
+    :return: dictionary name -> microseconds per payoff
+    """
+    surface = get_payoff_surface()
+    if not surface.usable:
+        raise ValueError(u"The payoff cache is not usable with these "
+                         u"parameters")
+    # a tick in the middle of the part, the resource between two nodes
+    the_time = pms.CONTINUOUS_TIME_DURATION.total_seconds() / 2
+    resource = pms.RESOURCE_INITIAL_STOCK + pms.DECISION_STEP / 3
+    on_grid = pms.DECISION_MIN + 7 * pms.DECISION_STEP
+    off_grid = on_grid + pms.DECISION_STEP / 2
+    calls = [
+        ("exact", lambda: pms.get_infinite_payoff(the_time, resource,
+                                                  on_grid)),
+        ("cache", lambda: surface.get(the_time, resource, on_grid)),
+        ("cache off grid", lambda: surface.get(the_time, resource,
+                                               off_grid))]
+    return {name: timeit.timeit(call, number=number) / number * 1e6
+            for name, call in calls}
+
+
+# the startup of a client, run in a new interpreter: time of the imports,
+# resident memory (peak, Unix only) and whether matplotlib was imported
+_STARTUP_SCRIPT = u"""
+import json, sys, time
+start = time.time()
+import controlOptimalRemote
+if {gui}:
+    import controlOptimalGui, controlOptimalRender
+duration = time.time() - start
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        rss *= 1024  # kilobytes on Linux
+except ImportError:
+    rss = None
+print(json.dumps([duration, rss, "matplotlib" in sys.modules]))
+"""
+
+
+def bench_startup(repeat=3):
+    """
+    Import time and resident memory of a simulated client (controlOptimalRemote
+    only) and of a client with the screens (plus controlOptimalGui and
+    matplotlib). Each run is a new interpreter, with the same sys.path.
+    :param repeat: number of runs of each mode, the fastest is kept
+    :return: dictionary mode -> (import seconds, bytes or None, matplotlib
+    imported)
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in sys.path if p)
+    results = {}
+    for mode, gui in [("headless", False), ("gui", True)]:
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.check_output(
+                [sys.executable, "-c", _STARTUP_SCRIPT.format(gui=gui)],
+                env=env)
+            runs.append(json.loads(output.decode("utf-8").splitlines()[-1]))
+        results[mode] = min(runs, key=lambda r: r[0])
+    return results
+
+
+if __name__ == "__main__":
+    names = {wire.WIRE_DICT: "dict", wire.WIRE_TUPLE: "tuple",
+             wire.WIRE_BATCH: "batch"}
+    print(u"Tick message (update_data)")
+    for version, (size, encoding, decoding) in sorted(bench_wire().items()):
+        print(u"{:>6}: {:6.1f} bytes, encoding {:6.1f} us, decoding "
+              u"{:6.1f} us".format(names[version], size, encoding, decoding))
+
+    print(u"Infinite payoff of a tick")
+    for name, duration in sorted(bench_payoff_cache().items()):
+        print(u"{:>14}: {:6.2f} us".format(name, duration))
+
+    print(u"Client startup")
+    for mode, (duration, rss, matplotlib) in sorted(
+            bench_startup().items()):
+        print(u"{:>8}: import {:6.0f} ms, resident memory {}, matplotlib "
+              u"{}".format(mode, duration * 1000,
+                           u"{:.1f} MB".format(rss / 1e6) if rss else u"-",
+                           u"imported" if matplotlib else u"not imported"))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+This module packs the (x, y) points of a curve in a compact binary string,
+stored in one row of CurvePackedCO.
+
+Format (little endian): version (uint8), flags (uint8), number of points
+(uint32), then the x section and the y section.
+- raw section: the float64 values
+- run-length section (flag X_RLE or Y_RLE): number of runs (uint32), for x the
+first value (float64), then the values of the runs (float64) and their
+lengths (uint32). For x the runs are those of the differences between two
+successive values, so regular times take one run; for y they are those of
+the values, so a step curve (the extractions) takes one run per step.
+A run-length section is only used if it is shorter and gives back exactly
+the same values.
+"""
+
+# built-in
+import struct
+import numpy as np
+
+
+FORMAT_VERSION = 1
+X_RLE = 1
+Y_RLE = 2
+
+_HEADER = struct.Struct("<BBI")
+_RUNS = struct.Struct("<I")
+
+
+def _get_runs(values):
+    """
+    :return: the values of the runs and their lengths
+    """
+    if values.size == 0:
+        return values, np.zeros(0, dtype=np.uint32)
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    lengths = np.diff(np.concatenate((starts, [values.size])))
+    return values[starts], lengths.astype(np.uint32)
+
+
+def _pack_runs(first, values, lengths):
+    parts = [_RUNS.pack(values.size)]
+    if first is not None:
+        parts.append(np.array([first], dtype="<f8").tobytes())
+    parts.append(values.astype("<f8").tobytes())
+    parts.append(lengths.astype("<u4").tobytes())
+    return b"".join(parts)
+
+
+def _unpack_runs(data, offset, with_first):
+    nb_runs, = _RUNS.unpack_from(data, offset)
+    offset += _RUNS.size
+    first = None
+    if with_first:
+        first = np.frombuffer(data, dtype="<f8", count=1, offset=offset)[0]
+        offset += 8
+    values = np.frombuffer(data, dtype="<f8", count=nb_runs, offset=offset)
+    offset += 8 * nb_runs
+    lengths = np.frombuffer(data, dtype="<u4", count=nb_runs, offset=offset)
+    offset += 4 * nb_runs
+    return first, values, lengths, offset
+
+
+def _decode_x(first, deltas, lengths):
+    x = np.empty(int(lengths.sum()) + 1)
+    x[0] = first
+    np.cumsum(np.repeat(deltas, lengths), out=x[1:])
+    x[1:] += first
+    return x
+
+
+def pack_curve(x, y, rle=None):
+    """
+    :param x: the x values
+    :param y: the y values, same length
+    :param rle: None to choose the shortest encoding, False for raw values
+    :return: the binary string
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.shape != y.shape or x.ndim != 1:
+        raise ValueError(u"x and y must be 1-d arrays of the same length")
+    flags = 0
+    x_section = x.astype("<f8").tobytes()
+    y_section = y.astype("<f8").tobytes()
+
+    if rle is not False and x.size > 1:
+        deltas, lengths = _get_runs(np.diff(x))
+        if np.array_equal(_decode_x(x[0], deltas, lengths), x):
+            packed = _pack_runs(x[0], deltas, lengths)
+            if len(packed) < len(x_section):
+                flags |= X_RLE
+                x_section = packed
+    if rle is not False and y.size > 0:
+        values, lengths = _get_runs(y)
+        packed = _pack_runs(None, values, lengths)
+        if len(packed) < len(y_section):
+            flags |= Y_RLE
+            y_section = packed
+
+    return _HEADER.pack(FORMAT_VERSION, flags, x.size) + x_section + y_section
+
+
+def unpack_curve(data):
+    """
+    :param data: the binary string made by pack_curve
+    :return: x, y (numpy arrays)
+    """
+    version, flags, nb = _HEADER.unpack_from(data, 0)
+    if version != FORMAT_VERSION:
+        raise ValueError(u"Unknown curve format {}".format(version))
+    offset = _HEADER.size
+
+    if flags & X_RLE:
+        first, deltas, lengths, offset = _unpack_runs(data, offset, True)
+        x = _decode_x(first, deltas, lengths)
+    else:
+        x = np.frombuffer(data, dtype="<f8", count=nb, offset=offset)
+        offset += 8 * nb
+
+    if flags & Y_RLE:
+        _, values, lengths, offset = _unpack_runs(data, offset, False)
+        y = np.repeat(values, lengths)
+    else:
+        y = np.frombuffer(data, dtype="<f8", count=nb, offset=offset)
+
+    return np.array(x, dtype=np.float64), np.array(y, dtype=np.float64)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the write-behind queue of the server.
+The rows of the extractions and of the curves are put in a queue, and a
+worker thread inserts them in batches, with its own connection, so that the
+database never blocks the reactor (and the ticks).
+With sqlite the worker and the session of le2m (the parts and the periods,
+committed once per period) write in the same file: the database is set in
+WAL mode, the worker waits DB_BUSY_TIMEOUT for the lock and writes a batch
+again if the database is still locked.
+"""
+
+# built-in
+import logging
+import threading
+import time
+from collections import deque
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from twisted.internet import threads
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+# controlOptimal
+import controlOptimalParams as pms
+import controlOptimalMetrics as metrics
+
+
+logger = logging.getLogger("le2m")
+
+_STOP = object()
+
+
+def get_row(obj):
+    """
+    The values of the columns of an orm object, without the primary key if
+    it has not been set
+    :param obj: an orm object
+    :return: dictionary
+    """
+    row = {}
+    for c in obj.__table__.columns:
+        value = getattr(obj, c.name)
+        if c.primary_key and value is None:
+            continue
+        row[c.name] = value
+    return row
+
+
+class BatchWriter(object):
+    def __init__(self, bind, batch_size=None, flush_interval=None):
+        """
+        :param bind: the sqlalchemy engine
+        :param batch_size: max number of rows per transaction,
+        default DB_BATCH_SIZE
+        :param flush_interval: max time a row waits in the queue,
+        default DB_FLUSH_INTERVAL
+        """
+        self.bind = bind
+        self.batch_size = batch_size or pms.DB_BATCH_SIZE
+        self.flush_interval = (flush_interval or
+                               pms.DB_FLUSH_INTERVAL).total_seconds()
+        self.rows_written = 0
+        self.errors = 0
+        self.flush_latencies = deque(maxlen=100)  # seconds
+        self._queue = queue.Queue()
+        self._connection = None
+        self._thread = threading.Thread(target=self._run,
+                                        name="controlOptimal-dbwriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def last_flush_latency(self):
+        try:
+            return self.flush_latencies[-1]
+        except IndexError:
+            return None
+
+    @property
+    def mean_flush_latency(self):
+        if not self.flush_latencies:
+            return None
+        return sum(self.flush_latencies) / len(self.flush_latencies)
+
+    def add(self, table, row):
+        """
+        :param table: the sqlalchemy table
+        :param row: dictionary column -> value
+        """
+        self._queue.put((table, row))
+
+    def add_object(self, obj):
+        """
+        The values are read now, later changes of the object are not written
+        :param obj: an orm object (not added to the session)
+        """
+        self.add(obj.__table__, get_row(obj))
+
+    def flush(self):
+        """
+        :return: a deferred fired when every row added before is written
+        """
+        return threads.deferToThread(self._queue.join)
+
+    def close(self):
+        """
+        Write the remaining rows and stop the worker
+        :return: a deferred fired when the worker is stopped (the reactor
+        doesn't wait for the last flush)
+        """
+        self._queue.put(_STOP)
+        return threads.deferToThread(self._thread.join)
+
+    def get_info(self):
+        latency = self.mean_flush_latency
+        return u"DB writer: {} rows written, {} in the queue, {} errors, " \
+               u"flush latency {}".format(
+                self.rows_written, self.queue_depth, self.errors,
+                u"-" if latency is None else u"{:.1f} ms".format(
+                    latency * 1000))
+
+    def _connect(self):
+        """
+        The connection of the worker, used only by its thread
+        """
+        connection = self.bind.connect()
+        if self.bind.dialect.name == "sqlite":
+            connection.execute(text("PRAGMA busy_timeout = {:d}".format(
+                int(pms.DB_BUSY_TIMEOUT.total_seconds() * 1000))))
+            if pms.DB_SQLITE_WAL:
+                try:
+                    mode = connection.execute(
+                        text("PRAGMA journal_mode = WAL")).scalar()
+                    logger.info(u"DB writer: sqlite journal mode {}".format(
+                        mode))
+                except OperationalError as e:
+                    logger.warning(u"DB writer: WAL mode not set: {}".format(
+                        e))
+        return connection
+
+    def _run(self):
+        try:
+            self._connection = self._connect()
+        except Exception as e:
+            logger.error(u"DB writer: no connection: {}".format(e))
+            self._connection = None
+        stop = False
+        while not stop:
+            items = [self._queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(items) < self.batch_size and items[-1] is not _STOP:
+                try:
+                    items.append(self._queue.get(
+                        timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            if items[-1] is _STOP:
+                stop = True
+            rows = [i for i in items if i is not _STOP]
+            try:
+                if rows:
+                    self._write(rows)
+            except Exception as e:
+                self.errors += 1
+                logger.error(u"DB writer: {} rows lost: {}".format(
+                    len(rows), e))
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+        if self._connection is not None:
+            self._connection.close()
+
+    def _write(self, rows):
+        start = time.time()
+        tables = {}
+        for table, row in rows:
+            tables.setdefault(table, []).append(row)
+        if self._connection is None:
+            raise RuntimeError(u"no connection")
+        for attempt in range(pms.DB_WRITE_RETRIES + 1):
+            try:
+                with self._connection.begin():
+                    for table, table_rows in tables.items():
+                        self._connection.execute(table.insert(), table_rows)
+                break
+            except OperationalError as e:
+                if u"locked" not in u"{}".format(e) or \
+                        attempt == pms.DB_WRITE_RETRIES:
+                    raise
+                logger.warning(u"DB writer: database locked, attempt "
+                               u"{}".format(attempt + 1))
+                time.sleep(0.1 * 2 ** attempt)
+        self.flush_latencies.append(time.time() - start)
+        metrics.observe(metrics.DB_FLUSH, self.flush_latencies[-1])
+        self.rows_written += len(rows)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the tick engine of the server.
+The resource, extraction, benefice, cost and payoff of all the players are
+stored in numpy arrays (one element per player) and are updated in one
+vectorized step at each tick. The stock is one element per group (a group
+per player if GROUP_RESOURCE is False), the extractions are summed by group
+with the group index built at the creation of the engine. The results are
+then sent to each PartieCO, which stores them and informs its remote. The
+ticks of the continuous game are given by one FixedStepScheduler for all the
+players, so every player gets the same time.
+The engine also keeps the values of every tick, from which the curves of
+the part are built at the end (the remotes don't have to send them back).
+The ticks can be shorter than the refresh of the remotes (SIMULATION_STEP
+below TIMER_UPDATE), the players then send the ticks in between together.
+If TICK_TRACE is True, the values of every tick are also written in a
+binary trace (see controlOptimalLog), instead of being logged.
+"""
+
+# built-in
+import logging
+from datetime import datetime
+import numpy as np
+
+# controlOptimal
+import controlOptimalParams as pms
+import controlOptimalMetrics as metrics
+from controlOptimalScheduler import monotonic
+
+
+logger = logging.getLogger("le2m")
+
+
+class TickHistory(object):
+    """
+    The values of every tick, one row per tick and one column per player.
+    The arrays are allocated for the expected number of ticks and doubled
+    if needed.
+    """
+
+    def __init__(self, nb_players, capacity, tick_duration=1.):
+        self.size = 0
+        self.tick_duration = tick_duration
+        self.xdata = np.zeros(capacity)
+        self.extraction = np.zeros((capacity, nb_players))
+        self.group_extraction = np.zeros((capacity, nb_players))
+        self.resource = np.zeros((capacity, nb_players))
+        self.cost = np.zeros((capacity, nb_players))
+        self.payoff = np.zeros((capacity, nb_players))
+
+    def _grow(self):
+        for name in ["xdata", "extraction", "group_extraction", "resource",
+                     "cost", "payoff"]:
+            old = getattr(self, name)
+            new = np.zeros((2 * old.shape[0],) + old.shape[1:])
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, xdata, extraction, group_extraction, resource, cost,
+               payoff):
+        if self.size == self.xdata.shape[0]:
+            self._grow()
+        self.xdata[self.size] = xdata
+        self.extraction[self.size] = extraction
+        self.group_extraction[self.size] = group_extraction
+        self.resource[self.size] = resource
+        self.cost[self.size] = cost
+        self.payoff[self.size] = payoff
+        self.size += 1
+
+    def get_part_payoff(self):
+        """
+        The part payoff after each tick, computed as in
+        RemoteCO.remote_update_data: the cumulative discounted payoff plus
+        the infinite payoff (only for the continuous dynamic). With a shared
+        stock, the extraction of the others is taken out of the growth.
+        :return: array (ticks, players)
+        """
+        if pms.DYNAMIC_TYPE != pms.CONTINUOUS:
+            return np.zeros((self.size, self.payoff.shape[1]))
+        xdata = self.xdata[:self.size, np.newaxis]
+        cumulative = np.cumsum(
+            pms.get_discount(xdata) * self.payoff[:self.size] *
+            self.tick_duration, axis=0)
+        extraction = self.extraction[:self.size]
+        others = self.group_extraction[:self.size] - extraction
+        return cumulative + pms.get_infinite_payoff_array(
+            xdata, self.resource[:self.size], extraction,
+            RESOURCE_GROWTH=pms.RESOURCE_GROWTH - others)
+
+
+class TickEngine(object):
+    def __init__(self, players):
+        """
+        :param players: the PartieCO of the part, each one receives its index
+        in the arrays
+        """
+        self.players = list(players)
+        for index, player in enumerate(self.players):
+            player.engine = self
+            player.engine_index = index
+
+        nb = len(self.players)
+        if pms.GROUP_RESOURCE:
+            groups = [u"{}".format(p.CO_group) for p in self.players]
+            self.group_index = np.unique(groups, return_inverse=True)[1]
+        else:
+            self.group_index = np.arange(nb)
+        self.group_index = self.group_index.astype(np.intp)
+        self.nb_groups = int(self.group_index.max()) + 1 if nb else 0
+        self.group_resource = np.full(self.nb_groups,
+                                      pms.RESOURCE_INITIAL_STOCK,
+                                      dtype=np.float64)
+        self.group_extraction = np.zeros(self.nb_groups)
+        # the stock of the group of each player
+        self.resource = self.group_resource[self.group_index]
+        self.extraction = np.zeros(nb)
+        self.benefice = np.zeros(nb)
+        self.cost = np.zeros(nb)
+        self.payoff = np.zeros(nb)
+
+        self.tick_duration = pms.get_tick_duration()
+        if pms.DYNAMIC_TYPE == pms.CONTINUOUS:
+            nb_ticks = int(pms.CONTINUOUS_TIME_DURATION.total_seconds() /
+                           self.tick_duration)
+            self.ticks_per_push = max(1, int(round(
+                pms.TIMER_UPDATE.total_seconds() / self.tick_duration)))
+        else:
+            nb_ticks = pms.NOMBRE_PERIODES
+            self.ticks_per_push = 1
+        # + the initial update and a possible last tick
+        self.history = TickHistory(nb, nb_ticks + 3, self.tick_duration)
+        self.part_payoff = None
+        self.trace = None  # TickTrace, set by the server
+        self.period = 0
+        self.ticks_since_push = 0
+
+        self.time_start = None
+
+    def set_extraction(self, index, extraction):
+        self.extraction[index] = extraction
+
+    def new_period(self, period):
+        self.period = period
+
+    def get_xdata(self, the_time):
+        """
+        The abscissa of the curves, as in RemoteCO.remote_update_data
+        """
+        if self.period == 0:
+            return 0
+        if pms.DYNAMIC_TYPE == pms.DISCRETE:
+            return self.period
+        return the_time
+
+    def get_curves(self, index):
+        """
+        The curves of a player, from the values of every tick
+        :param index: the index of the player
+        :return: dictionary curve type -> (xdata, ydata)
+        """
+        history = self.history
+        if self.part_payoff is None or \
+                self.part_payoff.shape[0] != history.size:
+            self.part_payoff = history.get_part_payoff()
+        xdata = history.xdata[:history.size]
+        return {
+            pms.EXTRACTION: (xdata, history.extraction[:history.size, index]),
+            pms.PAYOFF: (xdata, self.part_payoff[:, index]),
+            pms.RESOURCE: (xdata, history.resource[:history.size, index]),
+            pms.COST: (xdata, history.cost[:history.size, index])}
+
+    def update_data(self, the_time=None):
+        """
+        One tick: compute the payoffs and the new resource of every player,
+        then send them to the players
+        :param the_time: the time of the tick, given by the scheduler in the
+        continuous game, otherwise the time since time_start. The remotes
+        are informed every ticks_per_push ticks of the scheduler, and at
+        every other tick.
+        """
+        start = monotonic() if pms.METRICS_ENABLED else None
+        push = the_time is None
+        if the_time is None:
+            # after the initial extraction but before the game starts
+            # self.time_start is None
+            try:
+                the_time = int(
+                    (datetime.now() - self.time_start).total_seconds())
+            except TypeError:
+                the_time = 0
+
+        # ----------------------------------------------------------------------
+        # check extraction
+        # ----------------------------------------------------------------------
+        # if extraction of the group > resource => new extraction of 0 for
+        # the members of the group who extract
+        over = self.get_group_extraction() * self.tick_duration > \
+            self.group_resource
+        if over.any():
+            for index in np.flatnonzero(
+                    over[self.group_index] & (self.extraction > 0)):
+                self.players[index].new_extraction(0, the_time)
+            self.get_group_extraction()
+
+        # ----------------------------------------------------------------------
+        # compute payoff and the new available resource
+        # the payoff, the extraction and the growth are rates per second
+        # ----------------------------------------------------------------------
+        self.benefice, self.cost, self.payoff = pms.get_instant_payoff(
+            self.resource, self.extraction)
+        self.group_resource -= self.group_extraction * self.tick_duration
+        self.group_resource += pms.RESOURCE_GROWTH * self.tick_duration
+        self.resource = self.group_resource[self.group_index]
+        group_extraction = self.group_extraction[self.group_index]
+        self.history.append(self.get_xdata(the_time), self.extraction,
+                            group_extraction, self.resource, self.cost,
+                            self.payoff)
+        if self.trace is not None:
+            self.trace.write(the_time, self.extraction, group_extraction,
+                             self.resource, self.cost, self.payoff)
+
+        # ----------------------------------------------------------------------
+        # update the players (python floats for the database and the remotes)
+        # ----------------------------------------------------------------------
+        for player, benefice, cost, payoff, resource, group_extraction in zip(
+                self.players, self.benefice.tolist(), self.cost.tolist(),
+                self.payoff.tolist(), self.resource.tolist(),
+                group_extraction.tolist()):
+            player.update_data(the_time, benefice, cost, payoff, resource,
+                               group_extraction)
+        self.ticks_since_push += 1
+        if push or self.ticks_since_push >= self.ticks_per_push:
+            self.send_updates()
+        if start is not None:
+            metrics.observe(metrics.TICK_DURATION, monotonic() - start)
+
+    def get_group_extraction(self):
+        """
+        :return: the sum of the extractions of each group
+        """
+        self.group_extraction = np.bincount(
+            self.group_index, weights=self.extraction,
+            minlength=self.nb_groups)
+        return self.group_extraction
+
+    def send_updates(self):
+        """
+        Send to the remotes the ticks they don't have yet
+        """
+        for player in self.players:
+            player.send_updates()
+        self.ticks_since_push = 0
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+This module exports the data of the parts for the analysis: one file per
+table (parts, repetitions, extractions, curves), each row with the keys of
+its part (the columns of PartieCO and of the le2m parts table, among them
+the player and the sequence).
+The rows are read from the database and written by chunks of chunk_size
+rows, so the memory used doesn't depend on the number of extractions and
+points. The keys of the parts (one row per part or repetition) are read
+once and joined to the chunks with numpy / arrow, instead of being read
+again for every row.
+The files are parquet or arrow (IPC file) if pyarrow is installed,
+otherwise csv. The packed curves are unpacked, one row per point.
+
+Usage: python controlOptimalExport.py le2m.sqlite output_directory
+[--format parquet|arrow|csv] [--chunk-size 50000]
+"""
+
+# built-in
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+import numpy as np
+import sqlalchemy
+from sqlalchemy import Boolean, DateTime, Float, Integer, create_engine, \
+    select
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# le2m
+from server.servparties import Partie
+
+# controlOptimal
+from controlOptimalPart import PartieCO, RepetitionsCO, ExtractionsCO, \
+    CurveCO, CurvePackedCO
+from controlOptimalCurves import unpack_curve
+
+
+logger = logging.getLogger("le2m")
+
+CHUNK_SIZE = 50000
+FORMATS = ["parquet", "arrow", "csv"]
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+_LEGACY_SELECT = sqlalchemy.__version__.split(".")[:2] < ["1", "4"]
+
+
+def _select(columns):
+    if _LEGACY_SELECT:
+        return select(columns)
+    return select(*columns)
+
+
+def _arrow_type(column_type):
+    if isinstance(column_type, Boolean):
+        return pa.bool_()
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, Float):
+        return pa.float64()
+    if isinstance(column_type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+# ==============================================================================
+# WRITERS
+# ==============================================================================
+
+
+class ChunkWriter(object):
+    """
+    Writes the chunks of a table in a temporary file, renamed at the end
+    """
+
+    def __init__(self, path, columns):
+        """
+        :param columns: list of (name, sqlalchemy type)
+        """
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.names = [name for name, _ in columns]
+        self.nb_rows = 0
+
+    def take(self, index, values, positions):
+        """
+        :param index: the index of the column
+        :param values: the values of a key column, one per part or repetition
+        :param positions: array, the position of the key of each row
+        :return: the column of the rows
+        """
+        return [values[p] for p in positions.tolist()]
+
+    def write(self, columns):
+        """
+        :param columns: list of columns (sequences, numpy arrays or the
+        results of take) of the same length
+        """
+        self._write(columns)
+        self.nb_rows += len(columns[0])
+
+    def close(self):
+        self._close()
+        os.rename(self.tmp_path, self.path)
+
+
+class ArrowWriter(ChunkWriter):
+    def __init__(self, path, columns, file_format="parquet"):
+        ChunkWriter.__init__(self, path, columns)
+        self.schema = pa.schema([pa.field(name, _arrow_type(column_type))
+                                 for name, column_type in columns])
+        self.sink = None
+        if file_format == "parquet":
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+        else:
+            self.sink = pa.OSFile(self.tmp_path, "wb")
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+
+    def take(self, index, values, positions):
+        return pa.array(values, type=self.schema[index].type).take(
+            pa.array(positions))
+
+    def _write(self, columns):
+        self.writer.write_table(pa.Table.from_arrays(
+            [values if isinstance(values, pa.Array) else
+             pa.array(values, type=field.type)
+             for values, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def _close(self):
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+
+
+class CsvWriter(ChunkWriter):
+    """
+    The csv module of python 2 writes bytes: the text is encoded in utf-8
+    """
+
+    def __init__(self, path, columns):
+        ChunkWriter.__init__(self, path, columns)
+        self.encode = sys.version_info[0] < 3
+        if self.encode:
+            self.file = open(self.tmp_path, "wb")
+        else:
+            self.file = open(self.tmp_path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self._encode_row(self.names))
+
+    def _encode_row(self, row):
+        if not self.encode:
+            return row
+        return [v.encode("utf-8") if isinstance(v, type(u"")) else v
+                for v in row]
+
+    def _write(self, columns):
+        rows = zip(*[
+            c.tolist() if isinstance(c, np.ndarray) else c for c in columns])
+        if self.encode:
+            rows = (self._encode_row(row) for row in rows)
+        self.writer.writerows(rows)
+
+    def _close(self):
+        self.file.close()
+
+
+def create_writer(path, columns, file_format):
+    if file_format == "csv":
+        return CsvWriter(path, columns)
+    return ArrowWriter(path, columns, file_format)
+
+
+# ==============================================================================
+# QUERIES
+# ==============================================================================
+
+
+def _get_part_columns():
+    """
+    The keys of a part: the columns of PartieCO (partie_id first) and the
+    columns of the le2m parts table (player, session...), prefixed with
+    partie_
+    """
+    columns = [c.label(c.name) for c in PartieCO.__table__.columns]
+    columns += [c.label(u"partie_{}".format(c.name))
+                for c in Partie.__table__.columns if c.name != "id"]
+    return columns
+
+
+def _get_repetition_columns():
+    """
+    The keys of a repetition (repetitions_id first) and of its part
+    """
+    repetitions = RepetitionsCO.__table__
+    return [repetitions.c.id.label("repetitions_id")] + [
+        c.label(c.name) for c in repetitions.columns
+        if c.name not in ("id", "partie_partie_id")] + _get_part_columns()
+
+
+def get_key_queries():
+    """
+    The parts and the repetitions, with the keys of their part
+    :return: dictionary table name -> (columns, select)
+    """
+    part, base = PartieCO.__table__, Partie.__table__
+    repetitions = RepetitionsCO.__table__
+    parts = part.join(base, part.c.partie_id == base.c.id)
+    queries = OrderedDict()
+    columns = _get_part_columns()
+    queries["parts"] = columns, _select(columns).select_from(parts).order_by(
+        part.c.partie_id)
+    columns = _get_repetition_columns()
+    queries["repetitions"] = columns, _select(columns).select_from(
+        repetitions.join(parts, repetitions.c.partie_partie_id ==
+                         part.c.partie_id)).order_by(repetitions.c.id)
+    return queries
+
+
+class Keys(object):
+    """
+    The rows of a key query, in memory (one row per part or repetition),
+    joined to the chunks of the large tables by their id (first column)
+    """
+
+    def __init__(self, connection, columns, query):
+        rows = connection.execute(query).fetchall()
+        self.columns = list(zip(*rows)) if rows else [()] * len(columns)
+        ids = np.array(self.columns[0], dtype=np.int64)
+        self.order = np.argsort(ids, kind="mergesort")
+        self.sorted_ids = ids[self.order]
+
+    def get_positions(self, ids):
+        """
+        :param ids: array, the keys of the rows of a chunk
+        :return: the positions of the keys, mask of the rows that have one
+        (as an inner join)
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        index = np.minimum(np.searchsorted(self.sorted_ids, ids),
+                           max(self.sorted_ids.size - 1, 0))
+        if not self.sorted_ids.size:
+            return index, np.zeros(ids.shape, dtype=bool)
+        return self.order[index], self.sorted_ids[index] == ids
+
+
+# ==============================================================================
+# EXPORT
+# ==============================================================================
+
+
+def _execute(connection, query):
+    return connection.execution_options(stream_results=True).execute(query)
+
+
+def _write_with_keys(writer, columns, ids, keys):
+    """
+    :param columns: the columns of the chunk
+    :param ids: the key of each row
+    :param keys: Keys, its columns are added after the columns of the chunk
+    """
+    positions, found = keys.get_positions(ids)
+    if not found.all():
+        columns = [np.asarray(c, dtype=object)[found] for c in columns]
+        positions = positions[found]
+    nb = len(columns)
+    writer.write(list(columns) + [
+        writer.take(nb + i, values, positions)
+        for i, values in enumerate(keys.columns)])
+
+
+def _get_extraction_columns():
+    """
+    The columns of ExtractionsCO, without repetitions_id (the first column of
+    the keys)
+    """
+    return [c for c in ExtractionsCO.__table__.columns
+            if c.name != "repetitions_id"]
+
+
+def _export_extractions(connection, writer, keys, chunk_size):
+    extractions = ExtractionsCO.__table__
+    result = _execute(connection, _select(
+        [extractions.c.repetitions_id] + _get_extraction_columns()).order_by(
+        extractions.c.id))
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        _write_with_keys(writer, columns[1:], columns[0], keys)
+    result.close()
+
+
+def _export_curves(connection, writer, keys, chunk_size):
+    """
+    The packed curves, one row per point, then the points of CurveCO of the
+    curves that are not packed (parts played before the packing)
+    """
+    packed, points = CurvePackedCO.__table__, CurveCO.__table__
+    packed_curves = set()
+    chunk = []
+    size = 0
+
+    def write_chunk():
+        lengths = [len(x) for _, _, x, _ in chunk]
+        _write_with_keys(writer, [
+            np.repeat([t for _, t, _, _ in chunk], lengths).astype(np.int64),
+            np.concatenate([x for _, _, x, _ in chunk]),
+            np.concatenate([y for _, _, _, y in chunk])],
+            np.repeat([p for p, _, _, _ in chunk], lengths), keys)
+
+    result = _execute(connection, _select(
+        [packed.c.partie_id, packed.c.CO_curve_type,
+         packed.c.CO_curve_data]).order_by(packed.c.id))
+    for partie_id, curve_type, data in result:
+        x, y = unpack_curve(data)
+        packed_curves.add((partie_id, curve_type))
+        chunk.append((partie_id, curve_type, x, y))
+        size += len(x)
+        if size >= chunk_size:
+            write_chunk()
+            chunk, size = [], 0
+    result.close()
+    if chunk:
+        write_chunk()
+
+    result = _execute(connection, _select(
+        [points.c.partie_id, points.c.CO_curve_type, points.c.CO_curve_x,
+         points.c.CO_curve_y]).order_by(points.c.id))
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        rows = [r for r in rows if (r[0], r[1]) not in packed_curves]
+        if rows:
+            columns = list(zip(*rows))
+            _write_with_keys(writer, columns[1:], columns[0], keys)
+    result.close()
+
+
+def export(engine, directory, file_format=None, chunk_size=CHUNK_SIZE):
+    """
+    Export the tables of the parts, one file per table in directory
+    :param engine: sqlalchemy engine of the le2m database
+    :param file_format: parquet, arrow or csv, default parquet if pyarrow is
+    installed, otherwise csv
+    :param chunk_size: number of rows read and written at once
+    :return: dictionary table name -> (path, number of rows)
+    """
+    if file_format is None:
+        file_format = "parquet" if pa is not None else "csv"
+    if file_format not in FORMATS:
+        raise ValueError(u"Unknown format {}".format(file_format))
+    if file_format != "csv" and pa is None:
+        raise ValueError(u"pyarrow is needed for {}".format(file_format))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    def get_writer(name, columns):
+        """
+        :param columns: list of (name, sqlalchemy type)
+        """
+        return create_writer(
+            os.path.join(directory, u"controlOptimal_{}{}".format(
+                name, EXTENSIONS[file_format])), columns, file_format)
+
+    def get_types(columns):
+        return [(c.name, c.type) for c in columns]
+
+    files = OrderedDict()
+    keys = {}
+    connection = engine.connect()
+    try:
+        # __ parts and repetitions: also the keys of the other tables __
+        for name, (columns, query) in get_key_queries().items():
+            keys[name] = Keys(connection, columns, query)
+            writer = get_writer(name, get_types(columns))
+            if keys[name].columns[0]:
+                writer.write(keys[name].columns)
+            writer.close()
+            files[name] = writer.path, writer.nb_rows
+
+        start = time.time()
+        writer = get_writer("extractions", get_types(
+            _get_extraction_columns() + _get_repetition_columns()))
+        _export_extractions(connection, writer, keys["repetitions"],
+                            chunk_size)
+        writer.close()
+        files["extractions"] = writer.path, writer.nb_rows
+        logger.info(u"Export extractions: {} rows in {:.1f} s".format(
+            writer.nb_rows, time.time() - start))
+
+        start = time.time()
+        writer = get_writer("curves", [
+            ("CO_curve_type", Integer()), ("CO_curve_x", Float()),
+            ("CO_curve_y", Float())] + get_types(_get_part_columns()))
+        _export_curves(connection, writer, keys["parts"], chunk_size)
+        writer.close()
+        files["curves"] = writer.path, writer.nb_rows
+        logger.info(u"Export curves: {} points in {:.1f} s".format(
+            writer.nb_rows, time.time() - start))
+    finally:
+        connection.close()
+    return files
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=u"Export of the parts")
+    parser.add_argument("database",
+                        help=u"sqlite file or sqlalchemy url of le2m")
+    parser.add_argument("directory", help=u"output directory")
+    parser.add_argument("--format", choices=FORMATS, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    url = args.database if "://" in args.database else \
+        "sqlite:///{}".format(args.database)
+    for name, (path, nb_rows) in export(
+            create_engine(url), args.directory, args.format,
+            args.chunk_size).items():
+        print(u"{}: {} rows, {}".format(name, nb_rows, path))
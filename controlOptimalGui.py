@@ -15,10 +15,7 @@ import sys
 import logging
 from PyQt4.QtGui import *
 from PyQt4.QtCore import Qt, QTimer, QTime
-import random
 from datetime import timedelta
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
-import matplotlib.pyplot as plt
 import numpy as np
 from twisted.internet.defer import AlreadyCalledError
 
@@ -31,6 +28,7 @@ from client.cltgui.cltguiwidgets import (WExplication, WCompterebours)
 import controlOptimalParams as pms
 from controlOptimalTexts import trans_CO
 import controlOptimalTexts as texts_CO
+from controlOptimalRender import PlotRenderer
 
 logger = logging.getLogger("le2m")
 
@@ -82,13 +80,16 @@ class MySlider(QWidget):
     def value(self):
         return self.slider.value() / int(1 / pms.DECISION_STEP)
 
+    def setValue(self, value):
+        self.slider.setValue(int(round(value * int(1 / pms.DECISION_STEP))))
+
 
 class PlotExtraction(QWidget):
     """
     This widget plot the individual extractions
     """
 
-    def __init__(self, extractions):
+    def __init__(self, extractions, figure_pool):
         QWidget.__init__(self)
 
         self.extractions = extractions
@@ -96,8 +97,7 @@ class PlotExtraction(QWidget):
         layout = QVBoxLayout()
         self.setLayout(layout)
 
-        self.fig = plt.figure()
-        self.canvas = FigureCanvas(self.fig)
+        self.fig, self.canvas = figure_pool.get("extraction")
         layout.addWidget(self.canvas)
 
         self.graph = self.fig.add_subplot(111,
@@ -119,10 +119,10 @@ class PlotExtraction(QWidget):
             curve_marker = ""
 
         # curves
-        if self.extractions.curve is None:
-            self.extractions.curve, = self.graph.plot(
-                self.extractions.xdata, self.extractions.ydata,
-                "-k", marker=curve_marker)
+        # the figure comes cleared from the pool, a previous curve is gone
+        self.extractions.curve, = self.graph.plot(
+            self.extractions.xdata, self.extractions.ydata,
+            "-k", marker=curve_marker)
 
         self.graph.set_ylim(-0.1, pms.DECISION_MAX+0.1)
         self.graph.set_yticks(np.arange(0, pms.DECISION_MAX + 0.1, 0.2))
@@ -138,7 +138,7 @@ class PlotResource(QWidget):
     the stock of resource
     """
 
-    def __init__(self, resource):
+    def __init__(self, resource, figure_pool):
         QWidget.__init__(self)
 
         self.resource = resource
@@ -146,8 +146,7 @@ class PlotResource(QWidget):
         layout = QVBoxLayout()
         self.setLayout(layout)
 
-        self.fig = plt.figure()
-        self.canvas = FigureCanvas(self.fig)
+        self.fig, self.canvas = figure_pool.get("resource")
         layout.addWidget(self.canvas)
 
         self.graph = self.fig.add_subplot(111,
@@ -168,10 +167,10 @@ class PlotResource(QWidget):
             self.graph.set_xlabel(trans_CO(u"Time (seconds)"))
             curve_marker = ""
 
-        if self.resource.curve is None:
-            self.resource.curve, = self.graph.plot(
-                self.resource.xdata, self.resource.ydata,
-                "-k", marker=curve_marker)
+        # the figure comes cleared from the pool, a previous curve is gone
+        self.resource.curve, = self.graph.plot(
+            self.resource.xdata, self.resource.ydata,
+            "-k", marker=curve_marker)
 
         self.graph.set_ylim(0, pms.RESOURCE_INITIAL_STOCK * 3)
         self.graph.set_yticks(range(0, pms.RESOURCE_INITIAL_STOCK * 3 + 1, 5))
@@ -182,7 +181,7 @@ class PlotResource(QWidget):
 
 
 class PlotPayoff(QWidget):
-    def __init__(self, payoffs):
+    def __init__(self, payoffs, figure_pool):
         super(PlotPayoff, self).__init__()
 
         self.payoffs = payoffs
@@ -190,8 +189,7 @@ class PlotPayoff(QWidget):
         layout = QVBoxLayout()
         self.setLayout(layout)
 
-        self.fig = plt.figure()
-        self.canvas = FigureCanvas(self.fig)
+        self.fig, self.canvas = figure_pool.get("payoff")
         layout.addWidget(self.canvas)
 
         self.graph = self.fig.add_subplot(111,
@@ -212,10 +210,10 @@ class PlotPayoff(QWidget):
             self.graph.set_xlabel(trans_CO(u"Time (seconds)"))
             curve_marker = ""
 
-        if self.payoffs.curve is None:
-            self.payoffs.curve, = self.graph.plot(
-                self.payoffs.xdata, self.payoffs.ydata,
-                "-k", marker=curve_marker)
+        # the figure comes cleared from the pool, a previous curve is gone
+        self.payoffs.curve, = self.graph.plot(
+            self.payoffs.xdata, self.payoffs.ydata,
+            "-k", marker=curve_marker)
 
         self.graph.set_ylim(0, 250)
         self.graph.set_yticks(range(0, 271, 20))
@@ -256,9 +254,7 @@ class GuiInitialExtraction(QDialog):
         self.setFixedSize(self.size())
 
         if self.remote.le2mclt.automatique:
-            self.slider_area.slider.setValue(random.randint(
-                pms.DECISION_MIN,
-                pms.DECISION_MAX * int(1 / pms.DECISION_STEP)))
+            self.slider_area.setValue(self.remote.get_simulated_extraction())
             self.timer_automatique = QTimer()
             self.timer_automatique.timeout.connect(
                 buttons.button(QDialogButtonBox.Ok).click)
@@ -331,25 +327,36 @@ class GuiDecision(QDialog):
         self.plot_layout = QGridLayout()
         layout.addLayout(self.plot_layout)
         # extraction
-        self.plot_extraction = PlotExtraction(self.remote.extractions)
+        self.plot_extraction = PlotExtraction(self.remote.extractions,
+                                              self.remote.figure_pool)
         self.plot_layout.addWidget(self.plot_extraction, 0, 0)
         # part payoff
         self.plot_payoff = PlotPayoff(
-            self.remote.payoff_part)
+            self.remote.payoff_part, self.remote.figure_pool)
         self.plot_layout.addWidget(self.plot_payoff, 0, 1)
         # available resource
-        self.plot_resource = PlotResource(self.remote.resource)
+        self.plot_resource = PlotResource(self.remote.resource,
+                                          self.remote.figure_pool)
         self.plot_layout.addWidget(self.plot_resource, 1, 0)
         # value in text mode
         widget_infos = QWidget()
         widget_infos.setLayout(QVBoxLayout())
         self.textEdit_infos = QTextEdit()
         self.textEdit_infos.setReadOnly(True)
-        self.textEdit_infos.setHtml(self.remote.text_infos)
+        self.text_infos_shown = 0  # text_infos_count of the last display
+        self.insert_text_infos()
         widget_infos.layout().addWidget(self.textEdit_infos)
         self.plot_layout.addWidget(widget_infos, 1, 1)
         self.plot_layout.setColumnStretch(0, 1)
         self.plot_layout.setColumnStretch(1, 1)
+        # only the curves are drawn at each refresh
+        self.renderer = PlotRenderer(self, [
+            (self.plot_extraction.canvas, self.plot_extraction.graph,
+             self.remote.extractions),
+            (self.plot_resource.canvas, self.plot_resource.graph,
+             self.remote.resource),
+            (self.plot_payoff.canvas, self.plot_payoff.graph,
+             self.remote.payoff_part)])
 
         # ----------------------------------------------------------------------
         # DECISION AREA
@@ -374,12 +381,10 @@ class GuiDecision(QDialog):
             self.timer_continuous = QTimer()
             self.timer_continuous.timeout.connect(self.update_data_and_graphs)
             self.timer_continuous.start(
-                int(pms.TIMER_UPDATE.total_seconds()) * 1000)
+                int(pms.TIMER_UPDATE.total_seconds() * 1000))
 
         if pms.DYNAMIC_TYPE == pms.DISCRETE and self.remote.le2mclt.automatique:
-            self.extract_dec.slider.setValue(random.randint(
-                pms.DECISION_MIN,
-                pms.DECISION_MAX * int(1 / pms.DECISION_STEP)))
+            self.extract_dec.setValue(self.remote.get_simulated_extraction())
 
         self.remote.end_of_time.connect(self.end_of_time)
 
@@ -390,35 +395,59 @@ class GuiDecision(QDialog):
         dec = self.extract_dec.value()
         logger.info("{} send {}".format(self.remote.le2mclt, dec))
         if pms.DYNAMIC_TYPE == pms.CONTINUOUS:
-            self.remote.server_part.callRemote("new_extraction", dec)
+            self.remote.send_extraction(dec)
         elif pms.DYNAMIC_TYPE == pms.DISCRETE:
             self.defered.callback(dec)
 
     def update_data_and_graphs(self):
-        if self.remote.le2mclt.automatique:
-            if pms.DYNAMIC_TYPE == pms.CONTINUOUS:
-                if random.random() < 0.33:
-                    self.extract_dec.slider.setValue(random.randint(
-                        pms.DECISION_MIN,
-                        pms.DECISION_MAX * int(1 / pms.DECISION_STEP)))
-            elif pms.DYNAMIC_TYPE == pms.DISCRETE:
-                self.extract_dec.slider.setValue(random.randint(
-                    pms.DECISION_MIN,
-                    pms.DECISION_MAX * int(1 / pms.DECISION_STEP)))
-        self.plot_extraction.canvas.draw()
-        self.plot_resource.canvas.draw()
-        self.plot_payoff.canvas.draw()
-        self.textEdit_infos.setHtml(self.remote.text_infos)
+        # continuous automatique: the slider is moved by the remote
+        if self.remote.le2mclt.automatique and \
+                pms.DYNAMIC_TYPE == pms.DISCRETE:
+            self.extract_dec.setValue(self.remote.get_simulated_extraction())
+        self.renderer.render()
+        self.insert_text_infos()
         if pms.DYNAMIC_TYPE == pms.DISCRETE:
             self.label_period.setText(le2mtrans(u"Period") + u" {}".format(
                 self.remote.currentperiod))
             self.compte_rebours.restart()
 
+    def insert_text_infos(self):
+        """
+        Insert the new entries of the text history at the top, one block per
+        entry, and remove the oldest blocks beyond TEXT_INFOS_SIZE, so that
+        the cost doesn't depend on the length of the history
+        """
+        text_infos = self.remote.text_infos
+        nb_new = min(self.remote.text_infos_count - self.text_infos_shown,
+                     len(text_infos))
+        self.text_infos_shown = self.remote.text_infos_count
+        if nb_new <= 0:
+            return
+        document = self.textEdit_infos.document()
+        cursor = QTextCursor(document)
+        cursor.beginEditBlock()
+        # the oldest new entry first, each one is inserted on top
+        for i in range(nb_new - 1, -1, -1):
+            cursor.movePosition(QTextCursor.Start)
+            if not document.isEmpty():
+                cursor.insertBlock()
+                cursor.movePosition(QTextCursor.Start)
+            cursor.insertHtml(text_infos[i])
+        for _ in range(document.blockCount() - text_infos.maxlen):
+            cursor.movePosition(QTextCursor.End)
+            cursor.select(QTextCursor.BlockUnderCursor)
+            cursor.removeSelectedText()
+        cursor.endEditBlock()
+
     def end_of_time(self):
         try:
             self.timer_continuous.stop()
         except AttributeError:  # if dynamic == discrete
             pass
+        logger.info(u"{} {}".format(self.remote.le2mclt,
+                                    self.renderer.get_report()))
+        # the figures are used next by the summary screen
+        self.renderer.close()
         if pms.DYNAMIC_TYPE == pms.CONTINUOUS:
             try:
                 self.defered.callback(None)
@@ -447,16 +476,18 @@ class GuiSummary(QDialog):
         layout.addLayout(self.plot_layout)
 
         # extractions (indiv + group)
-        self.plot_extraction = PlotExtraction(self.remote.extractions)
+        self.plot_extraction = PlotExtraction(self.remote.extractions,
+                                              self.remote.figure_pool)
         self.plot_layout.addWidget(self.plot_extraction, 0, 0)
 
         # payoff indiv
         self.plot_payoff = PlotPayoff(
-            self.remote.payoff_part)
+            self.remote.payoff_part, self.remote.figure_pool)
         self.plot_layout.addWidget(self.plot_payoff, 0, 1)
 
         # resource
-        self.plot_resource = PlotResource(self.remote.resource)
+        self.plot_resource = PlotResource(self.remote.resource,
+                                          self.remote.figure_pool)
         self.plot_layout.addWidget(self.plot_resource, 1, 0)
 
         # value in text mode
@@ -493,18 +524,13 @@ class GuiSummary(QDialog):
             self.timer_automatique.stop()
         except AttributeError:
             pass
-        # ----------------------------------------------------------------------
-        # we send back the different individual curves
-        # ----------------------------------------------------------------------
-        data_indiv = {
-            "extractions": zip(self.remote.extractions.xdata, self.remote.extractions.ydata),
-            "payoffs": zip(self.remote.payoff_part.xdata, np.array(self.remote.payoff_part.ydata).tolist()),
-            "cost": zip(self.remote.cost.xdata, self.remote.cost.ydata),
-            "resource": zip(self.remote.resource.xdata, self.remote.resource.ydata)
-        }
-        logger.debug("{} send curves".format(self.remote.le2mclt))
-        self.defered.callback(data_indiv)
+        # the server builds the curves, we only acknowledge the summary
+        logger.debug("{} summary ok".format(self.remote.le2mclt))
+        self.defered.callback(None)
         self.accept()
+        # end of the part
+        self.remote.release_figures()
+        self.deleteLater()
 
     def reject(self):
         pass
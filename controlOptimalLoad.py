@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains a load generator: NB simulated clients in one process,
+on one Twisted reactor, without Qt widget nor Qt event loop. Each client
+connects to the server over TCP as a le2m client in simulation mode, and
+its RemoteCO decides with its own random stream. The streams are seeded from
+the seed of the load, so the decisions of each client are the same from one
+run to the other (the times of the messages still depend on the machine).
+
+The handshake (connexion, load_remote) is written after the le2m client,
+it is not the le2m client itself: the messages it does not implement are
+counted and reported, and --strict makes them fail instead of being
+acknowledged. RemoteCO imports PyQt4.QtCore, so PyQt4 has to be installed
+(no QApplication is created).
+
+Usage: python controlOptimalLoad.py 300 --port 8000 --seed 42
+"""
+
+# built-in
+from __future__ import print_function
+import argparse
+import logging
+from collections import Counter
+from twisted.internet import defer, reactor, task
+from twisted.spread import pb
+import numpy as np
+
+# controlOptimal
+from controlOptimalRemote import RemoteCO
+
+
+logger = logging.getLogger("le2m")
+
+
+class LoadClient(pb.Referenceable):
+    """
+    A le2m client in simulation mode, without screen. It creates the
+    RemoteCO of the part, and acknowledges with None the messages it does not
+    implement (screens of the other parts of the session), as a simulated
+    client does, unless it is strict.
+    """
+
+    def __init__(self, number, seed, strict=False):
+        """
+        :param number: the number of the client in the load
+        :param seed: the seed of the random stream of its remote
+        :param strict: if True the messages not implemented raise an error
+        on the server instead of being acknowledged
+        """
+        self.uid = u"load{:04d}".format(number)
+        self.seed = seed
+        self.simulation = True
+        self.automatique = False
+        self.screen = None
+        self.server = None
+        self.remotes = {}
+        self.strict = strict
+        self.messages = Counter()
+        self.ignored = Counter()
+
+    def __str__(self):
+        return self.uid
+
+    def connect(self, host, port):
+        """
+        :return: deferred, fired when the client is registered by the server
+        """
+        factory = pb.PBClientFactory()
+        reactor.connectTCP(host, port, factory)
+        defered = factory.getRootObject()
+        defered.addCallback(self._register)
+        return defered
+
+    def _register(self, server):
+        self.server = server
+        return server.callRemote("connexion", self)
+
+    def remoteMessageReceived(self, broker, message, args, kw):
+        name = message.decode("utf-8") if isinstance(message, bytes) \
+            else message
+        self.messages[name] += 1
+        if getattr(self, "remote_" + name, None) is None and \
+                not self.strict:
+            if not self.ignored[name]:
+                logger.warning(u"{} ignores {}".format(self, name))
+            self.ignored[name] += 1
+            return broker.serialize(None, self.perspective)
+        return pb.Referenceable.remoteMessageReceived(
+            self, broker, message, args, kw)
+
+    def remote_load_remote(self, remote_class, part_name):
+        """
+        :return: the remote of the part, only controlOptimal is played
+        """
+        if remote_class != RemoteCO.__name__:
+            logger.warning(u"{} has no remote {} for {}".format(
+                self, remote_class, part_name))
+            return None
+        self.remotes[part_name] = RemoteCO(self)
+        return self.remotes[part_name]
+
+
+class LoadGenerator(object):
+    def __init__(self, nb_clients, seed=None, host="127.0.0.1", port=8000,
+                 interval=0.01, strict=False):
+        """
+        :param nb_clients: the number of simulated clients
+        :param seed: the seed of the load, from which the seeds of the
+        clients are drawn
+        :param interval: seconds between the connections of two clients
+        :param strict: see LoadClient
+        """
+        self.host = host
+        self.port = port
+        self.interval = interval
+        seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1,
+                                                    size=nb_clients)
+        self.clients = [LoadClient(number, int(s), strict)
+                        for number, s in enumerate(seeds)]
+        self.connected = 0
+
+    def start(self):
+        """
+        Connect the clients one after the other
+        :return: deferred, fired when every client is registered or failed
+        """
+        connections = []
+        for number, client in enumerate(self.clients):
+            defered = task.deferLater(
+                reactor, number * self.interval, client.connect,
+                self.host, self.port)
+            defered.addCallbacks(self._connected, self._failed,
+                                 errbackArgs=(client,))
+            connections.append(defered)
+        return defer.DeferredList(connections)
+
+    def _connected(self, result):
+        self.connected += 1
+
+    def _failed(self, failure, client):
+        logger.error(u"{} not connected: {}".format(
+            client, failure.getErrorMessage()))
+
+    def get_report(self):
+        messages, ignored = Counter(), Counter()
+        for client in self.clients:
+            messages.update(client.messages)
+            ignored.update(client.ignored)
+        return u"Clients: {} connected out of {}\nMessages received: {}\n" \
+               u"Messages not implemented: {}".format(
+                   self.connected, len(self.clients), u", ".join(
+                       u"{} {}".format(name, count)
+                       for name, count in messages.most_common()),
+                   u", ".join(u"{} {}".format(name, count)
+                              for name, count in ignored.most_common())
+                   or u"-")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description=u"Simulated clients")
+    parser.add_argument("clients", type=int, help=u"number of clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--interval", type=float, default=0.01,
+                        help=u"seconds between two connections")
+    parser.add_argument("--strict", action="store_true",
+                        help=u"do not acknowledge the messages not "
+                             u"implemented")
+    args = parser.parse_args()
+    load = LoadGenerator(args.clients, args.seed, args.host, args.port,
+                         args.interval, args.strict)
+    reactor.addSystemEventTrigger(
+        "before", "shutdown", lambda: print(load.get_report()))
+    reactor.callWhenRunning(load.start)
+    reactor.run()
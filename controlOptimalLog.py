@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the logging of the hot path (ticks, extractions) and
+the tick trace.
+- the messages of the hot path are rate limited (LOG_HOT_PATH_RATE per
+second, per message and per owner, the number of messages suppressed is
+given with the next one) and formatted only if they are written
+- the records of the "le2m" logger can be written by a background thread
+(LOG_QUEUE, off by default): the reactor only puts them in a queue
+- every tick of every player can be written in a binary file (TICK_TRACE),
+read with read_trace
+"""
+
+# built-in
+import atexit
+import json
+import logging
+import os
+import struct
+import threading
+import weakref
+from datetime import datetime
+import numpy as np
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+# controlOptimal
+import controlOptimalParams as pms
+from controlOptimalScheduler import monotonic
+
+
+logger = logging.getLogger("le2m")
+
+
+class RateLimiter(object):
+    """
+    At most rate events per second, with bursts of burst events (token
+    bucket)
+    """
+
+    def __init__(self, rate=None, burst=1):
+        """
+        :param rate: events per second, default LOG_HOT_PATH_RATE (None or
+        0 = no limit)
+        """
+        self.rate = pms.LOG_HOT_PATH_RATE if rate is None else rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = monotonic()
+        self.suppressed = 0
+
+    def allow(self):
+        """
+        :return: True if the event can happen now
+        """
+        if not self.rate:
+            return True
+        now = monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.suppressed += 1
+        return False
+
+
+class LazyMessage(object):
+    """
+    A message formatted (str.format) only when it is written
+    """
+    __slots__ = ("template", "args", "suppressed")
+
+    def __init__(self, template, args, suppressed=0):
+        self.template = template
+        self.args = args
+        self.suppressed = suppressed
+
+    def __str__(self):
+        message = self.template.format(*self.args)
+        if self.suppressed:
+            message += u" ({} similar messages suppressed)".format(
+                self.suppressed)
+        return message
+
+    __unicode__ = __str__
+
+
+class SampledLogger(object):
+    """
+    The messages of a logger on the hot path, each message is rate limited
+    for each owner: the first argument of the message (player, client), so
+    that the clients of one process (controlOptimalLoad) have their own
+    messages. The limiters of an owner go with it (weak reference), those of
+    the owners that can't be referenced weakly (text) are kept.
+    """
+
+    def __init__(self, logger, rate=None):
+        self.logger = logger
+        self.rate = rate
+        self.limiters = weakref.WeakKeyDictionary()  # owner -> {template: }
+        self.other_limiters = {}
+
+    def _get_limiters(self, owner):
+        try:
+            return self.limiters.setdefault(owner, {})
+        except TypeError:  # no weak reference
+            return self.other_limiters.setdefault(owner, {})
+
+    def log(self, level, template, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        limiters = self._get_limiters(args[0] if args else None)
+        try:
+            limiter = limiters[template]
+        except KeyError:
+            limiter = limiters[template] = RateLimiter(self.rate)
+        if limiter.allow():
+            self.logger.log(level, LazyMessage(template, args,
+                                               limiter.suppressed))
+            limiter.suppressed = 0
+
+    def debug(self, template, *args):
+        self.log(logging.DEBUG, template, *args)
+
+    def info(self, template, *args):
+        self.log(logging.INFO, template, *args)
+
+
+# ==============================================================================
+# QUEUE
+# ==============================================================================
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts the records in a queue. The message is built here (the arguments
+    can change later) but the formatting of the handlers (time, level...) and
+    the writing are done by the QueueListener
+    """
+
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+                record.exc_info = None
+            self.records.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """
+    Writes the records of the queue with the handlers, in a daemon thread
+    """
+    _STOP = None
+
+    def __init__(self, records, handlers):
+        self.records = records
+        self.handlers = handlers
+        self.thread = threading.Thread(target=self._run,
+                                       name="controlOptimalLog")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            record = self.records.get()
+            if record is self._STOP:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        """
+        Write the records in the queue, then stop the thread
+        """
+        self.records.put(self._STOP)
+        self.thread.join()
+
+
+_queue_logging = {}
+
+
+def start_queue_logging(name="le2m"):
+    """
+    The handlers of the logger are replaced by a QueueHandler, they are used
+    by a QueueListener. The handlers of the other loggers (root) are left
+    as they are.
+    Nothing is done if LOG_QUEUE is False, if it is already started or if
+    the logger has no handler.
+    The listener is stopped at the exit of the program.
+    :return: the QueueListener or None
+    """
+    if not pms.LOG_QUEUE or name in _queue_logging:
+        return _queue_logging.get(name)
+    owner = logging.getLogger(name)
+    handlers = list(owner.handlers)
+    if not handlers:
+        return None
+    records = queue.Queue()
+    listener = QueueListener(records, handlers)
+    for handler in handlers:
+        owner.removeHandler(handler)
+    owner.addHandler(QueueHandler(records))
+    listener.start()
+    _queue_logging[name] = listener
+    atexit.register(listener.stop)
+    logger.info(u"Logging: {} handler(s) in a background thread".format(
+        len(handlers)))
+    return listener
+
+
+# ==============================================================================
+# TICK TRACE
+# ==============================================================================
+
+TRACE_MAGIC = b"COTRACE1"
+# one record per player and per tick
+TRACE_DTYPE = np.dtype([("time", "<f8"), ("player", "<u4"),
+                        ("extraction", "<f8"), ("group_extraction", "<f8"),
+                        ("resource", "<f8"), ("cost", "<f8"),
+                        ("payoff", "<f8")])
+
+
+def get_trace_dir():
+    if pms.TICK_TRACE_DIR is not None:
+        return pms.TICK_TRACE_DIR
+    return os.path.join(os.path.expanduser("~"), ".controlOptimal", "traces")
+
+
+class TickTrace(object):
+    """
+    The values of every player at every tick, in a binary file: TRACE_MAGIC,
+    the size of the header (uint32), the header (json: the fields and the
+    players) then the records (TRACE_DTYPE)
+    """
+
+    def __init__(self, players, path=None):
+        """
+        :param players: the names of the players, in the order of the engine
+        :param path: default a new file of get_trace_dir()
+        """
+        if path is None:
+            directory = get_trace_dir()
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            path = os.path.join(directory, u"ticks_{}.bin".format(
+                datetime.now().strftime("%Y%m%d_%H%M%S")))
+        self.path = path
+        self.records = np.zeros(len(players), dtype=TRACE_DTYPE)
+        self.records["player"] = np.arange(len(players))
+        self.nb_ticks = 0
+        header = json.dumps({"fields": TRACE_DTYPE.descr,
+                             "players": players}).encode("utf-8")
+        self.file = open(path, "wb")
+        self.file.write(TRACE_MAGIC + struct.pack("<I", len(header)) + header)
+
+    def write(self, the_time, extraction, group_extraction, resource, cost,
+              payoff):
+        """
+        :param the_time: the time of the tick
+        :param extraction: array, one value per player (the others too)
+        """
+        records = self.records
+        records["time"] = the_time
+        records["extraction"] = extraction
+        records["group_extraction"] = group_extraction
+        records["resource"] = resource
+        records["cost"] = cost
+        records["payoff"] = payoff
+        self.file.write(records.tobytes())
+        self.nb_ticks += 1
+
+    def close(self):
+        self.file.close()
+        logger.info(u"Tick trace: {} ticks in {}".format(self.nb_ticks,
+                                                         self.path))
+
+
+def read_trace(path):
+    """
+    :return: header (dictionary), records (array of TRACE_DTYPE)
+    """
+    with open(path, "rb") as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(u"{} is not a tick trace".format(path))
+        size = struct.unpack("<I", f.read(4))[0]
+        header = json.loads(f.read(size).decode("utf-8"))
+        records = np.frombuffer(f.read(), dtype=TRACE_DTYPE)
+    return header, records
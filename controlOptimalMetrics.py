@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the instrumentation of the server: histograms of the
+duration of the ticks, of the round-trip time of the update_data messages
+(one histogram per client), of the lateness of the ticks and of the
+database flushes.
+They are displayed by the server menu "Display metrics" and exported as
+OpenMetrics text on http://127.0.0.1:METRICS_PORT/metrics.
+If METRICS_ENABLED is False (default) nothing is measured: the callers check
+it before reading the clock, and no port is opened.
+The observations come from the reactor and from the thread of the batch
+writer, the registry is protected by a lock. twisted.web is imported only
+when the endpoint is started (the clients import this module through the
+scheduler).
+"""
+
+# built-in
+import logging
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+# controlOptimal
+import controlOptimalParams as pms
+
+
+logger = logging.getLogger("le2m")
+
+TICK_DURATION = "co_tick_duration_seconds"
+ROUND_TRIP = "co_update_round_trip_seconds"
+TICK_LATENESS = "co_tick_lateness_seconds"
+DB_FLUSH = "co_db_flush_seconds"
+
+DESCRIPTIONS = OrderedDict([
+    (TICK_DURATION, u"Duration of a tick of the engine (payoffs of every "
+                    u"player, database rows and messages)"),
+    (ROUND_TRIP, u"Time between the sending of update_data and its "
+                 u"acknowledgement by the client"),
+    (TICK_LATENESS, u"Time between the due time of a tick and its run"),
+    (DB_FLUSH, u"Duration of the insertion of a batch of rows")])
+
+# upper bounds of the buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1., 2.5, 5.)
+
+CONTENT_TYPE = b"application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class Histogram(object):
+    """
+    Counts of the values by bucket, plus their sum and max. The cost of an
+    observation is a bisection in BUCKETS.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.
+
+    def get_quantile(self, quantile):
+        """
+        :return: the upper bound of the bucket of the quantile (max for the
+        last bucket)
+        """
+        rank = quantile * self.count
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(upper_bound, self.max)
+        return self.max
+
+
+def _format_labels(labels):
+    return u",".join(
+        u'{}="{}"'.format(k, u"{}".format(v).replace(u"\\", u"\\\\").replace(
+            u'"', u'\\"').replace(u"\n", u"\\n")) for k, v in labels)
+
+
+class Registry(object):
+    def __init__(self):
+        # name -> labels -> Histogram
+        self.families = OrderedDict((name, OrderedDict())
+                                    for name in DESCRIPTIONS)
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            for family in self.families.values():
+                family.clear()
+
+    def _get(self, name, labels):
+        # with the lock
+        key = tuple(sorted(labels.items()))
+        family = self.families[name]
+        try:
+            return family[key]
+        except KeyError:
+            histogram = family[key] = Histogram()
+            return histogram
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self._get(name, labels).observe(value)
+
+    def to_openmetrics(self):
+        with self.lock:
+            return self._to_openmetrics()
+
+    def _to_openmetrics(self):
+        lines = []
+        for name, family in self.families.items():
+            lines.append(u"# TYPE {} histogram".format(name))
+            lines.append(u"# UNIT {} seconds".format(name))
+            lines.append(u"# HELP {} {}".format(name, DESCRIPTIONS[name]))
+            for labels, histogram in family.items():
+                cumulative = 0
+                for upper_bound, count in zip(
+                        list(histogram.buckets) + [u"+Inf"],
+                        histogram.counts):
+                    cumulative += count
+                    lines.append(u"{}_bucket{{{}}} {}".format(
+                        name, _format_labels(
+                            labels + (("le", upper_bound),)), cumulative))
+                prefix = u"{{{}}}".format(_format_labels(labels)) if labels \
+                    else u""
+                lines.append(u"{}_count{} {}".format(
+                    name, prefix, histogram.count))
+                lines.append(u"{}_sum{} {!r}".format(
+                    name, prefix, histogram.sum))
+        lines.append(u"# EOF")
+        return u"\n".join(lines) + u"\n"
+
+    def get_report(self):
+        """
+        :return: the text displayed by the server menu
+        """
+        with self.lock:
+            return self._get_report()
+
+    def _get_report(self):
+        lines = []
+        for name, family in self.families.items():
+            lines.append(DESCRIPTIONS[name])
+            if not family:
+                lines.append(u"    -")
+            for labels, histogram in family.items():
+                lines.append(
+                    u"    {}count {}, mean {:.1f} ms, p95 {:.1f} ms, "
+                    u"max {:.1f} ms".format(
+                        u"{} ".format(u", ".join(
+                            u"{}".format(v) for _, v in labels))
+                        if labels else u"",
+                        histogram.count, histogram.mean * 1000,
+                        histogram.get_quantile(0.95) * 1000,
+                        histogram.max * 1000))
+        return u"\n".join(lines)
+
+
+registry = Registry()
+
+
+def observe(name, value, **labels):
+    if pms.METRICS_ENABLED:
+        registry.observe(name, value, **labels)
+
+
+# ==============================================================================
+# ENDPOINT
+# ==============================================================================
+
+
+def start_endpoint(port=None):
+    """
+    Serve the metrics on localhost only
+    :param port: default METRICS_PORT
+    :return: the listening port, None if the port is not available
+    """
+    from twisted.internet import reactor
+    from twisted.internet.error import CannotListenError
+    from twisted.web import resource, server
+
+    class MetricsResource(resource.Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            request.setHeader(b"Content-Type", CONTENT_TYPE)
+            return registry.to_openmetrics().encode("utf-8")
+
+    port = port or pms.METRICS_PORT
+    try:
+        listening_port = reactor.listenTCP(
+            port, server.Site(MetricsResource()), interface="127.0.0.1")
+    except CannotListenError as e:
+        logger.warning(u"Metrics endpoint not started: {}".format(e))
+        return None
+    logger.info(u"Metrics on http://127.0.0.1:{}/metrics".format(port))
+    return listening_port
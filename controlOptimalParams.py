@@ -45,6 +45,12 @@ MONNAIE = u"ecu"
 DECISION_MIN = 0
 DECISION_MAX = 2.8
 DECISION_STEP = 0.01
+# continuous game: the client sends at most one extraction per interval (the
+# last value chosen during the interval is sent at its end)
+EXTRACTION_MIN_INTERVAL = timedelta(milliseconds=200)
+# simulation and automatique modes: the policy of the simulated players, name
+# and arguments (see controlOptimalPolicies.POLICIES)
+SIMULATION_POLICY = ("RandomPolicy", {})
 
 PARTIE_ESSAI = False
 
@@ -53,8 +59,17 @@ DYNAMIC_TYPE = CONTINUOUS
 CONTINUOUS_TIME_DURATION = timedelta(seconds=60)  # can be changed in config screen
 # time for the player to take a decision
 DISCRETE_DECISION_TIME = timedelta(seconds=10)
-# milliseconds
-TIMER_UPDATE = timedelta(seconds=1)  # refresh the group data and the graphs
+# time between two ticks of the continuous game (can be below one second),
+# the extraction, the growth and the payoff are rates per second
+SIMULATION_STEP = timedelta(seconds=1)
+# refresh the group data and the graphs, the ticks in between are sent
+# together to the remotes
+TIMER_UPDATE = timedelta(seconds=1)
+# max time spent drawing the plots at a refresh, the plots not drawn are
+# drawn at the next refresh
+FRAME_BUDGET = timedelta(milliseconds=40)
+# number of refreshes kept in the text history of the decision screen
+TEXT_INFOS_SIZE = 50
 
 # ------------------------------------------------------------------------------
 # RESOURCE
@@ -62,6 +77,54 @@ TIMER_UPDATE = timedelta(seconds=1)  # refresh the group data and the graphs
 
 RESOURCE_INITIAL_STOCK = 15
 RESOURCE_GROWTH = 0.56
+# True: one stock shared by the members of a group (TAILLE_GROUPES), that
+# grows once and decreases by the sum of their extractions
+GROUP_RESOURCE = False
+
+# ------------------------------------------------------------------------------
+# OPTIMAL SOLUTION (benchmark for the efficiency)
+# ------------------------------------------------------------------------------
+
+SOLVER_TOLERANCE = 1e-6  # max residual of the bellman equation
+SOLVER_MAX_ITERATIONS = 500
+SOLVER_RESOURCE_MAX = None  # None = 2 * max(initial stock, c0 / c1)
+
+# ------------------------------------------------------------------------------
+# DATABASE
+# ------------------------------------------------------------------------------
+
+DB_BATCH_SIZE = 500  # max number of rows inserted in one transaction
+DB_FLUSH_INTERVAL = timedelta(seconds=2)  # max time a row waits in the queue
+# sqlite: the worker and the session of le2m write in the same file
+DB_SQLITE_WAL = True  # readers and writer don't block each other
+DB_BUSY_TIMEOUT = timedelta(seconds=5)  # wait for the lock of the other writer
+DB_WRITE_RETRIES = 3  # then the batch is written again (database locked)
+
+# ------------------------------------------------------------------------------
+# METRICS
+# ------------------------------------------------------------------------------
+
+METRICS_ENABLED = False  # histograms of the ticks, messages and flushes
+METRICS_PORT = 9464  # OpenMetrics text on http://127.0.0.1:<port>/metrics
+
+# ------------------------------------------------------------------------------
+# LOGGING
+# ------------------------------------------------------------------------------
+
+LOG_QUEUE = False  # the log records of le2m are written by a thread
+LOG_HOT_PATH_RATE = 0.1  # max records per second of a message of a player
+TICK_TRACE = False  # every tick of every player in a binary file
+TICK_TRACE_DIR = None  # None = ~/.controlOptimal/traces
+
+# ------------------------------------------------------------------------------
+# PAYOFF CACHE
+# ------------------------------------------------------------------------------
+
+PAYOFF_CACHE = True  # interpolate the infinite payoff from a precomputed grid
+PAYOFF_CACHE_DIR = None  # None = ~/.controlOptimal/cache
+PAYOFF_CACHE_SIZE = 10  # number of parameter sets kept (memory and disk)
+PAYOFF_CACHE_TOLERANCE = 1e-3  # ecus, above the exact formula is used
+PAYOFF_CACHE_MAX_POINTS = 2000000  # size max of the grid
 
 # ------------------------------------------------------------------------------
 # FONCTION DE GAIN
@@ -75,11 +138,60 @@ param_r = 0.005
 param_tau = 0.1
 
 
-def get_infinite_payoff(t, resource, extraction):
+def get_tick_duration():
+    """
+    The duration of a tick, by which the extraction, the growth and the
+    instant payoff are multiplied: SIMULATION_STEP in seconds for the
+    continuous dynamic, 1 (one period) for the discrete dynamic
+    :return: float
+    """
+    if DYNAMIC_TYPE == CONTINUOUS:
+        return SIMULATION_STEP.total_seconds()
+    return 1.
+
+
+def get_discount(t, **kwargs):
+    """
+    The discount factor exp(-r t). Vectorized.
+    :param t: the time(s), seconds
+    :param kwargs: param_r can be given in order to override the value of
+    this module
+    :return: array
+    """
+    r = kwargs.get("param_r", param_r)
+    return np.exp(- r * np.asarray(t, dtype=np.float64))
+
+
+def get_instant_payoff(resource, extraction, **kwargs):
+    """
+    The benefice, the cost and the payoff of an extraction, with the rules of
+    PartieCO.update_data (the cost can't be negative). Vectorized.
+    :param resource: the available resource(s) before the extraction
+    :param extraction: the extraction(s)
+    :param kwargs: param_a, param_b, param_c0 and param_c1 can be given
+    (scalar or array) in order to override the values of this module
+    :return: benefice, cost, payoff
+    """
+    a = kwargs.get("param_a", param_a)
+    b = kwargs.get("param_b", param_b)
+    c0 = kwargs.get("param_c0", param_c0)
+    c1 = kwargs.get("param_c1", param_c1)
+    resource = np.asarray(resource, dtype=np.float64)
+    extraction = np.asarray(extraction, dtype=np.float64)
+    benefice = a * extraction - (b / 2) * extraction ** 2
+    cost = np.maximum(extraction * (c0 - c1 * resource), 0)
+    return benefice, cost, benefice - cost
+
+
+def get_infinite_payoff(t, resource, extraction, growth=None):
+    # growth: the growth of the resource if it isn't RESOURCE_GROWTH (shared
+    # resource: RESOURCE_GROWTH minus the extraction of the others)
     calcul = 0
 
     if DYNAMIC_TYPE == CONTINUOUS:
-        constante = RESOURCE_GROWTH - extraction
+        if growth is None:
+            growth = RESOURCE_GROWTH
+        constante = growth - extraction
         try:
             tm = ((param_c0 / param_c1) + constante * t - resource) / constante
             t0 = (constante * t - resource) / constante
@@ -140,4 +252,100 @@ def get_infinite_payoff(t, resource, extraction):
                           extraction * (param_c0 - param_c1 * resource)) * \
                          (np.exp(- param_r * t) / param_r)
 
-    return calcul
\ No newline at end of file
+    return calcul
+
+
+def get_infinite_payoff_array(t, resource, extraction, **kwargs):
+    """
+    Vectorized version of get_infinite_payoff.
+    t, resource and extraction can be scalars or arrays, they are broadcast
+    together. The case (1.1 to 1.5) is selected element by element with masks
+    and each case uses the same expression as in the scalar version, so that
+    the results are identical.
+    :param t: the time(s)
+    :param resource: the available resource(s)
+    :param extraction: the extraction(s)
+    :param kwargs: param_a, param_b, param_c0, param_c1, param_r and
+    RESOURCE_GROWTH can be given (scalar or array) in order to override the
+    values of this module, as well as DYNAMIC_TYPE
+    :return: an array with the broadcast shape of the arguments
+    """
+    a = kwargs.get("param_a", param_a)
+    b = kwargs.get("param_b", param_b)
+    c0 = kwargs.get("param_c0", param_c0)
+    c1 = kwargs.get("param_c1", param_c1)
+    r = kwargs.get("param_r", param_r)
+    growth = kwargs.get("RESOURCE_GROWTH", RESOURCE_GROWTH)
+
+    arrays = np.broadcast_arrays(
+        *[np.asarray(v, dtype=np.float64) for v in
+          (t, resource, extraction, a, b, c0, c1, r, growth)])
+    shape = arrays[0].shape
+    t, resource, extraction, a, b, c0, c1, r, growth = \
+        [v.ravel() for v in arrays]
+    calcul = np.zeros(t.size)
+
+    if kwargs.get("DYNAMIC_TYPE", DYNAMIC_TYPE) != CONTINUOUS:
+        return calcul.reshape(shape)
+
+    constante = growth - extraction
+    above = resource >= (c0 / c1)
+
+    def case(mask, formula):
+        if not mask.any():
+            return
+        sub = [v[mask] for v in
+               (t, resource, extraction, constante, a, b, c0, c1, r)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            calcul[mask] = formula(*sub)
+
+    def times(t, resource, constante, c0, c1):
+        tm = ((c0 / c1) + constante * t - resource) / constante
+        t0 = (constante * t - resource) / constante
+        return tm, t0
+
+    def cas_1_1(t, resource, extraction, constante, a, b, c0, c1, r):
+        return (a * extraction - (b / 2) * extraction ** 2) * \
+               (np.exp(- r * t) / r)
+
+    def cas_1_2(t, resource, extraction, constante, a, b, c0, c1, r):
+        tm, t0 = times(t, resource, constante, c0, c1)
+        return (a * extraction - (b / 2) * extraction ** 2) * \
+               ((np.exp(- r * t) - np.exp(- r * t0)) / r) - \
+               extraction * (c0 - c1 * resource + constante * c1 * t) * \
+               ((np.exp(- r * tm) - np.exp(- r * t0)) / r) + \
+               (extraction * c1 * constante) * \
+               ((1 + r * tm) * np.exp(-r * tm) -
+                (1 + r * t0) * np.exp(-r * t0)) / r ** 2
+
+    def cas_1_3(t, resource, extraction, constante, a, b, c0, c1, r):
+        tm, t0 = times(t, resource, constante, c0, c1)
+        return (a * extraction - (b / 2) * extraction ** 2) * \
+               (np.exp(- r * t) / r) - \
+               extraction * (c0 - c1 * resource + constante * c1 * t) * \
+               ((np.exp(- r * t) - np.exp(- r * tm)) / r) + \
+               (extraction * c1 * constante) * \
+               ((1 + r * t) * np.exp(-r * t) -
+                (1 + r * tm) * np.exp(-r * tm)) / r ** 2
+
+    def cas_1_4(t, resource, extraction, constante, a, b, c0, c1, r):
+        tm, t0 = times(t, resource, constante, c0, c1)
+        return (a * extraction - (b / 2) * extraction ** 2 -
+                extraction * (c0 - c1 * resource + constante * c1 * t)) * \
+               ((np.exp(- r * t) - np.exp(- r * t0)) / r) + \
+               (extraction * c1 * constante) * \
+               ((1 + r * t) * np.exp(-r * t) -
+                (1 + r * t0) * np.exp(-r * t0)) / r ** 2
+
+    def cas_1_5(t, resource, extraction, constante, a, b, c0, c1, r):
+        return (a * extraction - (b / 2) * extraction ** 2 -
+                extraction * (c0 - c1 * resource)) * \
+               (np.exp(- r * t) / r)
+
+    case(above & (constante >= 0), cas_1_1)
+    case(above & (constante < 0), cas_1_2)
+    case(~above & (constante > 0), cas_1_3)
+    case(~above & (constante < 0), cas_1_4)
+    case(~above & (constante == 0), cas_1_5)
+
+    return calcul.reshape(shape)
@@ -3,11 +3,13 @@
 # built-in
 import logging
 from datetime import datetime
-from twisted.internet import defer
+from itertools import groupby
+import numpy as np
+from twisted.internet import defer, reactor
 from twisted.spread import pb  # because some functions can be called remotely
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, Float, Boolean, ForeignKey, DateTime
-from PyQt4.QtCore import QTimer
+from sqlalchemy import Column, Integer, Float, Boolean, ForeignKey, DateTime, \
+    LargeBinary
 
 # le2m
 from server.servbase import Base
@@ -16,9 +18,15 @@ from util.utiltools import get_module_attributes
 
 # controlOptimal
 import controlOptimalParams as pms
+from controlOptimalCurves import pack_curve, unpack_curve
+import controlOptimalWire as wire
+import controlOptimalMetrics as metrics
+from controlOptimalScheduler import monotonic
+from controlOptimalLog import RateLimiter, SampledLogger
 
 
 logger = logging.getLogger("le2m")
+hot_logger = SampledLogger(logger)  # messages of the ticks, rate limited
 
 
 class PartieCO(Partie, pb.Referenceable):
@@ -28,6 +36,7 @@ class PartieCO(Partie, pb.Referenceable):
     partie_id = Column(Integer, ForeignKey('parties.id'), primary_key=True)
     repetitions = relationship('RepetitionsCO')
     curves = relationship('CurveCO')
+    curves_packed = relationship('CurvePackedCO')
 
     CO_dynamic_type = Column(Integer)
     CO_trial = Column(Boolean)
@@ -36,6 +45,7 @@ class PartieCO(Partie, pb.Referenceable):
     CO_group = Column(Integer, default=None)
     CO_gain_ecus = Column(Float)
     CO_gain_euros = Column(Float)
+    CO_efficiency = Column(Float, default=None)
 
     def __init__(self, le2mserv, joueur, **kwargs):
         super(PartieCO, self).__init__(
@@ -45,12 +55,26 @@ class PartieCO(Partie, pb.Referenceable):
         self.CO_sequence = kwargs.get("current_sequence", 0)
         self.CO_gain_ecus = 0
         self.CO_gain_euros = 0
+        self.optimal_solution = kwargs.get("optimal_solution", None)
 
         self.time_start = None
-        self.timer_update = QTimer()
-        self.timer_update.setInterval(
-            int(pms.TIMER_UPDATE.total_seconds())*1000)
-        self.timer_update.timeout.connect(self.update_data)
+        # set by the TickEngine of the server
+        self.engine = None
+        self.engine_index = None
+        # set by the server, the extractions and curves are written by it
+        self.writer = None
+        self.current_extraction = None
+        # whether a tick has been computed with the current extraction
+        self.current_extraction_applied = False
+        # format of the update_data messages, negotiated at configure
+        self.wire_version = wire.WIRE_DICT
+        # ticks not sent yet to the remote (WIRE_BATCH)
+        self.pending_updates = []
+        # the extractions displayed on the server screen, one per second at
+        # most, the last one suppressed is displayed at the end of the second
+        self.info_limiter = RateLimiter(1.)
+        self.info_pending = None
+        self.info_call = None
 
     @defer.inlineCallbacks
     def configure(self):
@@ -58,11 +82,21 @@ class PartieCO(Partie, pb.Referenceable):
         self.CO_dynamic_type = pms.DYNAMIC_TYPE
         self.CO_treatment = pms.TREATMENT
         self.CO_trial = pms.PARTIE_ESSAI
-        self.current_resource = pms.RESOURCE_INITIAL_STOCK
+        self.CO_group = self.joueur.group
         # we send self because some methods are called remotely
         # we send also the group composition
         yield (self.remote.callRemote(
             "configure", get_module_attributes(pms), self))
+        # the format of the update_data messages, a remote that doesn't know
+        # the negotiation gets WIRE_DICT
+        try:
+            remote_versions = yield (self.remote.callRemote(
+                "wire_versions", wire.SUPPORTED_VERSIONS))
+        except pb.RemoteError as e:
+            logger.info(u"{} no wire negotiation: {}".format(
+                self.joueur, e))
+            remote_versions = None
+        self.wire_version = wire.negotiate(remote_versions)
         self.joueur.info(u"Ok")
 
     @defer.inlineCallbacks
@@ -76,6 +110,9 @@ class PartieCO(Partie, pb.Referenceable):
         self.currentperiod = RepetitionsCO(period)
         self.le2mserv.gestionnaire_base.ajouter(self.currentperiod)
         self.repetitions.append(self.currentperiod)
+        # the extractions of the period are inserted by the batch writer, in
+        # its own transaction, so it needs the id of the period: the server
+        # commits the periods of all the players (commit_periods)
         yield (self.remote.callRemote("newperiod", period))
         logger.info(u"{} Ready for period {}".format(self.joueur, period))
 
@@ -116,113 +153,169 @@ class PartieCO(Partie, pb.Referenceable):
         :param extraction:
         :return:
         """
-        self.current_extraction = ExtractionsCO(
-            extraction, int((datetime.now() - self.time_start).total_seconds()))
-        self.joueur.info(self.current_extraction)
-        self.le2mserv.gestionnaire_base.ajouter(self.current_extraction)
-        self.currentperiod.extractions.append(self.current_extraction)
-
-    def update_data(self):
-        # after the initial extraction but before the game starts
-        # self.time_start is None
-        try:
-            the_time = int((datetime.now() - self.time_start).total_seconds())
-        except TypeError:
-            the_time = 0
-
-        # ----------------------------------------------------------------------
-        # check extraction
-        # ----------------------------------------------------------------------
-        # if extraction > current_resource => new extraction of 0
-        if self.current_extraction.CO_extraction > self.current_resource:
-            # create a new extraction
-            self.current_extraction = ExtractionsCO(0, the_time)
-            self.joueur.info(self.current_extraction)
-            self.le2mserv.gestionnaire_base.ajouter(self.current_extraction)
-            self.currentperiod.extractions.append(self.current_extraction)
-
-        j_extrac = self.current_extraction.CO_extraction
-
-        # ----------------------------------------------------------------------
-        # compute payoff
-        # ----------------------------------------------------------------------
-        # benefice
-        self.current_extraction.CO_benefice = \
-            pms.param_a * j_extrac - (pms.param_b / 2) * pow(j_extrac, 2)
-
-        # cost
-        cost = j_extrac * (pms.param_c0 - pms.param_c1 * self.current_resource)
-        if cost < 0:
-            cost = 0
-        self.current_extraction.CO_cost = cost
+        self.new_extraction(extraction, round(
+            (datetime.now() - self.time_start).total_seconds(), 3))
 
-        # payoff
-        self.current_extraction.CO_payoff = \
-            self.current_extraction.CO_benefice - self.current_extraction.CO_cost
+    def new_extraction(self, extraction, the_time):
+        """
+        Create the extraction and set it in the tick engine.
+        The previous extraction won't change anymore, so it is given to the
+        batch writer. If no tick has been computed with it (several
+        extractions within one tick) it is dropped, so that only the
+        extractions in force at a tick are stored
+        :param extraction:
+        :param the_time:
+        :return:
+        """
+        self.store_current_extraction()
+        self.current_extraction = ExtractionsCO(extraction, the_time)
+        self.current_extraction_applied = False
+        self.current_extraction.repetitions_id = self.currentperiod.id
+        self.info_pending = self.current_extraction
+        if self.info_call is None:
+            self.display_info()
+        self.engine.set_extraction(self.engine_index, extraction)
+
+    def display_info(self):
+        """
+        Display the last extraction on the server screen if the rate limit
+        allows it, otherwise display it later
+        """
+        self.info_call = None
+        if self.info_pending is None:
+            return
+        if self.info_limiter.allow():
+            self.joueur.info(self.info_pending)
+            self.info_pending = None
+        else:
+            self.info_call = reactor.callLater(
+                1. / self.info_limiter.rate, self.display_info)
+
+    def store_current_extraction(self):
+        """
+        Give the current extraction to the batch writer, or drop it if no
+        tick has been computed with it
+        :return:
+        """
+        if self.current_extraction is None:
+            return
+        if self.current_extraction_applied:
+            self.writer.add_object(self.current_extraction)
+        else:
+            hot_logger.debug(u"{} Extraction {} dropped, no tick with it",
+                             self.joueur,
+                             self.current_extraction.CO_extraction)
+        self.current_extraction = None
+
+    def update_data(self, the_time, benefice, cost, payoff, resource,
+                    group_extraction):
+        """
+        Called by the tick engine, that computes the values of every player
+        :param the_time: the time of the tick (the same for every player)
+        :param benefice:
+        :param cost:
+        :param payoff:
+        :param resource: the new available resource (of the group if
+        GROUP_RESOURCE)
+        :param group_extraction: the sum of the extractions of the group
+        :return:
+        """
+        if not self.current_extraction_applied:
+            self.current_extraction.CO_tick_time = the_time
+        self.current_extraction_applied = True
+        self.current_extraction.CO_benefice = benefice
+        self.current_extraction.CO_cost = cost
+        self.current_extraction.CO_payoff = payoff
+        self.current_extraction.CO_resource = resource
+        self.current_extraction.CO_group_extraction = group_extraction
+        message = wire.encode(self.wire_version, self.current_extraction)
+        if self.wire_version == wire.WIRE_BATCH:
+            self.pending_updates.append((message, the_time))
+        else:
+            self.measure_round_trip(self.remote.callRemote(
+                "update_data", message, the_time))
+
+    def send_updates(self):
+        """
+        Called by the tick engine at each refresh: send the ticks since the
+        last refresh in one message (a single tick is sent alone, without
+        the list)
+        :return:
+        """
+        if len(self.pending_updates) == 1:
+            message, the_time = self.pending_updates.pop()
+            self.measure_round_trip(self.remote.callRemote(
+                "update_data", message, the_time))
+        elif self.pending_updates:
+            updates, self.pending_updates = self.pending_updates, []
+            self.measure_round_trip(self.remote.callRemote(
+                "update_data_batch", updates))
+
+    def measure_round_trip(self, defered):
+        """
+        Record the time until the remote acknowledges the message
+        :param defered: the deferred of callRemote
+        :return:
+        """
+        if not pms.METRICS_ENABLED:
+            return
+        start = monotonic()
+        client = u"{}".format(self.joueur)
 
-        # ----------------------------------------------------------------------
-        # compute the new available resource
-        # ----------------------------------------------------------------------
-        self.current_resource -= self.current_extraction.CO_extraction
-        self.current_resource += pms.RESOURCE_GROWTH
-        self.current_extraction.CO_resource = self.current_resource
+        def record(result):
+            metrics.observe(metrics.ROUND_TRIP, monotonic() - start,
+                            client=client)
+            return result
 
-        # ----------------------------------------------------------------------
-        # update the remote
-        # ----------------------------------------------------------------------
-        self.remote.callRemote(
-            "update_data", self.current_extraction.to_dict(), the_time)
+        defered.addCallback(record)
 
     @defer.inlineCallbacks
     def end_update_data(self):
+        self.store_current_extraction()
         yield (self.remote.callRemote("end_update_data"))
 
     @defer.inlineCallbacks
     def display_summary(self, *args):
         """
         Send a dictionary with the period content values to the remote.
-        The remote creates the text and the history
+        The remote creates the text and the history.
+        The curves are built from the values of the tick engine, the remote
+        only acknowledges the summary
         :param args:
         :return:
         """
         logger.debug(u"{} Summary".format(self.joueur))
 
-        # ----------------------------------------------------------------------
-        # we collect the x_data and y_data of the curves displayed on the
-        # remote
-        # ----------------------------------------------------------------------
-        data_indiv = yield(self.remote.callRemote(
+        yield(self.remote.callRemote(
             "display_summary", self.currentperiod.to_dict()))
 
-        extrac_indiv = data_indiv["extractions"]
-        for x, y in extrac_indiv:
-            curve_data = CurveCO(pms.EXTRACTION, x, y)
-            self.le2mserv.gestionnaire_base.ajouter(curve_data)
-            self.curves.append(curve_data)
-
-        payoff_indiv = data_indiv["payoffs"]
-        for x, y in payoff_indiv:
-            curve_data = CurveCO(pms.PAYOFF, x, y)
-            self.le2mserv.gestionnaire_base.ajouter(curve_data)
-            self.curves.append(curve_data)
-        # we collect the part payoff
-        self.CO_gain_ecus = payoff_indiv[-1][1]
-
-        resource = data_indiv["resource"]
-        for x, y in resource:
-            curve_data = CurveCO(pms.RESOURCE, x, y)
-            self.le2mserv.gestionnaire_base.ajouter(curve_data)
-            self.curves.append(curve_data)
+        curves = self.engine.get_curves(self.engine_index)
+        for curve_type in [pms.EXTRACTION, pms.PAYOFF, pms.RESOURCE,
+                           pms.COST]:
+            self.store_curve(curve_type, *curves[curve_type])
 
-        cost = data_indiv["cost"]
-        for x, y in cost:
-            curve_data = CurveCO(pms.COST, x, y)
-            self.le2mserv.gestionnaire_base.ajouter(curve_data)
-            self.curves.append(curve_data)
+        # we collect the part payoff
+        payoffs = curves[pms.PAYOFF][1]
+        self.CO_gain_ecus = float(payoffs[-1]) if len(payoffs) else 0
+        if self.optimal_solution is not None:
+            self.CO_efficiency = self.optimal_solution.get_efficiency(
+                self.CO_gain_ecus)
 
         self.joueur.info("Ok")
         self.joueur.remove_waitmode()
 
+    def store_curve(self, curve_type, xdata, ydata):
+        """
+        Give the curve, packed in one row, to the batch writer
+        :param curve_type: pms.EXTRACTION, pms.PAYOFF, pms.RESOURCE or pms.COST
+        :param xdata:
+        :param ydata:
+        :return:
+        """
+        curve_data = CurvePackedCO(curve_type, xdata, ydata)
+        curve_data.partie_id = self.partie_id
+        self.writer.add_object(curve_data)
+
     @defer.inlineCallbacks
     def compute_partpayoff(self):
         """
@@ -294,6 +387,10 @@ class ExtractionsCO(Base):
     CO_benefice = Column(Float)
     CO_cost = Column(Float)
     CO_payoff = Column(Float)
+    CO_group_extraction = Column(Float, default=None)
+    # the time of the first tick computed with the extraction (time of the
+    # scheduler, CO_extraction_time is the time of the clock of the server)
+    CO_tick_time = Column(Float, default=None)
 
     def __init__(self, extraction, the_time):
         self.CO_extraction = extraction
@@ -309,6 +406,8 @@ class ExtractionsCO(Base):
 # ==============================================================================
 # CURVES
 # when the part is over, we save each curve
+# CurveCO (one row per point) is only read for the parts played before
+# CurvePackedCO (one row per curve)
 # ==============================================================================
 
 class CurveCO(Base):
@@ -325,3 +424,97 @@ class CurveCO(Base):
         self.CO_curve_y = y
 
 
+class CurvePackedCO(Base):
+    """
+    Every point of a curve in one row, packed by controlOptimalCurves
+    """
+    __tablename__ = "partie_controlOptimal_curves_packed"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    partie_id = Column(Integer, ForeignKey("partie_controlOptimal.partie_id"))
+    CO_curve_type = Column(Integer)
+    CO_curve_length = Column(Integer)
+    CO_curve_data = Column(LargeBinary)
+
+    def __init__(self, c_type, x, y):
+        self.CO_curve_type = c_type
+        self.CO_curve_length = len(x)
+        self.CO_curve_data = pack_curve(x, y)
+
+    def get_data(self):
+        """
+        :return: x, y (numpy arrays)
+        """
+        return unpack_curve(self.CO_curve_data)
+
+
+def load_curve(session, partie_id, curve_type):
+    """
+    Load a curve of a part, packed or, for the old parts, from CurveCO
+    :param session: sqlalchemy session
+    :param partie_id:
+    :param curve_type: pms.EXTRACTION, pms.PAYOFF, pms.RESOURCE or pms.COST
+    :return: x, y (numpy arrays)
+    """
+    packed = session.query(CurvePackedCO.CO_curve_data).filter(
+        CurvePackedCO.partie_id == partie_id,
+        CurvePackedCO.CO_curve_type == curve_type).first()
+    if packed is not None:
+        return unpack_curve(packed[0])
+    points = session.query(CurveCO.CO_curve_x, CurveCO.CO_curve_y).filter(
+        CurveCO.partie_id == partie_id,
+        CurveCO.CO_curve_type == curve_type).order_by(CurveCO.id).all()
+    return np.array([p[0] for p in points], dtype=np.float64), \
+        np.array([p[1] for p in points], dtype=np.float64)
+
+
+def migrate_curves(session, delete=False, batch_size=1000):
+    """
+    Pack the CurveCO rows of the curves that are not already packed.
+    The packed curves are inserted once every point has been read (the
+    session is not used while its cursor is open), by batches of batch_size
+    :param session: sqlalchemy session
+    :param delete: if True the CurveCO rows of the packed curves (now or
+    before) are deleted, those of the curves that could not be packed are
+    kept
+    :return: the number of curves packed
+    """
+    packed = set(session.query(CurvePackedCO.partie_id,
+                               CurvePackedCO.CO_curve_type).all())
+    points = session.query(
+        CurveCO.partie_id, CurveCO.CO_curve_type, CurveCO.CO_curve_x,
+        CurveCO.CO_curve_y).order_by(
+        CurveCO.partie_id, CurveCO.CO_curve_type, CurveCO.id).yield_per(10000)
+    rows = []
+    for (partie_id, curve_type), curve_points in groupby(
+            points, key=lambda p: (p[0], p[1])):
+        if (partie_id, curve_type) in packed:
+            continue
+        curve_points = list(curve_points)
+        try:
+            curve_data = pack_curve([p[2] for p in curve_points],
+                                    [p[3] for p in curve_points])
+        except (TypeError, ValueError) as e:
+            logger.warning(u"Curve {} of part {} not packed: {}".format(
+                curve_type, partie_id, e))
+            continue
+        rows.append({"partie_id": partie_id, "CO_curve_type": curve_type,
+                     "CO_curve_length": len(curve_points),
+                     "CO_curve_data": curve_data})
+
+    table = CurvePackedCO.__table__
+    for start in range(0, len(rows), batch_size):
+        session.execute(table.insert(), rows[start:start + batch_size])
+        session.flush()
+    if delete:
+        packed.update((r["partie_id"], r["CO_curve_type"]) for r in rows)
+        by_part = {}
+        for partie_id, curve_type in packed:
+            by_part.setdefault(partie_id, []).append(curve_type)
+        for partie_id, curve_types in by_part.items():
+            session.query(CurveCO).filter(
+                CurveCO.partie_id == partie_id,
+                CurveCO.CO_curve_type.in_(curve_types)).delete(
+                synchronize_session=False)
+    session.commit()
+    logger.info(u"{} curves packed".format(len(rows)))
+    return len(rows)
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the cache of the payoff surface.
+In the continuous game the infinite payoff can be written
+exp(-r * t) * S(resource, extraction), so the time-invariant surface S is
+computed once over a (resource, extraction) grid, at the first tick of the
+remote that needs it (the time is logged), stored on disk under a hash of
+the parameters, and the infinite payoff is then obtained by a linear
+interpolation along the resource and the exp(-r * t) factor. The extractions
+are the values of the slider, so they are nodes of the grid (the surface is
+not smooth in the extraction, around extraction = RESOURCE_GROWTH, so it is
+never interpolated in that direction).
+"""
+
+# built-in
+import hashlib
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+
+# controlOptimal
+import controlOptimalParams as pms
+
+
+logger = logging.getLogger("le2m")
+
+CACHE_FORMAT = 2
+
+# the parameters that change the surface
+SURFACE_PARAMS = ["DYNAMIC_TYPE", "param_a", "param_b", "param_c0",
+                  "param_c1", "param_r", "RESOURCE_GROWTH",
+                  "RESOURCE_INITIAL_STOCK", "DECISION_MIN", "DECISION_MAX",
+                  "DECISION_STEP", "CONTINUOUS_TIME_DURATION",
+                  "SIMULATION_STEP", "TIMER_UPDATE"]
+
+# the types of the arguments of get that are computed by _get_scalar
+# (np.float64 is a float)
+_SCALARS = (float, int)
+
+# surfaces loaded in memory, the most recently used at the end
+_SURFACES = OrderedDict()
+
+
+def get_cache_dir():
+    if pms.PAYOFF_CACHE_DIR is not None:
+        return pms.PAYOFF_CACHE_DIR
+    return os.path.join(os.path.expanduser("~"), ".controlOptimal", "cache")
+
+
+def get_parameters_hash():
+    """
+    :return: the hash of the parameters the surface depends on
+    """
+    values = [CACHE_FORMAT]
+    for k in SURFACE_PARAMS:
+        values.append((k, repr(getattr(pms, k))))
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()
+
+
+def get_extraction_grid():
+    """
+    The values of the slider, DECISION_MAX included
+    :return: array
+    """
+    nb = int(round((pms.DECISION_MAX - pms.DECISION_MIN) / pms.DECISION_STEP))
+    return np.linspace(pms.DECISION_MIN, pms.DECISION_MAX, nb + 1)
+
+
+def get_resource_grid(nb_extractions):
+    """
+    From 0 to (at least) the stock reached if nobody extracts during the
+    whole part. The nodes are multiples of DECISION_STEP, so that with ticks
+    of one second, and an initial stock and a growth that are multiples of
+    DECISION_STEP, the resource of the game falls on the nodes of the grid
+    (up to the rounding of the floats). If the grid would exceed
+    PAYOFF_CACHE_MAX_POINTS the step is larger and the resource is
+    interpolated between the nodes.
+    :param nb_extractions: the size of the extraction grid
+    :return: array
+    """
+    duration = pms.CONTINUOUS_TIME_DURATION.total_seconds() + \
+        pms.SIMULATION_STEP.total_seconds()
+    resource_max = max(
+        pms.RESOURCE_INITIAL_STOCK + pms.RESOURCE_GROWTH * duration,
+        pms.param_c0 / pms.param_c1) + pms.DECISION_STEP
+    nb = int(np.ceil(resource_max / pms.DECISION_STEP - 1e-9))
+    nb_max = int(pms.PAYOFF_CACHE_MAX_POINTS // nb_extractions) - 1
+    if nb <= nb_max:
+        return np.arange(nb + 1) * pms.DECISION_STEP
+    return np.linspace(0, resource_max, max(nb_max, 2) + 1)
+
+
+class PayoffSurface(object):
+    """
+    The surface S(resource, extraction) = get_infinite_payoff(0, resource,
+    extraction). If the surface is None the exact formula is used.
+    """
+
+    def __init__(self, resource_grid=None, extraction_grid=None, surface=None,
+                 error_bound=0.):
+        self.resource_grid = resource_grid
+        self.extraction_grid = extraction_grid
+        self.surface = surface
+        self.error_bound = error_bound
+        # the grids as python numbers, for _get_scalar (the arithmetic of the
+        # numpy scalars costs more than the exact formula)
+        if surface is not None:
+            self._r_origin = float(resource_grid[0])
+            self._r_step = float(resource_grid[1] - resource_grid[0])
+            self._r_last = resource_grid.size - 1
+            self._e_origin = float(extraction_grid[0])
+            self._e_step = float(extraction_grid[1] - extraction_grid[0])
+            self._e_last = extraction_grid.size - 1
+            self._rows = surface.tolist()
+
+    @classmethod
+    def build(cls):
+        """
+        Compute the surface with the current parameters and measure the
+        interpolation error at the middle of the cells
+        :return: PayoffSurface
+        """
+        extraction_grid = get_extraction_grid()
+        resource_grid = get_resource_grid(extraction_grid.size)
+        surface = pms.get_infinite_payoff_array(
+            0, resource_grid[:, np.newaxis], extraction_grid[np.newaxis, :])
+        payoff_surface = cls(resource_grid, extraction_grid, surface)
+        payoff_surface.error_bound = payoff_surface.measure_error()
+        return payoff_surface
+
+    def measure_error(self):
+        """
+        The interpolation error is maximal between the nodes, so we compare
+        the interpolation with the exact formula at the middle of the
+        resource cells
+        :return: the maximal absolute error (at t=0, it decreases with t)
+        """
+        resource = (self.resource_grid[:-1] + self.resource_grid[1:]) / 2
+        exact = pms.get_infinite_payoff_array(
+            0, resource[:, np.newaxis], self.extraction_grid[np.newaxis, :])
+        interpolated = (self.surface[:-1] + self.surface[1:]) / 2
+        return float(np.max(np.abs(exact - interpolated)))
+
+    @property
+    def usable(self):
+        return self.surface is not None and \
+               self.error_bound <= pms.PAYOFF_CACHE_TOLERANCE
+
+    def get(self, t, resource, extraction):
+        """
+        The infinite payoff, same arguments as
+        controlOptimalParams.get_infinite_payoff_array.
+        The points outside the grid, or whose extraction is not a node of the
+        grid, are computed with the exact formula.
+        """
+        if not self.usable:
+            return pms.get_infinite_payoff_array(t, resource, extraction)
+
+        if isinstance(t, _SCALARS) and isinstance(resource, _SCALARS) and \
+                isinstance(extraction, _SCALARS):
+            return self._get_scalar(float(t), float(resource),
+                                    float(extraction))
+
+        t, resource, extraction = np.broadcast_arrays(
+            *[np.asarray(v, dtype=np.float64) for v in
+              (t, resource, extraction)])
+
+        r_grid, e_grid = self.resource_grid, self.extraction_grid
+        fi = (resource - r_grid[0]) / (r_grid[1] - r_grid[0])
+        fj = (extraction - e_grid[0]) / (e_grid[1] - e_grid[0])
+        j = np.rint(fj)
+        inside = (fi >= 0) & (fi <= r_grid.size - 1) & \
+                 (j >= 0) & (j <= e_grid.size - 1) & (np.abs(fj - j) < 1e-6)
+        i = np.clip(np.floor(fi), 0, r_grid.size - 2).astype(np.intp)
+        j = np.clip(j, 0, e_grid.size - 1).astype(np.intp)
+        wi = np.clip(fi - i, 0, 1)
+        value = np.array(
+            ((1 - wi) * self.surface[i, j] + wi * self.surface[i + 1, j]) *
+            np.exp(- pms.param_r * t))
+
+        if not inside.all():
+            value[~inside] = pms.get_infinite_payoff_array(
+                t[~inside], resource[~inside], extraction[~inside])
+        return value
+
+    def _get_scalar(self, t, resource, extraction):
+        """
+        Same as get for one point (the remote calls it every tick), with
+        python floats only
+        """
+        fi = (resource - self._r_origin) / self._r_step
+        fj = (extraction - self._e_origin) / self._e_step
+        j = int(round(fj))
+        if not (0 <= fi <= self._r_last and 0 <= j <= self._e_last and
+                abs(fj - j) < 1e-6):
+            return float(pms.get_infinite_payoff(t, resource, extraction))
+        i = min(int(fi), self._r_last - 1)
+        wi = fi - i
+        return ((1 - wi) * self._rows[i][j] + wi * self._rows[i + 1][j]) * \
+            math.exp(- pms.param_r * t)
+
+    def save(self, path):
+        # written in a temporary file first, so that a reader never sees a
+        # partial file
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, resource_grid=self.resource_grid,
+                 extraction_grid=self.extraction_grid, surface=self.surface,
+                 error_bound=self.error_bound)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:  # windows, another client wrote the same file
+            os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["resource_grid"], data["extraction_grid"],
+                   data["surface"], float(data["error_bound"]))
+
+
+def _evict(cache_dir):
+    """
+    Remove the least recently used files, the date of a file is updated each
+    time it is loaded
+    """
+    files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+             if f.endswith(".npz") and not f.endswith(".tmp.npz")]
+    files.sort(key=os.path.getmtime)
+    for f in files[:max(0, len(files) - pms.PAYOFF_CACHE_SIZE)]:
+        try:
+            os.remove(f)
+        except OSError as e:
+            logger.warning(u"Payoff cache: unable to remove {}: {}".format(
+                f, e))
+
+
+def get_payoff_surface():
+    """
+    Return the surface for the current parameters: from memory, from the disk
+    or computed (and then stored)
+    :return: PayoffSurface
+    """
+    if not pms.PAYOFF_CACHE or pms.DYNAMIC_TYPE != pms.CONTINUOUS:
+        return PayoffSurface()
+
+    key = get_parameters_hash()
+    try:
+        _SURFACES[key] = _SURFACES.pop(key)
+        return _SURFACES[key]
+    except KeyError:
+        pass
+
+    cache_dir = get_cache_dir()
+    path = os.path.join(cache_dir, key + ".npz")
+    payoff_surface = None
+    if os.path.exists(path):
+        try:
+            payoff_surface = PayoffSurface.load(path)
+            os.utime(path, None)
+            logger.info(u"Payoff cache: surface {} loaded".format(key))
+        except (IOError, OSError, ValueError, KeyError) as e:
+            logger.warning(u"Payoff cache: unable to load {}: {}".format(
+                path, e))
+
+    if payoff_surface is None:
+        start = time.time()
+        payoff_surface = PayoffSurface.build()
+        logger.info(u"Payoff cache: surface {} computed in {:.2f} s, error "
+                    u"bound {:.2e}".format(key, time.time() - start,
+                                           payoff_surface.error_bound))
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            payoff_surface.save(path)
+            _evict(cache_dir)
+        except (IOError, OSError) as e:
+            logger.warning(u"Payoff cache: unable to save {}: {}".format(
+                path, e))
+
+    if not payoff_surface.usable:
+        logger.warning(
+            u"Payoff cache: error bound {:.2e} above the tolerance {:.2e}, "
+            u"the exact formula is used".format(
+                payoff_surface.error_bound, pms.PAYOFF_CACHE_TOLERANCE))
+
+    _SURFACES[key] = payoff_surface
+    while len(_SURFACES) > pms.PAYOFF_CACHE_SIZE:
+        _SURFACES.popitem(last=False)
+    return payoff_surface
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the extraction policies of the scripted players.
+A policy decides the extractions of several players at once: the arguments
+of decide are arrays (one value per player) and the parameters of the game
+(param_a, ..., RESOURCE_GROWTH) can be given as keyword arguments, scalar or
+array, to override the values of controlOptimalParams.
+The simulated players of the clients (simulation and automatique modes) use
+the policy SIMULATION_POLICY, through the PolicyBatch of their process: all
+the players of the process (several hundreds with controlOptimalLoad) are
+decided with one call of the policy.
+"""
+
+# built-in
+import logging
+import numpy as np
+from twisted.internet import task
+
+# controlOptimal
+import controlOptimalParams as pms
+
+
+logger = logging.getLogger("le2m")
+
+_decision_grids = {}
+
+
+def get_decision_grid():
+    """
+    The extractions that can be chosen with the slider, DECISION_MIN to
+    DECISION_MAX by DECISION_STEP. Computed once for each set of parameters.
+    :return: array (read-only)
+    """
+    key = (pms.DECISION_MIN, pms.DECISION_MAX, pms.DECISION_STEP)
+    try:
+        return _decision_grids[key]
+    except KeyError:
+        nb = int(round((pms.DECISION_MAX - pms.DECISION_MIN) /
+                       pms.DECISION_STEP)) + 1
+        grid = np.round(pms.DECISION_MIN + np.arange(nb) * pms.DECISION_STEP,
+                        10)
+        grid.flags.writeable = False
+        _decision_grids[key] = grid
+        return grid
+
+
+def snap_to_grid(extraction):
+    """
+    :param extraction: array
+    :return: array, the nearest extractions of the decision grid
+    """
+    grid = get_decision_grid()
+    index = np.rint((np.asarray(extraction, dtype=np.float64) - grid[0]) /
+                    pms.DECISION_STEP)
+    return grid[np.clip(index, 0, grid.size - 1).astype(np.intp)]
+
+
+class Policy(object):
+    """
+    Base class of the policies
+    """
+    # True if decide draws random numbers (see PolicyBatch)
+    stochastic = False
+    # True if decide depends on which players are decided (see PolicyBatch)
+    indexed = False
+
+    def decide(self, the_time, resource, extraction, **params):
+        """
+        :param the_time: the time of the tick
+        :param resource: array, the available resource of each player
+        :param extraction: array, the current extraction of each player
+        :param params: parameters of the game that override controlOptimalParams
+        :return: array, the new extraction of each player. The base policy
+        keeps the current extractions, the subclasses override this method.
+        """
+        return np.array(np.broadcast_to(extraction, np.shape(resource)),
+                        dtype=np.float64)
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, ", ".join(
+            "{}={!r}".format(k, v) for k, v in sorted(self.__dict__.items())
+            if not k.startswith("_")))
+
+
+class RandomPolicy(Policy):
+    """
+    An extraction of the decision grid, drawn uniformly, DECISION_MAX
+    excluded (as np.arange(DECISION_MIN, DECISION_MAX, DECISION_STEP) of
+    the first simulations)
+    """
+    stochastic = True
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self._random_state = np.random.RandomState(seed)
+
+    def decide(self, the_time, resource, extraction, uniform=None, **params):
+        """
+        :param uniform: array, one draw in [0, 1) per player (the PolicyBatch
+        draws them from the stream of each player), by default drawn from
+        the stream of the policy
+        """
+        grid = get_decision_grid()
+        if grid.size > 1:
+            grid = grid[:-1]
+        if uniform is None:
+            uniform = self._random_state.random_sample(np.shape(resource))
+        index = (np.asarray(uniform) * grid.size).astype(np.intp)
+        return grid[np.minimum(index, grid.size - 1)]
+
+
+class ConstantPolicy(Policy):
+    """
+    Always the same extraction, by default RESOURCE_GROWTH (the stock stays
+    the same)
+    """
+
+    def __init__(self, extraction=None):
+        self.extraction = extraction
+
+    def decide(self, the_time, resource, extraction, **params):
+        value = self.extraction
+        if value is None:
+            value = params.get("RESOURCE_GROWTH", pms.RESOURCE_GROWTH)
+        return np.array(np.broadcast_to(value, np.shape(resource)),
+                        dtype=np.float64)
+
+
+class ThresholdPolicy(Policy):
+    """
+    extraction_high if the resource is greater or equal to the threshold,
+    otherwise extraction_low. By default the threshold is c0 / c1 (no cost
+    above), the extractions DECISION_MAX and DECISION_MIN.
+    """
+
+    def __init__(self, threshold=None, extraction_high=None,
+                 extraction_low=None):
+        self.threshold = threshold
+        self.extraction_high = extraction_high
+        self.extraction_low = extraction_low
+
+    def decide(self, the_time, resource, extraction, **params):
+        # the defaults are read at each decision, remote_configure sets the
+        # parameters of the part after the policy is created
+        threshold = self.threshold
+        if threshold is None:
+            threshold = np.divide(params.get("param_c0", pms.param_c0),
+                                  params.get("param_c1", pms.param_c1))
+        high = pms.DECISION_MAX if self.extraction_high is None \
+            else self.extraction_high
+        low = pms.DECISION_MIN if self.extraction_low is None \
+            else self.extraction_low
+        return np.where(np.asarray(resource) >= threshold, high,
+                        low).astype(np.float64)
+
+
+class MyopicPolicy(Policy):
+    """
+    The best response to the instant payoff: the extraction that maximizes
+    a e - b/2 e^2 - e max(0, c0 - c1 R) for the current resource, on the
+    decision grid
+    """
+
+    def decide(self, the_time, resource, extraction, **params):
+        a = params.get("param_a", pms.param_a)
+        b = params.get("param_b", pms.param_b)
+        c0 = params.get("param_c0", pms.param_c0)
+        c1 = params.get("param_c1", pms.param_c1)
+        marginal_cost = np.maximum(
+            c0 - c1 * np.asarray(resource, dtype=np.float64), 0)
+        return snap_to_grid((a - marginal_cost) / b)
+
+
+class ReplayPolicy(Policy):
+    """
+    The extractions of a file: csv, one row per decision with the time
+    (seconds or period) followed by the extractions of the players (the
+    columns are used in turn if there are more players than columns).
+    Before the first row the players keep their extraction.
+    """
+    indexed = True
+
+    def __init__(self, path):
+        self.path = path
+        table = np.loadtxt(path, delimiter=",", ndmin=2)
+        order = np.argsort(table[:, 0], kind="mergesort")
+        self._times = table[order, 0]
+        self._extractions = table[order, 1:]
+
+    def decide(self, the_time, resource, extraction, index=None, **params):
+        """
+        :param index: array, the index of each player (the PolicyBatch gives
+        the index of its members), by default their position in the arrays
+        """
+        extraction = np.array(np.broadcast_to(
+            extraction, np.shape(resource)), dtype=np.float64)
+        row = np.searchsorted(self._times, the_time, side="right") - 1
+        if index is None:
+            index = np.arange(extraction.size)
+        column = np.asarray(index) % self._extractions.shape[1]
+        row = np.broadcast_to(row, extraction.shape)
+        started = row >= 0
+        extraction[started] = self._extractions[row[started],
+                                                column[started]]
+        return extraction
+
+
+POLICIES = {"ConstantPolicy": ConstantPolicy,
+            "ThresholdPolicy": ThresholdPolicy,
+            "RandomPolicy": RandomPolicy,
+            "MyopicPolicy": MyopicPolicy,
+            "ReplayPolicy": ReplayPolicy}
+
+
+def create_policy(name, **kwargs):
+    """
+    :param name: the name of the class, key of POLICIES
+    :param kwargs: the arguments of the class
+    :return: Policy
+    """
+    if name not in POLICIES:
+        raise ValueError(u"Unknown policy {}".format(name))
+    return POLICIES[name](**kwargs)
+
+
+# ==============================================================================
+# SIMULATED PLAYERS
+# ==============================================================================
+
+
+class PolicyBatch(object):
+    """
+    The simulated players of a process, decided together. A member gives
+    get_policy_state() (time, resource, extraction) and random_state, and
+    receives its extraction with on_policy_decision. The members of the
+    continuous game decide every decision_interval seconds, checked at each
+    TIMER_UPDATE.
+    Each member has a policy_index, given in the order of registration and
+    kept by the member, so that an indexed policy (ReplayPolicy) gives it
+    the same column whatever the other members decided with it.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.members = []
+        self.nb_registered = 0
+        self.loop = task.LoopingCall(self._tick)
+
+    def register(self, member):
+        """
+        Give its policy_index to the member, if it has none
+        :return: int, the index
+        """
+        if getattr(member, "policy_index", None) is None:
+            member.policy_index = self.nb_registered
+            self.nb_registered += 1
+        return member.policy_index
+
+    def decide(self, members):
+        """
+        One call of the policy for these members
+        :param members: list
+        :return: array, their extractions
+        """
+        nb = len(members)
+        state = np.array([m.get_policy_state() for m in members],
+                         dtype=np.float64).reshape(nb, 3)
+        params = {}
+        if self.policy.stochastic:
+            params["uniform"] = np.fromiter(
+                (m.random_state.random_sample() for m in members),
+                np.float64, nb)
+        if self.policy.indexed:
+            params["index"] = np.fromiter(
+                (self.register(m) for m in members), np.intp, nb)
+        return self.policy.decide(state[:, 0], state[:, 1], state[:, 2],
+                                  **params)
+
+    def add(self, member):
+        """
+        Add a member of the continuous game, it decides first after
+        decision_interval
+        """
+        self.register(member)
+        member.next_decision = self.loop.clock.seconds() + \
+            member.decision_interval
+        self.members.append(member)
+        if not self.loop.running:
+            self.loop.start(pms.TIMER_UPDATE.total_seconds(), now=False)
+
+    def discard(self, member):
+        if member in self.members:
+            self.members.remove(member)
+        if not self.members and self.loop.running:
+            self.loop.stop()
+
+    def _tick(self):
+        now = self.loop.clock.seconds()
+        due = [m for m in self.members if m.next_decision <= now]
+        if not due:
+            return
+        for member, extraction in zip(due, self.decide(due).tolist()):
+            member.next_decision += member.decision_interval
+            member.on_policy_decision(extraction)
+
+
+_policy_batches = {}
+
+
+def get_policy_batch():
+    """
+    The PolicyBatch of the process for SIMULATION_POLICY
+    """
+    name, kwargs = pms.SIMULATION_POLICY
+    key = repr((name, sorted(kwargs.items())))
+    try:
+        return _policy_batches[key]
+    except KeyError:
+        batch = _policy_batches[key] = PolicyBatch(
+            create_policy(name, **kwargs))
+        logger.info(u"Simulated players: {}".format(batch.policy))
+        return batch
@@ -1,22 +1,34 @@
 # -*- coding: utf-8 -*-
+"""
+The screens (controlOptimalGui, matplotlib and PyQt4.QtGui) are imported
+only when one is displayed: a simulated client runs without importing
+matplotlib. The timers are the ones of the Twisted reactor, so simulated
+remotes also run without Qt event loop (see controlOptimalLoad).
+"""
 
 # built-in
 import logging
-import random
-from twisted.internet import defer
+from collections import deque
+from twisted.internet import defer, reactor
 import numpy as np
-from PyQt4.QtCore import QTimer, pyqtSignal, QObject
+from PyQt4.QtCore import pyqtSignal, QObject
 
 # le2m
 from client.cltremote import IRemote
 
 # controlOptimal
 import controlOptimalParams as pms
-from controlOptimalGui import GuiDecision, GuiInitialExtraction, GuiSummary
 import controlOptimalTexts as texts_CO
+from controlOptimalPayoffCache import get_payoff_surface
+import controlOptimalWire as wire
+from controlOptimalScheduler import monotonic
+from controlOptimalAccounting import DiscountTable, PayoffAccumulator
+from controlOptimalPolicies import get_policy_batch
+from controlOptimalLog import SampledLogger, start_queue_logging
 
 
 logger = logging.getLogger("le2m")
+hot_logger = SampledLogger(logger)  # messages of the ticks, rate limited
 
 
 class RemoteCO(IRemote, QObject):
@@ -26,8 +38,23 @@ class RemoteCO(IRemote, QObject):
     def __init__(self, le2mclt):
         IRemote.__init__(self, le2mclt)
         QObject.__init__(self)
+        start_queue_logging()
+        self._figure_pool = None
+        self._payoff_surface = None
+        self.decision_screen = None
+        # the random decisions of the simulation, the load generator gives a
+        # seed to each client
+        self.random_state = np.random.RandomState(
+            getattr(le2mclt, "seed", None))
+        # the simulated decisions (simulation and automatique), see
+        # controlOptimalPolicies
+        self.policy_batch = None
+        self.policy_index = None  # given by the policy batch
+        self.decision_interval = None
+        self.next_decision = None
 
     def __init_vars(self):
+        self.release_figures()  # if the previous part was not closed
         self.start_time = None
         self.extractions = PlotData()
         self.cost = PlotData()
@@ -35,13 +62,26 @@ class RemoteCO(IRemote, QObject):
         self.payoff_instant_discounted = PlotData()
         self.payoff_part = PlotData()
         self.resource = PlotData()
-        self.text_infos = u""
+        self.cumulative_payoff = 0
+        self.accounting = PayoffAccumulator(DiscountTable(
+            pms.get_tick_duration(), int(round(
+                pms.CONTINUOUS_TIME_DURATION.total_seconds() /
+                pms.get_tick_duration()))))
+        # one entry per refresh, the last one first
+        self.text_infos = deque(maxlen=pms.TEXT_INFOS_SIZE)
+        self.text_infos_count = 0  # number of entries since the beginning
+        self.text_infos_template = get_text_infos_template()
         self.decision_screen = None
+        # coalescing of the extractions of the continuous game
+        self.pending_extraction = None
+        self.last_sending = None
+        self.extraction_call = None  # the sending at the end of the interval
 
     def remote_configure(self, params, server_part):
         """
         Set the same parameters as in the server side
         :param params:
+        :param server_part:
         :return:
         """
         logger.info(u"{} configure".format(self.le2mclt))
@@ -49,6 +89,21 @@ class RemoteCO(IRemote, QObject):
         for k, v in params.items():
             setattr(pms, k, v)
         self.__init_vars()
+        self._payoff_surface = None  # the parameters have changed
+        self.policy_batch = get_policy_batch()
+        self.policy_batch.register(self)
+        # until the server negotiates (an older server doesn't)
+        self.wire_version = wire.WIRE_DICT
+
+    def remote_wire_versions(self, wire_versions):
+        """
+        Called by the server after configure
+        :param wire_versions: the formats of update_data known by the server
+        :return: the versions known by the remote (both sides choose the
+        highest common one)
+        """
+        self.wire_version = wire.negotiate(wire_versions)
+        return wire.SUPPORTED_VERSIONS
 
     def remote_newperiod(self, period):
         """
@@ -65,12 +120,11 @@ class RemoteCO(IRemote, QObject):
         :return:
         """
         if self.le2mclt.simulation:
-            extraction = float(np.random.choice(
-                np.arange(pms.DECISION_MIN, pms.DECISION_MAX,
-                          pms.DECISION_STEP)))
+            extraction = self.get_simulated_extraction()
             logger.info(u"{} Send {}".format(self.le2mclt, extraction))
             return extraction
         else:
+            from controlOptimalGui import GuiInitialExtraction
             defered = defer.Deferred()
             screen = GuiInitialExtraction(self, defered)
             screen.show()
@@ -97,22 +151,11 @@ class RemoteCO(IRemote, QObject):
 
             if pms.DYNAMIC_TYPE == pms.CONTINUOUS:
 
-                def send_simulation():
-                    extraction = float(np.random.choice(
-                        np.arange(pms.DECISION_MIN, pms.DECISION_MAX,
-                                  pms.DECISION_STEP)))
-                    logger.info(u"{} Send {}".format(self._le2mclt.uid,
-                                                     extraction))
-                    self.server_part.callRemote("new_extraction",
-                                                extraction)
-
+                # the decisions are taken by the batch of the process
                 self.continuous_simulation_defered = defer.Deferred()
-                self.continuous_simulation_timer = QTimer()
-                self.continuous_simulation_timer.setInterval(
-                    random.randint(2000, 10000))
-                self.continuous_simulation_timer.timeout.connect(
-                    send_simulation)
-                self.continuous_simulation_timer.start()
+                self.decision_interval = \
+                    self.random_state.randint(2000, 10001) / 1000.
+                self.policy_batch.add(self)
 
                 return self.continuous_simulation_defered
 
@@ -121,9 +164,7 @@ class RemoteCO(IRemote, QObject):
             # ------------------------------------------------------------------
 
             elif pms.DYNAMIC_TYPE == pms.DISCRETE:
-                extraction = float(np.random.choice(
-                    np.arange(pms.DECISION_MIN, pms.DECISION_MAX,
-                              pms.DECISION_STEP)))
+                extraction = self.get_simulated_extraction()
                 logger.info(u"{} Send {}".format(self.le2mclt, extraction))
                 return extraction
 
@@ -134,8 +175,14 @@ class RemoteCO(IRemote, QObject):
         else:
             defered = defer.Deferred()
             if self.decision_screen is None:
+                from controlOptimalGui import GuiDecision
                 self.decision_screen = GuiDecision(self, defered)
                 self.decision_screen.showFullScreen()
+                if self.le2mclt.automatique and \
+                        pms.DYNAMIC_TYPE == pms.CONTINUOUS:
+                    self.decision_interval = \
+                        self.random_state.randint(2000, 10001) / 1000.
+                    self.policy_batch.add(self)
             else:
                 self.decision_screen.defered = defered
                 self.decision_screen.update_data_and_graphs()
@@ -144,12 +191,35 @@ class RemoteCO(IRemote, QObject):
     def remote_update_data(self, player_extraction, the_time):
         """
         called by the server:
-        - every second if dynamic == continuous
+        - every tick if dynamic == continuous (with WIRE_BATCH, only when one
+        tick is pending at the refresh)
         - every period if dynamic == discrete
-        :param player_extraction: the player's extraction
+        :param player_extraction: the player's extraction, in the format
+        negotiated at configure (see controlOptimalWire)
         :param the_time: the time of the update
         :return:
         """
+        self._add_tick(player_extraction, the_time)
+        self._update_display()
+
+    def remote_update_data_batch(self, updates):
+        """
+        called by the server at every refresh (TIMER_UPDATE) with the ticks
+        since the previous refresh (WIRE_BATCH format)
+        :param updates: list of (player_extraction, the_time)
+        :return:
+        """
+        for player_extraction, the_time in updates:
+            self._add_tick(player_extraction, the_time)
+        if updates:
+            self._update_display()
+
+    def _add_tick(self, player_extraction, the_time):
+        """
+        Add the values of one tick to the data of the curves
+        """
+        extraction, resource, cost, payoff, group_extraction = wire.decode(
+            self.wire_version, player_extraction)
 
         # ----------------------------------------------------------------------
         # we set the same time for every player in the group
@@ -166,41 +236,50 @@ class RemoteCO(IRemote, QObject):
         # player extraction
         # ----------------------------------------------------------------------
         self.extractions.add_x(xdata)
-        self.extractions.add_y(player_extraction["CO_extraction"])
-        try:
-            self.extractions.update_curve()
-        except AttributeError:
-            pass
+        self.extractions.add_y(extraction)
 
         # ----------------------------------------------------------------------
         # resource
         # ----------------------------------------------------------------------
         self.resource.add_x(xdata)
-        self.resource.add_y(player_extraction["CO_resource"])
+        self.resource.add_y(resource)
 
         # ----------------------------------------------------------------------
         # cost
         # ----------------------------------------------------------------------
         self.cost.add_x(xdata)
-        self.cost.add_y(player_extraction["CO_cost"])
+        self.cost.add_y(cost)
 
         # ----------------------------------------------------------------------
-        # player payoff
+        # player payoff (the instant payoff is a rate per second)
         # ----------------------------------------------------------------------
         self.payoff_instant.add_x(xdata)
-        self.payoff_instant.add_y(player_extraction["CO_payoff"])
+        self.payoff_instant.add_y(payoff)
         self.payoff_instant_discounted.add_x(xdata)
         if pms.DYNAMIC_TYPE == pms.CONTINUOUS:
             self.payoff_instant_discounted.add_y(
-                np.exp(- pms.param_r * xdata) * self.payoff_instant.ydata[-1])
+                self.accounting.add(xdata, payoff, extraction))
         else:  # discrete
             pass  # todo: discounted payoff for discrete dynamic
-        cumulative_payoff = np.sum(self.payoff_instant_discounted.ydata)
-        infinite_payoff = pms.get_infinite_payoff(
-            xdata, player_extraction["CO_resource"],
-            player_extraction["CO_extraction"])
+        self.cumulative_payoff = self.accounting.cumulative_payoff
+        if pms.GROUP_RESOURCE:
+            # the stock grows less because of the extraction of the others
+            # (the growth changes with them, so the payoff cache, computed
+            # for RESOURCE_GROWTH, is not used)
+            infinite_payoff = float(pms.get_infinite_payoff(
+                xdata, resource, extraction,
+                pms.RESOURCE_GROWTH - (group_extraction - extraction)))
+        else:
+            infinite_payoff = float(self.payoff_surface.get(
+                xdata, resource, extraction))
         self.payoff_part.add_x(xdata)
-        self.payoff_part.add_y(cumulative_payoff + infinite_payoff)
+        self.payoff_part.add_y(self.cumulative_payoff + infinite_payoff)
+
+    def _update_display(self):
+        """
+        Update the curves and the text with the last tick
+        """
+        xdata = self.extractions.xdata[-1]
 
         # ----------------------------------------------------------------------
         # update curves
@@ -215,60 +294,139 @@ class RemoteCO(IRemote, QObject):
         # ----------------------------------------------------------------------
         # text information
         # ----------------------------------------------------------------------
-        old = self.text_infos
-        the_time_str = texts_CO.trans_CO(u"Instant") if \
-            pms.DYNAMIC_TYPE == pms.CONTINUOUS else \
-            texts_CO.trans_CO(u"Period")
-        self.text_infos = the_time_str + u": {}".format(int(xdata)) + \
-            u"<br>" + texts_CO.trans_CO(u"Extraction") + \
-            u": {:.2f}".format(self.extractions.ydata[-1]) + \
-            u"<br>" + texts_CO.trans_CO(u"Available resource") + \
-            u": {:.2f}".format(self.resource.ydata[-1]) + \
-            u"<br>" + texts_CO.trans_CO(u"Instant payoff") + \
-            u": {:.2f}".format(self.payoff_instant.ydata[-1]) + \
-            u"<br>" + texts_CO.trans_CO(u"Discounted payoff") + \
-            u": {:.4f}".format(self.payoff_instant_discounted.ydata[-1]) + \
-            u"<br>" + texts_CO.trans_CO(u"Cumulative payoff") + \
-            u": {:.2f}".format(cumulative_payoff) + \
-            u"<br>" + texts_CO.trans_CO(u"Part payoff") + \
-            u": {:.2f}".format(self.payoff_part.ydata[-1])
-        self.text_infos += u"<br>{}<br>{}".format(20*"-", old)
+        self.text_infos.appendleft(self.text_infos_template.format(
+            xdata, self.extractions.ydata[-1], self.resource.ydata[-1],
+            self.payoff_instant.ydata[-1],
+            self.accounting.last_discounted_payoff, self.cumulative_payoff,
+            self.payoff_part.ydata[-1]))
+        self.text_infos_count += 1
 
         # ----------------------------------------------------------------------
         # log
         # ----------------------------------------------------------------------
-        logger.info("{} update data extraction: {:.2f} "
-                    "resource: {:.2f} payoff: {:.2f}".format(
-            self.le2mclt, self.extractions.ydata[-1],
-            self.resource.ydata[-1],
-            self.payoff_part.ydata[-1]))
+        hot_logger.info(u"{} update data extraction: {:.2f} "
+                        u"resource: {:.2f} payoff: {:.2f}", self.le2mclt,
+                        self.extractions.ydata[-1], self.resource.ydata[-1],
+                        self.payoff_part.ydata[-1])
+
+    def get_policy_state(self):
+        """
+        What the policy of the simulated player knows (see PolicyBatch)
+        :return: time, resource and extraction of the last update
+        """
+        if not len(self.extractions):
+            return 0, pms.RESOURCE_INITIAL_STOCK, 0
+        return self.extractions.xdata[-1], self.resource.ydata[-1], \
+            self.extractions.ydata[-1]
+
+    def get_simulated_extraction(self):
+        """
+        The decision of the simulated player (simulation and automatique),
+        taken by SIMULATION_POLICY
+        :return: float
+        """
+        return float(self.policy_batch.decide([self])[0])
+
+    def on_policy_decision(self, extraction):
+        """
+        Called by the PolicyBatch in the continuous game, the extraction is
+        sent (simulation) or set on the slider (automatique)
+        """
+        if self.decision_screen is not None:
+            self.decision_screen.extract_dec.setValue(extraction)
+            return
+        hot_logger.info(u"{} Send {}", self.le2mclt, extraction)
+        self.send_extraction(extraction)
+
+    def send_extraction(self, extraction):
+        """
+        Send an extraction of the continuous game to the server, at most one
+        message every EXTRACTION_MIN_INTERVAL: during the interval only the
+        last extraction is kept, and it is sent at the end of the interval
+        :param extraction:
+        :return:
+        """
+        self.pending_extraction = extraction
+        if self.extraction_call is not None and self.extraction_call.active():
+            return
+        wait = 0
+        if self.last_sending is not None:
+            wait = self.last_sending + \
+                pms.EXTRACTION_MIN_INTERVAL.total_seconds() - monotonic()
+        if wait > 0:
+            self.extraction_call = reactor.callLater(
+                wait, self._send_pending_extraction)
+        else:
+            self._send_pending_extraction()
+
+    def _send_pending_extraction(self):
+        if self.pending_extraction is None:
+            return
+        extraction, self.pending_extraction = self.pending_extraction, None
+        self.last_sending = monotonic()
+        self.server_part.callRemote("new_extraction", extraction)
 
     def remote_end_update_data(self):
         logger.debug("{}: call of remote_end_data".format(self.le2mclt))
 
+        # __ the game is over, a pending extraction is not sent __
+        if self.extraction_call is not None and self.extraction_call.active():
+            self.extraction_call.cancel()
+        self.pending_extraction = None
+
+        # __ the simulated decisions stop __
+        self.policy_batch.discard(self)
+
         # __ if continuous simulation __
         if self.le2mclt.simulation and pms.DYNAMIC_TYPE == pms.CONTINUOUS:
-            self.continuous_simulation_timer.stop()
             self.continuous_simulation_defered.callback(None)
 
         self.end_of_time.emit()
 
+    @property
+    def payoff_surface(self):
+        """
+        The surface of the infinite payoff, loaded or computed at the first
+        tick that needs it (not with a shared stock nor in the discrete game)
+        """
+        if self._payoff_surface is None:
+            self._payoff_surface = get_payoff_surface()
+        return self._payoff_surface
+
+    @property
+    def figure_pool(self):
+        """
+        The figures of the decision and summary screens, created with the
+        first screen
+        """
+        if self._figure_pool is None:
+            from controlOptimalRender import FigurePool
+            self._figure_pool = FigurePool()
+        return self._figure_pool
+
+    def release_figures(self):
+        """
+        Release the figures and the decision screen of the part
+        :return:
+        """
+        if self._figure_pool is not None:
+            self._figure_pool.release()
+        if self.decision_screen is not None:
+            self.decision_screen.deleteLater()
+            self.decision_screen = None
+
     def remote_display_summary(self, period_content):
         """
         Display the summary screen
         :param period_content: dictionary with the content of the current period
-        :return: deferred
+        :return: deferred, fired when the subject closes the summary (the
+        curves are built by the server)
         """
         logger.info(u"{} Summary".format(self._le2mclt.uid))
         if self._le2mclt.simulation:
-            logger.info("{} send curves".format(self.le2mclt))
-            return {
-                "extractions": zip(self.extractions.xdata, self.extractions.ydata),
-                "payoffs": zip(self.payoff_part.xdata, self.payoff_part.ydata),
-                "costs": zip(self.cost.xdata, self.cost.ydata),
-                "resource": zip(self.resource.xdata, self.resource.ydata)
-            }
+            return None
         else:
+            from controlOptimalGui import GuiSummary
             defered = defer.Deferred()
             summary_screen = GuiSummary(
                 self, defered, texts_CO.get_text_summary(
@@ -277,24 +435,95 @@ class RemoteCO(IRemote, QObject):
             return defered
 
 
+def get_text_infos_template():
+    """
+    The text of one refresh, translated once: time, extraction, resource,
+    instant payoff, discounted payoff, cumulative payoff and part payoff
+    """
+    def label(text):
+        # the template goes through str.format
+        return texts_CO.trans_CO(text).replace(u"{", u"{{").replace(
+            u"}", u"}}")
+
+    the_time_str = label(u"Instant") if \
+        pms.DYNAMIC_TYPE == pms.CONTINUOUS else label(u"Period")
+    return the_time_str + u": {:g}" + \
+        u"<br>" + label(u"Extraction") + u": {:.2f}" + \
+        u"<br>" + label(u"Available resource") + u": {:.2f}" + \
+        u"<br>" + label(u"Instant payoff") + u": {:.2f}" + \
+        u"<br>" + label(u"Discounted payoff") + u": {:.4f}" + \
+        u"<br>" + label(u"Cumulative payoff") + u": {:.2f}" + \
+        u"<br>" + label(u"Part payoff") + u": {:.2f}" + \
+        u"<br>" + 20 * u"-"
+
+
 # ==============================================================================
 # PLOT DATA
 # ==============================================================================
 
 
-class PlotData():
-    def __init__(self):
-        self.xdata = []
-        self.ydata = []
+def get_plot_capacity():
+    """
+    The number of points of a curve: the initial extraction plus one point
+    per tick (continuous) or per period (discrete)
+    """
+    if pms.DYNAMIC_TYPE == pms.CONTINUOUS:
+        return int(round(pms.CONTINUOUS_TIME_DURATION.total_seconds() /
+                         pms.get_tick_duration())) + 2
+    return pms.NOMBRE_PERIODES + 2
+
+
+class PlotData(object):
+    """
+    The points of a curve, in numpy arrays allocated for the expected
+    number of points and doubled if needed. xdata and ydata are views of
+    the arrays (no copy), for the plots and the export. version changes
+    each time the data are given to the curve.
+    """
+
+    def __init__(self, capacity=None):
+        capacity = max(capacity or get_plot_capacity(), 1)
+        self._x = np.zeros(capacity)
+        self._y = np.zeros(capacity)
+        self._nx = 0
+        self._ny = 0
         self.curve = None
+        self.version = 0
+
+    @staticmethod
+    def _append(array, size, val):
+        if size == array.shape[0]:
+            new = np.zeros(2 * size)
+            new[:size] = array
+            array = new
+        array[size] = val
+        return array
 
     def add_x(self, val):
-        self.xdata.append(val)
+        self._x = self._append(self._x, self._nx, val)
+        self._nx += 1
 
     def add_y(self, val):
-        self.ydata.append(val)
+        self._y = self._append(self._y, self._ny, val)
+        self._ny += 1
 
-    def update_curve(self):
-        self.curve.set_data(self.xdata, self.ydata)
+    @property
+    def xdata(self):
+        return self._x[:self._nx]
+
+    @property
+    def ydata(self):
+        return self._y[:self._ny]
 
+    def __len__(self):
+        return self._ny
 
+    def tolist(self):
+        """
+        :return: xdata, ydata as lists of python floats (for the messages)
+        """
+        return self.xdata.tolist(), self.ydata.tolist()
+
+    def update_curve(self):
+        self.curve.set_data(self.xdata, self.ydata)
+        self.version += 1
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the renderer of the live plots of the decision screen.
+The curves are animated artists: the static part of each plot (axes,
+ticks, grid, title) is drawn once and kept as a background, and at each
+frame only the curves whose data changed are drawn on it and blitted.
+Nothing is drawn if the window is not visible, and a frame stops when
+FRAME_BUDGET is spent (the remaining plots are drawn at the next frame).
+The figures are created without pyplot, by the FigurePool of the remote.
+"""
+
+# built-in
+import logging
+from collections import deque
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
+
+# controlOptimal
+import controlOptimalParams as pms
+from controlOptimalScheduler import monotonic
+
+
+logger = logging.getLogger("le2m")
+
+
+class BlitPlot(object):
+    def __init__(self, canvas, axes, plot_data):
+        """
+        :param canvas: the FigureCanvas
+        :param axes: the axes of the curve
+        :param plot_data: the PlotData, with its curve
+        """
+        self.canvas = canvas
+        self.axes = axes
+        self.plot_data = plot_data
+        self.background = None
+        self.version_drawn = None
+        plot_data.curve.set_animated(True)
+        # a full draw (first display, resize) renews the background
+        self.connection = canvas.mpl_connect("draw_event", self._on_draw)
+
+    def close(self):
+        self.canvas.mpl_disconnect(self.connection)
+        self.plot_data.curve.set_animated(False)
+
+    def _on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        # the curve is animated, a full draw leaves it out
+        self.axes.draw_artist(self.plot_data.curve)
+        self.canvas.blit(self.axes.bbox)
+        self.version_drawn = self.plot_data.version
+
+    @property
+    def dirty(self):
+        return self.version_drawn != self.plot_data.version
+
+    def render(self):
+        if self.background is None:
+            self.canvas.draw()  # calls _on_draw
+            return
+        self.canvas.restore_region(self.background)
+        self.axes.draw_artist(self.plot_data.curve)
+        self.canvas.blit(self.axes.bbox)
+        self.version_drawn = self.plot_data.version
+
+
+class PlotRenderer(object):
+    def __init__(self, widget, plots):
+        """
+        :param widget: the window of the plots, nothing is drawn if it is
+        not visible
+        :param plots: list of (canvas, axes, plot_data)
+        """
+        self.widget = widget
+        self.plots = [BlitPlot(*p) for p in plots]
+        self.budget = pms.FRAME_BUDGET.total_seconds()
+        self.next_plot = 0  # where the previous frame stopped
+        self.frame_times = deque(maxlen=1000)  # the last frames
+        self.frames_drawn = 0
+        self.frames_skipped = 0
+        self.frames_over_budget = 0
+
+    def is_visible(self):
+        return self.widget.isVisible() and \
+            not self.widget.isMinimized() and \
+            not self.widget.visibleRegion().isEmpty()
+
+    def render(self):
+        """
+        Draw the plots whose data changed since their last drawing
+        :return: the number of plots drawn
+        """
+        dirty = [p for p in self.plots if p.dirty]
+        if not dirty or not self.is_visible():
+            self.frames_skipped += 1
+            return 0
+        start = monotonic()
+        nb = len(self.plots)
+        drawn = 0
+        for i in range(nb):
+            plot = self.plots[(self.next_plot + i) % nb]
+            if not plot.dirty:
+                continue
+            plot.render()
+            drawn += 1
+            if monotonic() - start > self.budget:
+                self.next_plot = (self.next_plot + i + 1) % nb
+                self.frames_over_budget += 1
+                break
+        self.frame_times.append(monotonic() - start)
+        self.frames_drawn += 1
+        return drawn
+
+    def close(self):
+        """
+        Stop the blitting, the canvases can then be used by other screens
+        """
+        for plot in self.plots:
+            plot.close()
+
+    def get_report(self):
+        if not self.frame_times:
+            return u"Frames: none drawn, {} skipped".format(self.frames_skipped)
+        return u"Frames: {} drawn, mean {:.1f} ms, max {:.1f} ms, {} over " \
+               u"budget, {} skipped".format(
+                self.frames_drawn,
+                sum(self.frame_times) / len(self.frame_times) * 1000,
+                max(self.frame_times) * 1000, self.frames_over_budget,
+                self.frames_skipped)
+
+
+class FigurePool(object):
+    """
+    The figures of the plots of a part, with their canvas. They are created
+    without pyplot, so they are not kept by its global figure manager. The
+    decision screen and the summary screen use the same ones, and they are
+    released at the end of the part.
+    """
+
+    def __init__(self):
+        self.items = {}
+
+    def get(self, name):
+        """
+        :param name: the name of the plot
+        :return: figure (cleared), canvas
+        """
+        try:
+            figure, canvas = self.items[name]
+            figure.clear()
+        except KeyError:
+            figure = Figure()
+            canvas = FigureCanvas(figure)
+            self.items[name] = figure, canvas
+        return figure, canvas
+
+    def release(self):
+        for figure, canvas in self.items.values():
+            figure.clear()
+            canvas.setParent(None)
+            canvas.deleteLater()
+        self.items.clear()
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+This module replays the recorded parts from the database, without server
+nor clients. The extractions (ExtractionsCO: extraction and time) are the
+events: the state of every player at every tick is rebuilt from them with
+the rules of TickEngine.update_data (reset of the extractions of a group
+that extracts more than its stock, payoff on the resource before the tick,
+then the new resource), in one vectorized step per tick for all the players
+of all the parts.
+Each extraction stores the values of the last tick it was in force, they are
+compared with the replayed ones, and the part payoff (CO_gain_ecus) is
+computed again as in TickHistory.get_part_payoff. The parameters of the game
+can be changed (param_r, RESOURCE_GROWTH...) to score the same extractions
+again.
+
+An extraction is in force from the tick at which the server applied it
+(CO_tick_time, the time of the scheduler), or for the parts recorded without
+it from the first tick whose time is not before its time (the clock of the
+server: a late tick makes them differ). The initial extraction and those of
+the discrete game are in force from their period.
+The extractions made within one tick are stored only if the scheduler was
+late, the replay then keeps the last one and the others are reported as
+collapsed.
+
+Usage: python controlOptimalReplay.py le2m.sqlite [--param param_r=0.02]
+[--tolerance 1e-6]
+"""
+
+# built-in
+from __future__ import print_function
+import argparse
+import logging
+import time
+from collections import OrderedDict
+import numpy as np
+import sqlalchemy
+from sqlalchemy import create_engine, select
+
+# le2m
+from server.servparties import Partie
+
+# controlOptimal
+import controlOptimalParams as pms
+from controlOptimalPart import PartieCO, RepetitionsCO, ExtractionsCO
+
+
+logger = logging.getLogger("le2m")
+
+TOLERANCE = 1e-6
+REPLAY_PARAMS = ["param_a", "param_b", "param_c0", "param_c1", "param_r",
+                 "RESOURCE_INITIAL_STOCK", "RESOURCE_GROWTH",
+                 "CONTINUOUS_TIME_DURATION", "SIMULATION_STEP",
+                 "GROUP_RESOURCE"]
+
+_LEGACY_SELECT = sqlalchemy.__version__.split(".")[:2] < ["1", "4"]
+
+
+def _select(columns):
+    if _LEGACY_SELECT:
+        return select(columns)
+    return select(*columns)
+
+
+def _get_session_column():
+    """
+    :return: the column of the session in the le2m parts table, None if it
+    has none (one database per session)
+    """
+    for column in Partie.__table__.columns:
+        if u"session" in column.name:
+            return column
+    return None
+
+
+def _to_array(values, dtype=np.float64):
+    # None (value never written) -> nan
+    return np.array([np.nan if v is None else v for v in values],
+                    dtype=dtype)
+
+
+class Recording(object):
+    """
+    The parts of one dynamic type and their extractions, as arrays
+    """
+
+    def __init__(self, connection, dynamic_type=None):
+        """
+        :param connection: sqlalchemy engine or connection
+        :param dynamic_type: pms.CONTINUOUS or pms.DISCRETE, default the one
+        of controlOptimalParams
+        """
+        self.dynamic_type = pms.DYNAMIC_TYPE if dynamic_type is None \
+            else dynamic_type
+        part = PartieCO.__table__
+        # the groups are numbered in each sequence of each session
+        session = _get_session_column()
+        query = _select([
+            part.c.partie_id, part.c.CO_sequence, part.c.CO_group,
+            part.c.CO_gain_ecus] + ([] if session is None else [session]))
+        if session is not None:
+            query = query.select_from(part.join(
+                session.table, part.c.partie_id == session.table.c.id))
+        rows = connection.execute(query.where(
+            part.c.CO_dynamic_type == self.dynamic_type).order_by(
+            part.c.partie_id)).fetchall()
+        columns = list(zip(*rows)) if rows else [()] * 5
+        if session is None:
+            columns.append([None] * len(rows))
+        self.partie_id = np.array(columns[0], dtype=np.int64)
+        self.groups = [u"{}_{}_{}".format(session_id, sequence, group)
+                       for sequence, group, session_id in zip(
+                           columns[1], columns[2], columns[4])]
+        self.gain_ecus = _to_array(columns[3])
+
+        extractions, repetitions = ExtractionsCO.__table__, \
+            RepetitionsCO.__table__
+        rows = connection.execute(_select([
+            extractions.c.id, repetitions.c.partie_partie_id,
+            repetitions.c.CO_period, extractions.c.CO_extraction,
+            extractions.c.CO_extraction_time, extractions.c.CO_resource,
+            extractions.c.CO_payoff,
+            extractions.c.CO_tick_time]).select_from(extractions.join(
+                repetitions, extractions.c.repetitions_id ==
+                repetitions.c.id).join(
+                part, repetitions.c.partie_partie_id == part.c.partie_id)).
+            where(part.c.CO_dynamic_type == self.dynamic_type).order_by(
+            extractions.c.id)).fetchall()
+        columns = list(zip(*rows)) if rows else [()] * 8
+        self.id = np.array(columns[0], dtype=np.int64)
+        self.player = np.searchsorted(
+            self.partie_id, np.array(columns[1], dtype=np.int64))
+        self.period = np.array(columns[2], dtype=np.int64)
+        self.extraction = _to_array(columns[3])
+        self.time = _to_array(columns[4])
+        self.resource = _to_array(columns[5])
+        self.payoff = _to_array(columns[6])
+        self.tick_time = _to_array(columns[7])  # nan before it was stored
+
+    @property
+    def nb_players(self):
+        return self.partie_id.size
+
+    @property
+    def nb_extractions(self):
+        return self.id.size
+
+
+class Replay(object):
+    def __init__(self, recording, tolerance=TOLERANCE, **params):
+        """
+        :param recording: the Recording
+        :param tolerance: the absolute difference above which a replayed
+        value diverges from the stored one
+        :param params: the parameters of the game, the other parameters have
+        the values of controlOptimalParams (REPLAY_PARAMS;
+        CONTINUOUS_TIME_DURATION and SIMULATION_STEP in seconds)
+        """
+        for k in params:
+            if k not in REPLAY_PARAMS:
+                raise ValueError(u"{} can't be replayed".format(k))
+        self.recording = recording
+        self.tolerance = tolerance
+        self.overrides = sorted(params)  # the parameters changed
+        self.continuous = recording.dynamic_type == pms.CONTINUOUS
+        # a tick is one period in the discrete game (get_tick_duration)
+        self.dt = float(params.pop(
+            "SIMULATION_STEP", pms.SIMULATION_STEP.total_seconds()))
+        if not self.continuous:
+            self.dt = 1.
+        self.game_duration = float(params.pop(
+            "CONTINUOUS_TIME_DURATION",
+            pms.CONTINUOUS_TIME_DURATION.total_seconds()))
+        self.initial_stock = params.pop("RESOURCE_INITIAL_STOCK",
+                                        pms.RESOURCE_INITIAL_STOCK)
+        self.group_resource = params.pop("GROUP_RESOURCE", pms.GROUP_RESOURCE)
+        self.params = params
+        if self.continuous:
+            # as the scheduler of the server
+            self.nb_ticks = int(round(self.game_duration / self.dt))
+        else:
+            self.nb_ticks = int(recording.period.max()) \
+                if recording.period.size else 0
+
+        # the values of the last tick of each extraction (nan if the
+        # extraction has not been in force in the replay)
+        self.replayed_resource = np.full(recording.nb_extractions, np.nan)
+        self.replayed_payoff = np.full(recording.nb_extractions, np.nan)
+        self.gain_ecus = np.zeros(recording.nb_players)
+        self.collapsed = 0
+        self.after_end = 0
+        self.resets = 0
+        self.duration = None
+
+    def get_ticks(self):
+        """
+        The tick of the first tick time stored with the extraction, otherwise
+        (parts recorded before CO_tick_time) the first tick not before its
+        time, which differs if the scheduler was late
+        :return: the tick at which each extraction is put in force
+        """
+        recording = self.recording
+        if not self.continuous:
+            return recording.period.copy()
+        ticks = np.where(np.isnan(recording.tick_time),
+                         np.ceil(recording.time / self.dt - 1e-9),
+                         np.rint(recording.tick_time / self.dt))
+        ticks = np.maximum(np.nan_to_num(ticks), 1).astype(np.int64)
+        ticks[recording.period == 0] = 0
+        return ticks
+
+    def get_xdata(self, tick):
+        """
+        The abscissa of the tick, as TickEngine.get_xdata
+        """
+        if tick == 0 or not self.continuous:
+            return tick
+        return round(tick * self.dt, 3)
+
+    def run(self):
+        """
+        Replay every tick of the parts
+        :return: self
+        """
+        start = time.time()
+        recording = self.recording
+        nb = recording.nb_players
+        dt = self.dt
+        growth = self.params.get("RESOURCE_GROWTH", pms.RESOURCE_GROWTH)
+
+        # __ the events, sorted by tick and player, only the last one of a
+        # player at a tick __
+        ticks = self.get_ticks()
+        order = np.lexsort((np.arange(ticks.size), recording.player, ticks))
+        ticks, player = ticks[order], recording.player[order]
+        last = np.ones(order.size, dtype=bool)
+        last[:-1] = (ticks[1:] != ticks[:-1]) | (player[1:] != player[:-1])
+        self.collapsed = int(order.size - last.sum())
+        self.after_end = int((ticks[last] > self.nb_ticks).sum())
+        order, ticks, player = order[last], ticks[last], player[last]
+        values = recording.extraction[order]
+        bounds = np.searchsorted(ticks, np.arange(self.nb_ticks + 2))
+
+        if self.group_resource:
+            group_index = np.unique(recording.groups, return_inverse=True)[1]
+        else:
+            group_index = np.arange(nb)
+        group_index = group_index.astype(np.intp)
+        nb_groups = int(group_index.max()) + 1 if nb else 0
+        group_resource = np.full(nb_groups, self.initial_stock,
+                                 dtype=np.float64)
+        resource = group_resource[group_index]
+        extraction = np.zeros(nb)
+        current = np.full(nb, -1, dtype=np.int64)  # the extraction in force
+        cumulative = np.zeros(nb)
+        group_extraction = np.zeros(nb_groups)
+        xdata = 0
+
+        for tick in range(self.nb_ticks + 1):
+            first, stop = bounds[tick], bounds[tick + 1]
+            if stop > first:
+                extraction[player[first:stop]] = values[first:stop]
+                current[player[first:stop]] = order[first:stop]
+
+            group_extraction = np.bincount(group_index, weights=extraction,
+                                           minlength=nb_groups)
+            over = group_extraction * dt > group_resource
+            if over.any():
+                reset = over[group_index] & (extraction > 0)
+                # the server would have stored a new extraction of 0
+                self.resets += int(reset.sum())
+                extraction[reset] = 0
+                current[reset] = -1
+                group_extraction = np.bincount(
+                    group_index, weights=extraction, minlength=nb_groups)
+
+            payoff = pms.get_instant_payoff(resource, extraction,
+                                            **self.params)[2]
+            group_resource -= group_extraction * dt
+            group_resource += growth * dt
+            resource = group_resource[group_index]
+
+            xdata = self.get_xdata(tick)
+            if self.continuous:
+                cumulative += pms.get_discount(xdata, **self.params) * \
+                    payoff * dt
+            in_force = current >= 0
+            self.replayed_resource[current[in_force]] = resource[in_force]
+            self.replayed_payoff[current[in_force]] = payoff[in_force]
+
+        # __ the part payoff, as TickHistory.get_part_payoff (0 in the
+        # discrete game) __
+        if self.continuous and nb:
+            others = group_extraction[group_index] - extraction
+            params = dict(self.params)
+            params["RESOURCE_GROWTH"] = growth - others
+            self.gain_ecus = cumulative + pms.get_infinite_payoff_array(
+                xdata, resource, extraction, DYNAMIC_TYPE=pms.CONTINUOUS,
+                **params)
+        self.duration = time.time() - start
+        return self
+
+    def get_divergences(self):
+        """
+        :return: the differences replayed - stored of the resource and of the
+        payoff of each extraction (nan if not replayed), the extractions
+        that diverge
+        """
+        resource = self.replayed_resource - self.recording.resource
+        payoff = self.replayed_payoff - self.recording.payoff
+        diverging = ~((np.abs(resource) <= self.tolerance) &
+                      (np.abs(payoff) <= self.tolerance))
+        return resource, payoff, diverging
+
+    def get_parts(self):
+        """
+        :return: dictionary of arrays, one element per part
+        """
+        resource, payoff, diverging = self.get_divergences()
+        player = self.recording.player
+        return OrderedDict([
+            ("partie_id", self.recording.partie_id),
+            ("gain_ecus", self.recording.gain_ecus),
+            ("replayed_gain_ecus", self.gain_ecus),
+            ("nb_extractions", np.bincount(
+                player, minlength=self.recording.nb_players)),
+            ("nb_diverging", np.bincount(
+                player, weights=diverging,
+                minlength=self.recording.nb_players).astype(np.int64))])
+
+    def get_params(self):
+        """
+        :return: OrderedDict, the parameters of the replay (REPLAY_PARAMS)
+        """
+        params = OrderedDict(
+            (k, self.params.get(k, getattr(pms, k))) for k in
+            ["param_a", "param_b", "param_c0", "param_c1", "param_r",
+             "RESOURCE_GROWTH"])
+        params["RESOURCE_INITIAL_STOCK"] = self.initial_stock
+        params["GROUP_RESOURCE"] = self.group_resource
+        if self.continuous:
+            params["SIMULATION_STEP"] = self.dt
+            params["CONTINUOUS_TIME_DURATION"] = self.game_duration
+        return params
+
+    def get_report(self):
+        recording = self.recording
+        resource, payoff, diverging = self.get_divergences()
+        gain = np.abs(self.gain_ecus - recording.gain_ecus)
+        lines = [
+            u"Replay: {} parts, {} extractions, {} ticks in {:.3f} s".format(
+                recording.nb_players, recording.nb_extractions,
+                self.nb_ticks + 1, self.duration),
+            u"Parameters: {}".format(u", ".join(
+                u"{}={}{}".format(k, v, u" (changed)" if k in self.overrides
+                                  else u"")
+                for k, v in self.get_params().items()))]
+        if self.continuous and self.duration:
+            lines.append(u"{:.0f} x real time".format(
+                self.nb_ticks * self.dt / self.duration))
+        lines.append(
+            u"Extractions collapsed in a tick: {}, after the end: {}, "
+            u"reset by the replay: {}".format(self.collapsed, self.after_end,
+                                              self.resets))
+        if recording.nb_extractions:
+            lines.append(
+                u"Max difference: resource {:.3g}, payoff {:.3g}".format(
+                    np.nanmax(np.abs(resource)) if (~np.isnan(
+                        resource)).any() else np.nan,
+                    np.nanmax(np.abs(payoff)) if (~np.isnan(
+                        payoff)).any() else np.nan))
+        lines.append(u"Extractions diverging (> {:g}): {}".format(
+            self.tolerance, int(diverging.sum())))
+        if diverging.any():
+            first = int(np.flatnonzero(diverging)[0])
+            lines.append(
+                u"First: extraction {} of part {}, time {}, resource {} "
+                u"(replayed {}), payoff {} (replayed {})".format(
+                    recording.id[first],
+                    recording.partie_id[recording.player[first]],
+                    recording.time[first], recording.resource[first],
+                    self.replayed_resource[first], recording.payoff[first],
+                    self.replayed_payoff[first]))
+        if self.continuous and recording.nb_players:
+            lines.append(
+                u"Part payoff: max difference {:.3g}, parts diverging "
+                u"(> {:g}): {}".format(
+                    np.nanmax(gain) if (~np.isnan(gain)).any() else np.nan,
+                    self.tolerance, int((~(gain <= self.tolerance)).sum())))
+        return u"\n".join(lines)
+
+
+def _parse_param(text):
+    name, value = text.split("=", 1)
+    if name == "GROUP_RESOURCE":
+        return name, value.lower() in ("1", "true", "yes")
+    return name, float(value)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=u"Replay of the parts")
+    parser.add_argument("database", help=u"the sqlite file of le2m")
+    parser.add_argument("--dynamic", choices=["continuous", "discrete"],
+                        default=None, help=u"default the one of the params")
+    parser.add_argument("--param", action="append", default=[],
+                        type=_parse_param, metavar="NAME=VALUE",
+                        help=u"one of {}".format(u", ".join(REPLAY_PARAMS)))
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    dynamic_type = {None: None, "continuous": pms.CONTINUOUS,
+                    "discrete": pms.DISCRETE}[args.dynamic]
+    engine = create_engine(u"sqlite:///{}".format(args.database))
+    with engine.connect() as connection:
+        recording = Recording(connection, dynamic_type)
+    replay = Replay(recording, args.tolerance, **dict(args.param)).run()
+    print(replay.get_report())
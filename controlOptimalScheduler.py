@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the scheduler of the ticks of the continuous game.
+The step k is due at start + k * step on a monotonic clock, and its time is
+exactly k * step (rounded to the millisecond). If the timer fires late (busy
+machine), the steps that are due are all run, in order, so that no step is
+skipped or run twice and the last step is at CONTINUOUS_TIME_DURATION.
+The clients import monotonic from this module: QTimer and the metrics are
+imported only when a scheduler is created.
+"""
+
+# built-in
+import logging
+import math
+import os
+import sys
+
+try:
+    from time import monotonic
+except ImportError:  # python 2
+    if sys.platform == "win32":
+        from time import clock as monotonic  # QueryPerformanceCounter
+    else:
+        def monotonic():
+            # elapsed real time since an arbitrary point, not changed by
+            # the setting of the clock
+            return os.times()[4]
+
+
+logger = logging.getLogger("le2m")
+
+# upper bounds (milliseconds) of the bins of the lateness histogram
+LATENESS_BINS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float("inf")]
+
+
+class FixedStepScheduler(object):
+    def __init__(self, step, nb_steps, callback, finished=None):
+        """
+        :param step: timedelta, the time between two steps
+        :param nb_steps: the steps are 1 to nb_steps
+        :param callback: called with the time of the step (k * step, in
+        seconds, rounded to the millisecond)
+        :param finished: called after the last step
+        """
+        self.step = step.total_seconds()
+        self.nb_steps = nb_steps
+        self.callback = callback
+        self.finished = finished
+        self.origin = None
+        self.next_step = 1
+        self.catch_ups = 0
+        self.lateness_max = 0.
+        self.lateness_histogram = [0] * len(LATENESS_BINS)
+        from PyQt4.QtCore import QTimer
+        import controlOptimalMetrics
+        self.metrics = controlOptimalMetrics
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._wake_up)
+
+    @property
+    def running(self):
+        return self.origin is not None and self.next_step <= self.nb_steps
+
+    def start(self):
+        self.origin = monotonic()
+        self.next_step = 1
+        self._schedule()
+
+    def stop(self):
+        self.timer.stop()
+        self.next_step = self.nb_steps + 1
+
+    def _schedule(self):
+        delay = self.origin + self.next_step * self.step - monotonic()
+        self.timer.start(max(0, int(math.ceil(delay * 1000))))
+
+    def _record_lateness(self, lateness):
+        self.metrics.observe(self.metrics.TICK_LATENESS, max(0., lateness))
+        lateness_ms = max(0., lateness * 1000)
+        self.lateness_max = max(self.lateness_max, lateness_ms)
+        for i, upper_bound in enumerate(LATENESS_BINS):
+            if lateness_ms <= upper_bound:
+                self.lateness_histogram[i] += 1
+                break
+
+    def _wake_up(self):
+        now = monotonic()
+        due = min(self.nb_steps,
+                  int(math.floor((now - self.origin) / self.step + 1e-9)))
+        first = self.next_step
+        for k in range(first, due + 1):
+            if not self.running:  # stopped by the callback
+                return
+            self._record_lateness(now - (self.origin + k * self.step))
+            if k > first:
+                self.catch_ups += 1
+            self.next_step = k + 1
+            self.callback(round(k * self.step, 3))
+        if self.next_step > self.nb_steps:
+            self.timer.stop()
+            if self.finished is not None:
+                self.finished()
+        elif self.running:
+            self._schedule()
+
+    def get_report(self):
+        bins = []
+        lower = 0
+        for upper_bound, count in zip(LATENESS_BINS, self.lateness_histogram):
+            if count:
+                bins.append(u"{}-{} ms: {}".format(
+                    lower, upper_bound if upper_bound != float("inf")
+                    else u"+", count))
+            lower = upper_bound
+        return u"Ticks: {} catch-ups, lateness max {:.0f} ms ({})".format(
+            self.catch_ups, self.lateness_max, u", ".join(bins))
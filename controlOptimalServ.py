@@ -5,8 +5,9 @@ import logging
 from collections import OrderedDict
 from twisted.internet import defer
 from datetime import datetime
-from PyQt4.QtCore import QTimer, QObject, pyqtSlot
+from PyQt4.QtCore import QObject, pyqtSlot
 from PyQt4.QtGui import QMessageBox
+from sqlalchemy.orm import object_session
 
 # le2m
 from util import utiltools
@@ -18,6 +19,12 @@ from server.servgui.servguidialogs import DSequence, GuiPayoffs
 import controlOptimalParams as pms
 from controlOptimalTexts import trans_CO
 from controlOptimalGui import DConfigure
+from controlOptimalSolver import solve
+from controlOptimalEngine import TickEngine
+from controlOptimalDbWriter import BatchWriter
+from controlOptimalScheduler import FixedStepScheduler
+import controlOptimalMetrics as metrics
+from controlOptimalLog import TickTrace, start_queue_logging
 
 
 logger = logging.getLogger("le2m.{}".format(__name__))
@@ -29,6 +36,11 @@ class Serveur(object):
         self.current_sequence = 0
         self.current_period = 0
         self.all = []
+        self.engine = None
+        self.writer = None
+        self.scheduler = None
+        self.metrics_port = None
+        start_queue_logging()
 
         # creation of the menu (will be placed in the "part" menu on the
         # server screen)
@@ -38,6 +50,10 @@ class Serveur(object):
             lambda _: self.le2mserv.gestionnaire_graphique. \
             display_information2(
                 utiltools.get_module_info(pms), le2mtrans(u"Parameters"))
+        actions[trans_CO(u"Display metrics")] = \
+            lambda _: self.le2mserv.gestionnaire_graphique. \
+            display_information2(metrics.registry.get_report(),
+                                 trans_CO(u"Metrics"))
         actions[le2mtrans(u"Start")] = lambda _: self.demarrer()
         actions[le2mtrans(u"Display payoffs")] = \
             lambda _: self.display_payoffs()
@@ -69,6 +85,17 @@ class Serveur(object):
                         le2mtrans("Start") + " Control Optimal?"):
             return
 
+        # __ form groups, the members of a group share the stock __
+        if pms.GROUP_RESOURCE:
+            try:
+                self.le2mserv.gestionnaire_groupes.former_groupes(
+                    self.le2mserv.gestionnaire_joueurs.get_players(),
+                    pms.TAILLE_GROUPES, forcer_nouveaux=True)
+            except ValueError as e:
+                self.le2mserv.gestionnaire_graphique.display_error(
+                    u"{}".format(e))
+                return
+
         # ----------------------------------------------------------------------
         # init part
         # ----------------------------------------------------------------------
@@ -76,10 +103,27 @@ class Serveur(object):
         self.current_sequence += 1
         self.current_period = 0
 
+        # __ the metrics are those of the current part __
+        metrics.registry.clear()
+        if pms.METRICS_ENABLED and self.metrics_port is None:
+            self.metrics_port = metrics.start_endpoint()
+
+        # __ optimal solution, benchmark for the efficiency (of a player
+        # alone with the stock) __
+        optimal_solution = None
+        if pms.DYNAMIC_TYPE == pms.CONTINUOUS and not pms.GROUP_RESOURCE:
+            optimal_solution = solve()
+            self.le2mserv.gestionnaire_graphique.infoserv(
+                u"Optimal solution: {} iterations, residual {:.2e}, "
+                u"{:.2f} s".format(optimal_solution.iterations,
+                                   optimal_solution.residual,
+                                   optimal_solution.elapsed))
+
         # __ creates parts ___
         yield (self.le2mserv.gestionnaire_experience.init_part(
             "controlOptimal", "PartieCO", "RemoteCO", pms,
-            current_sequence=self.current_sequence))
+            current_sequence=self.current_sequence,
+            optimal_solution=optimal_solution))
         self.all = self.le2mserv.gestionnaire_joueurs.get_players(
             'controlOptimal')
 
@@ -87,90 +131,140 @@ class Serveur(object):
         yield (self.le2mserv.gestionnaire_experience.run_step(
             le2mtrans(u"Configure"), self.all, "configure"))
 
-        # ----------------------------------------------------------------------
-        # SELECT THE INITIAL EXTRACTION
-        # ----------------------------------------------------------------------
-
-        self.le2mserv.gestionnaire_experience.run_func(self.all, "newperiod", 0)
-        yield (self.le2mserv.gestionnaire_experience.run_step(
-            trans_CO(u"Initial extraction"), self.all, "set_initial_extraction"))
-        self.le2mserv.gestionnaire_experience.run_func(
-            self.all, "update_data")
+        # __ one engine computes the ticks of every player __
+        self.engine = TickEngine(self.all)
+        if pms.TICK_TRACE:
+            self.engine.trace = TickTrace(
+                [u"{}".format(j.joueur) for j in self.all])
 
-        # ----------------------------------------------------------------------
-        # DEPENDS ON TREATMENT
-        # ----------------------------------------------------------------------
+        # __ the extractions and curves are written by a worker thread __
+        self.writer = BatchWriter(object_session(self.all[0]).get_bind())
+        for j in self.all:
+            j.writer = self.writer
 
-        if pms.DYNAMIC_TYPE == pms.CONTINUOUS:
+        # __ the writer is closed (remaining rows written) even if the part
+        # fails __
+        try:
+            # ------------------------------------------------------------------
+            # SELECT THE INITIAL EXTRACTION
+            # ------------------------------------------------------------------
 
-            txt = le2mtrans(u"Period") + u" 1"
-            self.le2mserv.gestionnaire_graphique.infoserv(
-                txt, fg="white", bg="gray")
-            self.le2mserv.gestionnaire_graphique.infoclt(
-                txt, fg="white", bg="gray")
             yield (self.le2mserv.gestionnaire_experience.run_func(
-                self.all, "newperiod", 1))
-
-            # __ timer continuous part __
-            QTimer.singleShot(
-                pms.CONTINUOUS_TIME_DURATION.total_seconds()*1000 + 1000,
-                self.slot_time_elapsed)
-            time_start = datetime.now()
-            self.le2mserv.gestionnaire_graphique.infoserv(
-                "Start time: {}".format(time_start.strftime("%H:%M:%S")))
-            for j in self.all:
-                j.time_start = time_start
-                j.timer_update.start()
-            yield(self.le2mserv.gestionnaire_experience.run_step(
-                trans_CO("Decision"), self.all, "display_decision",
-                time_start))
-
-        elif pms.DYNAMIC_TYPE == pms.DISCRETE:
+                self.all, "newperiod", 0))
+            self.commit_periods()
+            self.engine.new_period(0)
+            yield (self.le2mserv.gestionnaire_experience.run_step(
+                trans_CO(u"Initial extraction"), self.all,
+                "set_initial_extraction"))
+            self.engine.update_data()
 
-            for period in range(1, pms.NOMBRE_PERIODES + 1):
+            # ------------------------------------------------------------------
+            # DEPENDS ON TREATMENT
+            # ------------------------------------------------------------------
 
-                if self.le2mserv.gestionnaire_experience.stop_repetitions:
-                    break
+            if pms.DYNAMIC_TYPE == pms.CONTINUOUS:
 
-                # init period
-                txt = le2mtrans(u"Period") + u" {}".format(period)
+                txt = le2mtrans(u"Period") + u" 1"
                 self.le2mserv.gestionnaire_graphique.infoserv(
-                    [txt], fg="white", bg="gray")
+                    txt, fg="white", bg="gray")
                 self.le2mserv.gestionnaire_graphique.infoclt(
-                    [txt], fg="white", bg="gray")
+                    txt, fg="white", bg="gray")
                 yield (self.le2mserv.gestionnaire_experience.run_func(
-                    self.all, "newperiod", period))
-
-                # decision
+                    self.all, "newperiod", 1))
+                self.commit_periods()
+                self.engine.new_period(1)
+
+                # __ ticks of the continuous part, the last one at the end of
+                # the duration __
+                self.scheduler = FixedStepScheduler(
+                    pms.SIMULATION_STEP,
+                    int(round(pms.CONTINUOUS_TIME_DURATION.total_seconds() /
+                              pms.SIMULATION_STEP.total_seconds())),
+                    self.engine.update_data, self.slot_time_elapsed)
                 time_start = datetime.now()
+                self.le2mserv.gestionnaire_graphique.infoserv(
+                    "Start time: {}".format(time_start.strftime("%H:%M:%S")))
+                for j in self.all:
+                    j.time_start = time_start
+                self.engine.time_start = time_start
+                self.scheduler.start()
                 yield(self.le2mserv.gestionnaire_experience.run_step(
-                    "Decision", self.all, "display_decision", time_start))
+                    trans_CO("Decision"), self.all, "display_decision",
+                    time_start))
 
-                self.le2mserv.gestionnaire_experience.run_func(
-                    self.all, "update_data")
+            elif pms.DYNAMIC_TYPE == pms.DISCRETE:
 
-            self.slot_time_elapsed()
+                for period in range(1, pms.NOMBRE_PERIODES + 1):
 
-        # ----------------------------------------------------------------------
-        # summary
-        # ----------------------------------------------------------------------
+                    if self.le2mserv.gestionnaire_experience.stop_repetitions:
+                        break
+
+                    # init period
+                    txt = le2mtrans(u"Period") + u" {}".format(period)
+                    self.le2mserv.gestionnaire_graphique.infoserv(
+                        [txt], fg="white", bg="gray")
+                    self.le2mserv.gestionnaire_graphique.infoclt(
+                        [txt], fg="white", bg="gray")
+                    yield (self.le2mserv.gestionnaire_experience.run_func(
+                        self.all, "newperiod", period))
+                    self.commit_periods()
+                    self.engine.new_period(period)
+
+                    # decision
+                    time_start = datetime.now()
+                    self.engine.time_start = time_start
+                    yield(self.le2mserv.gestionnaire_experience.run_step(
+                        "Decision", self.all, "display_decision", time_start))
+
+                    self.engine.update_data()
+                    yield (self.writer.flush())
+
+                self.slot_time_elapsed()
+
+            # ------------------------------------------------------------------
+            # summary
+            # ------------------------------------------------------------------
+
+            yield(self.le2mserv.gestionnaire_experience.run_step(
+                le2mtrans(u"Summary"), self.all, "display_summary"))
+            yield (self.writer.flush())
+            self.le2mserv.gestionnaire_graphique.infoserv(
+                self.writer.get_info())
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.stop()
+                self.scheduler = None
+            yield (self.writer.close())
 
-        yield(self.le2mserv.gestionnaire_experience.run_step(
-            le2mtrans(u"Summary"), self.all, "display_summary"))
-        
         # ----------------------------------------------------------------------
         # End of part
         # ----------------------------------------------------------------------
 
         yield (self.le2mserv.gestionnaire_experience.finalize_part("controlOptimal"))
 
+    def commit_periods(self):
+        """
+        The periods created by newperiod are committed together, once per
+        period: the batch writer needs their id
+        """
+        object_session(self.all[0].currentperiod).commit()
+
     @defer.inlineCallbacks
     @pyqtSlot()
     def slot_time_elapsed(self):
         self.le2mserv.gestionnaire_graphique.infoserv("End time: {}".format(
             datetime.now().strftime("%H:%M:%S")))
-        for j in self.all:
-            j.timer_update.stop()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.le2mserv.gestionnaire_graphique.infoserv(
+                self.scheduler.get_report())
+            self.scheduler = None
+            self.engine.send_updates()
+        if self.engine.trace is not None:
+            self.engine.trace.close()
+            self.le2mserv.gestionnaire_graphique.infoserv(
+                u"Tick trace: {}".format(self.engine.trace.path))
+            self.engine.trace = None
         yield (self.le2mserv.gestionnaire_experience.run_func(
             self.all, "end_update_data"))
 
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+This module computes the optimal extraction path, used as a benchmark to
+score the efficiency of the subjects.
+The dynamic is the one of the TickEngine: at each tick of duration dt
+(SIMULATION_STEP) the payoff rate is
+a * e - b / 2 * e^2 - max(0, e * (c0 - c1 * R)), then R becomes
+R + (growth - e) * dt, and the payoff of the tick t is discounted with
+exp(-r * t).
+The planner problem V(R) = max_e payoff(R, e) * dt +
+exp(-r * dt) * V(R + (g - e) * dt) is solved by (modified) policy iteration
+on a resource grid whose step is DECISION_STEP. With ticks of one second the
+next resource of a node is also a node, otherwise the value is interpolated
+between the two nearest nodes.
+"""
+
+# built-in
+import logging
+import time
+import numpy as np
+
+# controlOptimal
+import controlOptimalParams as pms
+
+
+logger = logging.getLogger("le2m")
+
+# number of evaluation sweeps between two improvements of the policy, for
+# ticks of one second (more sweeps for shorter ticks)
+EVALUATION_SWEEPS = 200
+
+
+class OptimalSolution(object):
+    """
+    The feedback policy and the value function on the resource grid, with the
+    information about the convergence of the solver
+    """
+
+    def __init__(self, resource_grid, extraction_grid, policy_index, value,
+                 iterations, residual, elapsed):
+        self.resource_grid = resource_grid
+        self.extraction_grid = extraction_grid
+        self.policy_index = policy_index
+        self.policy = extraction_grid[policy_index]
+        self.value = value
+        self.iterations = iterations
+        self.residual = residual
+        self.elapsed = elapsed
+
+    @property
+    def converged(self):
+        return self.residual <= pms.SOLVER_TOLERANCE
+
+    @property
+    def error_bound(self):
+        """
+        bound of |value - true value|, from the residual of the bellman
+        equation
+        """
+        discount = np.exp(- pms.param_r * pms.SIMULATION_STEP.total_seconds())
+        return self.residual * discount / (1 - discount)
+
+    def _get_index(self, resource):
+        step = self.resource_grid[1] - self.resource_grid[0]
+        index = np.rint((np.asarray(resource) - self.resource_grid[0]) / step)
+        return np.clip(index, 0, self.resource_grid.size - 1).astype(np.intp)
+
+    def get_extraction(self, resource):
+        """
+        The optimal extraction for the given resource(s)
+        """
+        return self.policy[self._get_index(resource)]
+
+    def get_value(self, resource):
+        """
+        The optimal discounted payoff from the given resource(s) at t=0
+        """
+        return np.interp(resource, self.resource_grid, self.value)
+
+    def get_trajectory(self, resource_initial=None, nb_ticks=None):
+        """
+        Apply the optimal policy with the rules of TickEngine.update_data.
+        :param resource_initial: default RESOURCE_INITIAL_STOCK
+        :param nb_ticks: default the number of ticks of the continuous part
+        :return: dictionary of arrays (time, extraction, resource, cost,
+        payoff, discounted_payoff, cumulative_payoff)
+        """
+        if resource_initial is None:
+            resource_initial = pms.RESOURCE_INITIAL_STOCK
+        dt = pms.SIMULATION_STEP.total_seconds()
+        if nb_ticks is None:
+            nb_ticks = int(pms.CONTINUOUS_TIME_DURATION.total_seconds() / dt)
+        the_time = np.arange(nb_ticks + 1) * dt
+        extraction = np.zeros(nb_ticks + 1)
+        resource = np.zeros(nb_ticks + 1)
+        current_resource = resource_initial
+        for t in range(nb_ticks + 1):
+            extraction[t] = self.get_extraction(current_resource)
+            if extraction[t] * dt > current_resource:
+                extraction[t] = 0
+            resource[t] = current_resource
+            current_resource -= extraction[t] * dt
+            current_resource += pms.RESOURCE_GROWTH * dt
+        benefice, cost, payoff = pms.get_instant_payoff(resource, extraction)
+        discounted = np.exp(- pms.param_r * the_time) * payoff * dt
+        return {"time": the_time, "extraction": extraction,
+                "resource": resource, "cost": cost, "payoff": payoff,
+                "discounted_payoff": discounted,
+                "cumulative_payoff": np.cumsum(discounted)}
+
+    def get_efficiency(self, part_payoff, resource_initial=None):
+        """
+        :param part_payoff: the payoff of the subject (CO_gain_ecus)
+        :return: the ratio between the payoff and the optimal one
+        """
+        if resource_initial is None:
+            resource_initial = pms.RESOURCE_INITIAL_STOCK
+        optimal = float(self.get_value(resource_initial))
+        if optimal == 0:
+            return None
+        return part_payoff / optimal
+
+
+def get_grids():
+    step = pms.DECISION_STEP
+    nb = int(round((pms.DECISION_MAX - pms.DECISION_MIN) / step))
+    extraction_grid = np.linspace(pms.DECISION_MIN, pms.DECISION_MAX, nb + 1)
+    resource_max = pms.SOLVER_RESOURCE_MAX
+    if resource_max is None:
+        resource_max = 2 * max(pms.RESOURCE_INITIAL_STOCK,
+                               pms.param_c0 / pms.param_c1)
+    nb = int(np.ceil(resource_max / step))
+    resource_grid = np.arange(nb + 1) * step
+    return resource_grid, extraction_grid
+
+
+def solve():
+    """
+    Solve the planner problem with the current parameters.
+    The resource above the grid is set to the top of the grid.
+    :return: OptimalSolution
+    """
+    start = time.time()
+    resource_grid, extraction_grid = get_grids()
+    step = resource_grid[1] - resource_grid[0]
+    dt = pms.SIMULATION_STEP.total_seconds()
+    discount = np.exp(- pms.param_r * dt)
+    sweeps = int(np.ceil(EVALUATION_SWEEPS / dt))
+
+    # rewards and transitions, for each (resource, extraction)
+    resource = resource_grid[:, np.newaxis]
+    extraction = extraction_grid[np.newaxis, :]
+    reward = pms.get_instant_payoff(resource, extraction)[2] * dt
+    # an extraction greater than the resource is set to 0 by the server
+    reward[extraction * dt > resource + 1e-9] = -np.inf
+    # the next resource is between the nodes next_index and next_index + 1
+    position = (resource + (pms.RESOURCE_GROWTH - extraction) * dt) / step
+    nearest = np.rint(position)
+    position = np.where(np.abs(position - nearest) < 1e-9, nearest, position)
+    position = np.clip(position, 0, resource_grid.size - 1)
+    next_index = np.minimum(np.floor(position),
+                            resource_grid.size - 2).astype(np.intp)
+    next_weight = position - next_index
+
+    def expected(value, index, weight):
+        return (1 - weight) * value[index] + weight * value[index + 1]
+
+    nodes = np.arange(resource_grid.size)
+    value = np.zeros(resource_grid.size)
+    policy_index = np.zeros(resource_grid.size, dtype=np.intp)
+    residual = np.inf
+    iterations = 0
+    while iterations < pms.SOLVER_MAX_ITERATIONS:
+        iterations += 1
+        # improvement
+        q = reward + discount * expected(value, next_index, next_weight)
+        policy_index = np.argmax(q, axis=1)
+        new_value = q[nodes, policy_index]
+        residual = float(np.max(np.abs(new_value - value)))
+        value = new_value
+        if residual <= pms.SOLVER_TOLERANCE:
+            break
+        # evaluation of the policy
+        policy_reward = reward[nodes, policy_index]
+        policy_next = next_index[nodes, policy_index]
+        policy_weight = next_weight[nodes, policy_index]
+        for _ in range(sweeps):
+            value = policy_reward + discount * expected(
+                value, policy_next, policy_weight)
+
+    solution = OptimalSolution(resource_grid, extraction_grid, policy_index,
+                               value, iterations, residual,
+                               time.time() - start)
+    if not solution.converged:
+        logger.warning(u"Optimal solution: no convergence after {} "
+                       u"iterations (residual {:.2e})".format(
+                        iterations, residual))
+    logger.info(u"Optimal solution: {} iterations, residual {:.2e}, "
+                u"{:.3f} s".format(iterations, residual, solution.elapsed))
+    return solution
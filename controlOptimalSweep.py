@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+This module runs the continuous game without server nor clients, for a grid
+of parameters and scripted extraction policies (see controlOptimalPolicies).
+The dynamic is the one of PartieCO.update_data and the payoff of the part is
+computed as in RemoteCO.remote_update_data (cumulative discounted payoff plus
+the infinite payoff of the last tick). The policies decide every
+decision_interval seconds (every tick by default), and an extraction refused
+by the server (greater than the resource) stays 0 until the next decision,
+as in the game.
+
+The points of the grid are split in chunks, computed by a pool of processes.
+Each chunk is written in its own file of the output directory (parquet if
+pyarrow is installed, npz otherwise), so a sweep that has been interrupted
+restarts where it stopped.
+
+Usage: python controlOptimalSweep.py spec.json output_directory
+with spec.json like
+{"grid": {"param_r": [0.005, 0.01], "RESOURCE_GROWTH": [0.4, 0.56]},
+ "policies": [["ConstantPolicy", {"extraction": 0.56}]],
+ "chunk_size": 5000, "decision_interval": 5}
+"""
+
+# built-in
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from datetime import timedelta
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# controlOptimal
+import controlOptimalParams as pms
+from controlOptimalPolicies import create_policy
+
+
+logger = logging.getLogger("le2m")
+
+SWEEP_PARAMS = ["param_a", "param_b", "param_c0", "param_c1", "param_r",
+                "RESOURCE_INITIAL_STOCK", "RESOURCE_GROWTH",
+                "CONTINUOUS_TIME_DURATION"]
+
+MANIFEST = "sweep.json"
+
+
+def simulate(policy, duration, dt=1., decision_interval=None, **params):
+    """
+    Run the continuous game for several points at once.
+    As in the game, an extraction greater than the resource is set to 0, and
+    stays 0 until the next decision of the player.
+    :param policy: the policy of the players
+    :param duration: array, duration of the part in seconds for each point
+    :param dt: the time between two ticks, in seconds (the extraction, the
+    growth and the payoff are rates per second, as in the TickEngine)
+    :param decision_interval: seconds between two decisions of the policy,
+    default every tick (the first decision is the initial extraction)
+    :param params: arrays, the parameters of the game for each point
+    (RESOURCE_INITIAL_STOCK and the keys accepted by
+    controlOptimalParams.get_instant_payoff and get_infinite_payoff_array)
+    :return: dictionary of arrays
+    """
+    duration = np.asarray(duration, dtype=np.float64)
+    nb_ticks = np.floor(duration / dt + 1e-9).astype(np.int64)
+    resource = np.array(np.broadcast_to(
+        params.pop("RESOURCE_INITIAL_STOCK", pms.RESOURCE_INITIAL_STOCK),
+        duration.shape), dtype=np.float64)
+    growth = params.get("RESOURCE_GROWTH", pms.RESOURCE_GROWTH)
+    discount_rate = params.get("param_r", pms.param_r)
+    extraction = np.zeros(duration.shape)
+    extraction_total = np.zeros(duration.shape)
+    refused = np.zeros(duration.shape, dtype=np.int64)
+    cumulative = np.zeros(duration.shape)
+    every = 1 if decision_interval is None else \
+        max(1, int(round(decision_interval / dt)))
+
+    # tick 0 is the update after the initial extraction
+    for tick in range(int(nb_ticks.max()) + 1 if nb_ticks.size else 0):
+        active = tick <= nb_ticks
+        the_time = tick * dt
+        if tick % every == 0:
+            decision = policy.decide(the_time, resource, extraction, **params)
+        else:
+            decision = extraction
+        over = decision * dt > resource
+        decision = np.where(over, 0., decision)
+        payoff = pms.get_instant_payoff(resource, decision, **params)[2]
+        new_resource = resource - decision * dt
+        new_resource += growth * dt
+        cumulative += np.where(
+            active, np.exp(- discount_rate * the_time) * payoff * dt, 0.)
+        extraction_total += np.where(active, decision * dt, 0.)
+        refused += active & over
+        extraction = np.where(active, decision, extraction)
+        resource = np.where(active, new_resource, resource)
+
+    infinite = pms.get_infinite_payoff_array(
+        nb_ticks * dt, resource, extraction, DYNAMIC_TYPE=pms.CONTINUOUS,
+        **params)
+    return OrderedDict([
+        ("resource_final", resource),
+        ("extraction_final", extraction),
+        ("extraction_total", extraction_total),
+        ("nb_extractions_refused", refused),
+        ("cumulative_payoff", cumulative),
+        ("infinite_payoff", infinite),
+        ("part_payoff", cumulative + infinite)])
+
+
+class Sweep(object):
+    """
+    The cartesian product of the values of the grid and of the policies
+    """
+
+    def __init__(self, grid, policies, directory, chunk_size=5000,
+                 decision_interval=None):
+        """
+        :param grid: dictionary parameter -> list of values, the parameters
+        are in SWEEP_PARAMS (CONTINUOUS_TIME_DURATION in seconds or
+        timedelta), the other parameters have the values of
+        controlOptimalParams
+        :param policies: list of policies
+        :param directory: the output directory
+        :param chunk_size: number of points per file
+        :param decision_interval: seconds between two decisions of the
+        policies, default every tick
+        """
+        for k in grid:
+            if k not in SWEEP_PARAMS:
+                raise ValueError(u"{} can't be swept".format(k))
+        self.grid = OrderedDict()
+        for k in SWEEP_PARAMS:
+            values = grid.get(k, [getattr(pms, k)])
+            if k == "CONTINUOUS_TIME_DURATION":
+                values = [v.total_seconds() if isinstance(v, timedelta)
+                          else v for v in values]
+            self.grid[k] = [float(v) for v in values]
+        self.policies = list(policies)
+        self.directory = directory
+        self.chunk_size = int(chunk_size)
+        self.decision_interval = decision_interval
+        self.dt = pms.SIMULATION_STEP.total_seconds()
+        # the policy varies the slowest, so that a chunk has few policies
+        self.shape = tuple([len(self.policies)] +
+                           [len(v) for v in self.grid.values()])
+        self.size = int(np.prod(self.shape))
+        self.nb_chunks = int(np.ceil(self.size / float(self.chunk_size)))
+
+    def get_manifest(self):
+        manifest = {"grid": self.grid,
+                    "policies": [repr(p) for p in self.policies],
+                    "chunk_size": self.chunk_size, "dt": self.dt,
+                    "DYNAMIC_TYPE": pms.CONTINUOUS}
+        if self.decision_interval is not None:
+            manifest["decision_interval"] = self.decision_interval
+        return manifest
+
+    def get_points(self, start, stop):
+        """
+        :return: the index of the policy and the parameters of the points
+        start to stop - 1
+        """
+        indexes = np.unravel_index(np.arange(start, stop), self.shape)
+        params = OrderedDict()
+        for (k, values), index in zip(self.grid.items(), indexes[1:]):
+            params[k] = np.asarray(values)[index]
+        return indexes[0], params
+
+    def get_chunk_path(self, chunk):
+        extension = "parquet" if pa is not None else "npz"
+        return os.path.join(self.directory, "chunk-{:06d}.{}".format(
+            chunk, extension))
+
+    def run_chunk(self, chunk):
+        start = chunk * self.chunk_size
+        stop = min(start + self.chunk_size, self.size)
+        policy_index, params = self.get_points(start, stop)
+        columns = OrderedDict()
+        columns["point"] = np.arange(start, stop)
+        columns["policy"] = policy_index
+        columns.update(params)
+        results = None
+        for p in np.unique(policy_index):
+            mask = policy_index == p
+            sub_params = {k: v[mask] for k, v in params.items()}
+            duration = sub_params.pop("CONTINUOUS_TIME_DURATION")
+            sub_results = simulate(self.policies[p], duration, self.dt,
+                                   self.decision_interval, **sub_params)
+            if results is None:
+                results = OrderedDict(
+                    (k, np.zeros(stop - start, dtype=v.dtype))
+                    for k, v in sub_results.items())
+            for k, v in sub_results.items():
+                results[k][mask] = v
+        columns.update(results)
+        write_columns(self.get_chunk_path(chunk), columns)
+        return chunk
+
+    def get_remaining_chunks(self):
+        return [c for c in range(self.nb_chunks)
+                if not os.path.exists(self.get_chunk_path(c))]
+
+    def run(self, processes=None):
+        """
+        Compute the chunks that are not already in the directory
+        :param processes: size of the pool, default the number of cpus
+        :return: the time of the sweep in seconds
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        manifest_path = os.path.join(self.directory, MANIFEST)
+        manifest = json.loads(json.dumps(self.get_manifest()))
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                if json.load(f) != manifest:
+                    raise ValueError(
+                        u"{} contains another sweep".format(self.directory))
+        else:
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f, indent=1)
+
+        start = time.time()
+        remaining = self.get_remaining_chunks()
+        logger.info(u"Sweep: {} points, {} chunks to compute out of {}".format(
+            self.size, len(remaining), self.nb_chunks))
+        if not remaining:
+            return 0.
+        pool = multiprocessing.Pool(processes)
+        try:
+            for done, chunk in enumerate(pool.imap_unordered(
+                    _run_chunk, [(self, c) for c in remaining])):
+                logger.debug(u"Sweep: chunk {} done ({}/{})".format(
+                    chunk, done + 1, len(remaining)))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        elapsed = time.time() - start
+        logger.info(u"Sweep: done in {:.1f} s".format(elapsed))
+        return elapsed
+
+
+def _run_chunk(args):
+    sweep, chunk = args
+    return sweep.run_chunk(chunk)
+
+
+def write_columns(path, columns):
+    """
+    Write the columns (dictionary name -> array) in a temporary file that is
+    renamed at the end, so that a chunk file is either complete or absent
+    """
+    tmp_path = path + ".tmp"
+    if path.endswith(".parquet"):
+        pq.write_table(pa.table(columns), tmp_path)
+    else:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **columns)
+    os.rename(tmp_path, path)
+
+
+def load_results(directory):
+    """
+    :return: dictionary column -> array with all the chunks of the directory
+    """
+    files = sorted(f for f in os.listdir(directory)
+                   if f.startswith("chunk-") and
+                   (f.endswith(".parquet") or f.endswith(".npz")))
+    parts = []
+    for f in files:
+        path = os.path.join(directory, f)
+        if f.endswith(".parquet"):
+            table = pq.read_table(path)
+            parts.append(OrderedDict(
+                (n, table.column(n).to_numpy()) for n in table.column_names))
+        else:
+            data = np.load(path)
+            parts.append(OrderedDict((n, data[n]) for n in data.files))
+    if not parts:
+        return OrderedDict()
+    return OrderedDict((n, np.concatenate([p[n] for p in parts]))
+                       for n in parts[0])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=u"Parameter sweep")
+    parser.add_argument("spec", help=u"json file with the grid and policies")
+    parser.add_argument("directory", help=u"output directory")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+    with open(args.spec) as f:
+        spec = json.load(f)
+    Sweep(spec["grid"],
+          [create_policy(name, **kwargs) for name, kwargs in spec["policies"]],
+          args.directory, spec.get("chunk_size", 5000),
+          spec.get("decision_interval")).run(args.processes)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the format of the data sent to the remote at each tick.
+The server and the remote agree on a version at configure:
+- WIRE_DICT: the dictionary of ExtractionsCO.to_dict (every column, with the
+names), the original format
+- WIRE_TUPLE: a tuple with only the values read by the remote, in the order
+of FIELDS, followed by GROUP_FIELD if the stock is shared (GROUP_RESOURCE)
+- WIRE_BATCH: the WIRE_TUPLE messages of the ticks between two refreshes
+(TIMER_UPDATE) are sent together by update_data_batch, as a list of
+(message, time), a single tick is sent by update_data
+"""
+
+# controlOptimal
+import controlOptimalParams as pms
+
+
+WIRE_DICT = 0
+WIRE_TUPLE = 1
+WIRE_BATCH = 2
+SUPPORTED_VERSIONS = [WIRE_DICT, WIRE_TUPLE, WIRE_BATCH]
+
+FIELDS = ("CO_extraction", "CO_resource", "CO_cost", "CO_payoff")
+# only with GROUP_RESOURCE, the extraction of the group otherwise
+GROUP_FIELD = "CO_group_extraction"
+
+
+def negotiate(versions):
+    """
+    :param versions: the versions supported by the other side, None if it
+    doesn't know the negotiation
+    :return: the highest version supported by both sides
+    """
+    common = set(versions or []) & set(SUPPORTED_VERSIONS)
+    return max(common) if common else WIRE_DICT
+
+
+def encode(version, extraction):
+    """
+    :param version: the negotiated version
+    :param extraction: the ExtractionsCO of the tick
+    :return: the message for the remote
+    """
+    if version in (WIRE_TUPLE, WIRE_BATCH):
+        message = (extraction.CO_extraction, extraction.CO_resource,
+                   extraction.CO_cost, extraction.CO_payoff)
+        if pms.GROUP_RESOURCE:
+            message += (extraction.CO_group_extraction,)
+        return message
+    return extraction.to_dict()
+
+
+def decode(version, message):
+    """
+    :param version: the negotiated version
+    :param message: the message made by encode
+    :return: a tuple with the values of FIELDS and GROUP_FIELD
+    """
+    if version in (WIRE_TUPLE, WIRE_BATCH):
+        values = tuple(message)
+        group_extraction = values[4] if len(values) > 4 else None
+    else:
+        values = tuple(message[f] for f in FIELDS)
+        group_extraction = message.get(GROUP_FIELD)
+    if group_extraction is None:
+        group_extraction = values[0]
+    return values[:4] + (group_extraction,)
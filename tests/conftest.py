@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+The modules of controlOptimal are imported by their name, as le2m does
+"""
+
+# built-in
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+The running payoff of the remote against the part payoff of the server
+"""
+
+# built-in
+import unittest
+import numpy as np
+
+# controlOptimal
+import controlOptimalParams as pms
+from controlOptimalAccounting import DiscountTable, PayoffAccumulator
+
+
+class TestAccounting(unittest.TestCase):
+    TICK_DURATION = 0.25
+    NB_TICKS = 240
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.times = np.array([round(k * self.TICK_DURATION, 3)
+                               for k in range(self.NB_TICKS + 1)])
+        self.payoffs = random_state.uniform(-1, 2, self.times.size)
+        self.extractions = random_state.uniform(0, 2.8, self.times.size)
+
+    def test_cumulative_payoff(self):
+        # the same float as the np.cumsum of TickHistory.get_part_payoff
+        accumulator = PayoffAccumulator(
+            DiscountTable(self.TICK_DURATION, self.NB_TICKS))
+        cumulative = []
+        for the_time, payoff, extraction in zip(
+                self.times.tolist(), self.payoffs.tolist(),
+                self.extractions.tolist()):
+            accumulator.add(the_time, payoff, extraction)
+            cumulative.append(accumulator.cumulative_payoff)
+        expected = np.cumsum(pms.get_discount(self.times) * self.payoffs *
+                             self.TICK_DURATION)
+        self.assertEqual(cumulative, expected.tolist())
+        self.assertAlmostEqual(
+            accumulator.undiscounted_payoff,
+            float(np.sum(self.payoffs) * self.TICK_DURATION))
+        self.assertAlmostEqual(
+            accumulator.extraction_total,
+            float(np.sum(self.extractions) * self.TICK_DURATION))
+        self.assertEqual(accumulator.nb_ticks, self.times.size)
+
+    def test_discount_outside_table(self):
+        table = DiscountTable(self.TICK_DURATION, 4)
+        for the_time in [0.5, 0.3, 2.]:
+            self.assertAlmostEqual(table.get(the_time),
+                                   float(pms.get_discount(the_time)))
+
+
+if __name__ == "__main__":
+    unittest.main()
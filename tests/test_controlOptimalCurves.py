@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+The packed curves and the migration of the curves stored point by point
+"""
+
+# built-in
+import unittest
+import numpy as np
+from sqlalchemy import create_engine, literal_column
+from sqlalchemy.orm import sessionmaker
+
+# le2m
+from server.servbase import Base
+
+# controlOptimal
+from controlOptimalCurves import X_RLE, Y_RLE, pack_curve, unpack_curve
+from controlOptimalPart import CurveCO, CurvePackedCO, migrate_curves
+
+
+class TestPackCurve(unittest.TestCase):
+    def assert_round_trip(self, x, y):
+        data = pack_curve(x, y)
+        x_unpacked, y_unpacked = unpack_curve(data)
+        np.testing.assert_array_equal(x_unpacked, np.asarray(x, dtype=float))
+        np.testing.assert_array_equal(y_unpacked, np.asarray(y, dtype=float))
+        return data
+
+    def test_rle(self):
+        # regular times and a step curve: one run for x, one per step for y
+        x = np.arange(1, 601) * 0.25
+        y = np.repeat([0.5, 1.2, 0.], [200, 300, 100])
+        data = self.assert_round_trip(x, y)
+        self.assertEqual(bytearray(data)[1], X_RLE | Y_RLE)
+        self.assertLess(len(data), 100)
+
+    def test_raw(self):
+        random_state = np.random.RandomState(0)
+        x = np.cumsum(random_state.uniform(0.1, 1, 50))
+        data = self.assert_round_trip(x, random_state.uniform(0, 20, 50))
+        self.assertEqual(bytearray(data)[1], 0)
+
+    def test_empty(self):
+        self.assert_round_trip([], [])
+
+    def test_single_point(self):
+        self.assert_round_trip([3.], [1.5])
+
+    def test_nan(self):
+        self.assert_round_trip([0., 1., np.nan, 3., 4.],
+                               [1., np.nan, np.nan, 2., 2.])
+
+    def test_length(self):
+        self.assertRaises(ValueError, pack_curve, [1., 2.], [1.])
+
+
+class TestMigrateCurves(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+    def tearDown(self):
+        self.session.close()
+
+    def add_points(self, partie_id, curve_type, points):
+        for x, y in points:
+            curve = CurveCO(curve_type, x, y)
+            curve.partie_id = partie_id
+            self.session.add(curve)
+
+    def test_delete(self):
+        points = [(k, 0.5 * k) for k in range(1, 11)]
+        # part 1: type 0 already packed, type 1 to pack
+        self.add_points(1, 0, points)
+        packed = CurvePackedCO(0, [p[0] for p in points],
+                               [p[1] for p in points])
+        packed.partie_id = 1
+        self.session.add(packed)
+        self.add_points(1, 1, points)
+        # part 2: a point that can't be packed (text in a float column)
+        self.add_points(2, 0, points)
+        self.session.execute(CurveCO.__table__.insert().values(
+            partie_id=2, CO_curve_type=0, CO_curve_x=11,
+            CO_curve_y=literal_column(u"'n/a'")))
+        self.session.commit()
+
+        self.assertEqual(migrate_curves(self.session, delete=True), 1)
+        self.assertEqual(
+            sorted(self.session.query(CurvePackedCO.partie_id,
+                                      CurvePackedCO.CO_curve_type).all()),
+            [(1, 0), (1, 1)])
+        # only the rows of the packed curves are deleted
+        self.assertEqual(
+            set(self.session.query(CurveCO.partie_id,
+                                   CurveCO.CO_curve_type).all()), {(2, 0)})
+        self.assertEqual(self.session.query(CurveCO).count(), 11)
+        curve = self.session.query(CurvePackedCO).filter_by(
+            partie_id=1, CO_curve_type=1).one()
+        x, y = unpack_curve(curve.CO_curve_data)
+        np.testing.assert_array_equal(x, [p[0] for p in points])
+        np.testing.assert_array_equal(y, [p[1] for p in points])
+
+    def test_keep(self):
+        self.add_points(1, 0, [(1, 1.), (2, 1.)])
+        self.session.commit()
+        self.assertEqual(migrate_curves(self.session), 1)
+        self.assertEqual(self.session.query(CurveCO).count(), 2)
+        self.assertEqual(migrate_curves(self.session), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+The csv files of the export, with text that is not ascii
+"""
+
+# built-in
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from sqlalchemy import Float, String
+
+# controlOptimal
+from controlOptimalExport import CsvWriter
+
+
+class TestCsvWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_utf8(self):
+        path = os.path.join(self.directory, u"players.csv")
+        writer = CsvWriter(path, [(u"joueur", String), (u"extraction", Float)])
+        writer.write([[u"Hélène", u"Zoë"], np.array([0.5, 1.25])])
+        writer.close()
+        with io.open(path, encoding="utf-8", newline="") as csv_file:
+            self.assertEqual(csv_file.read(), u"joueur,extraction\r\n"
+                                              u"Hélène,0.5\r\nZoë,1.25\r\n")
+        self.assertEqual(writer.nb_rows, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
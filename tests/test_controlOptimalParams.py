@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+The vectorized infinite payoff against the scalar get_infinite_payoff
+"""
+
+# built-in
+import unittest
+import numpy as np
+
+# controlOptimal
+import controlOptimalParams as pms
+
+
+class TestInfinitePayoffArray(unittest.TestCase):
+    # c0 / c1 = 20, RESOURCE_GROWTH = 0.56
+    CASES = {
+        "1.1": (25., 0.3),  # resource above c0 / c1, growth >= extraction
+        "1.2": (25., 1.5),  # resource above c0 / c1, growth < extraction
+        "1.3": (10., 0.3),  # resource below c0 / c1, growth > extraction
+        "1.4": (10., 1.5),  # resource below c0 / c1, growth < extraction
+        "1.5": (10., pms.RESOURCE_GROWTH)}  # growth == extraction
+    TIMES = [0., 12.5, 60.]
+
+    def setUp(self):
+        self.dynamic_type = pms.DYNAMIC_TYPE
+        pms.DYNAMIC_TYPE = pms.CONTINUOUS
+
+    def tearDown(self):
+        pms.DYNAMIC_TYPE = self.dynamic_type
+
+    def test_cases(self):
+        for name, (resource, extraction) in sorted(self.CASES.items()):
+            for t in self.TIMES:
+                expected = pms.get_infinite_payoff(t, resource, extraction)
+                self.assertNotEqual(expected, 0, name)
+                np.testing.assert_allclose(
+                    pms.get_infinite_payoff_array(t, resource, extraction),
+                    expected, rtol=1e-12, err_msg=name)
+
+    def test_broadcast(self):
+        resource, extraction = zip(*self.CASES.values())
+        t = np.array(self.TIMES)[:, np.newaxis]
+        values = pms.get_infinite_payoff_array(
+            t, np.array(resource), np.array(extraction))
+        self.assertEqual(values.shape, (len(self.TIMES), len(self.CASES)))
+        for i, time in enumerate(self.TIMES):
+            for j, (r, e) in enumerate(zip(resource, extraction)):
+                np.testing.assert_allclose(
+                    values[i, j], pms.get_infinite_payoff(time, r, e),
+                    rtol=1e-12)
+
+    def test_overrides(self):
+        expected = pms.get_infinite_payoff(12.5, 25., 0.3)
+        pms.param_r, param_r = 0.01, pms.param_r
+        try:
+            other = pms.get_infinite_payoff(12.5, 25., 0.3)
+        finally:
+            pms.param_r = param_r
+        self.assertNotAlmostEqual(expected, other)
+        np.testing.assert_allclose(pms.get_infinite_payoff_array(
+            12.5, 25., 0.3, param_r=0.01), other, rtol=1e-12)
+
+    def test_growth(self):
+        # the growth of a shared resource, in the cases 1.1 to 1.5
+        for resource, growth in [(25., 0.8), (25., 0.1), (12., 0.8),
+                                 (12., 0.1), (12., 0.3)]:
+            np.testing.assert_allclose(
+                pms.get_infinite_payoff(12.5, resource, 0.3, growth),
+                pms.get_infinite_payoff_array(12.5, resource, 0.3,
+                                              RESOURCE_GROWTH=growth),
+                rtol=1e-12)
+
+    def test_discrete(self):
+        pms.DYNAMIC_TYPE = pms.DISCRETE
+        self.assertEqual(pms.get_infinite_payoff_array(12.5, 25., 0.3), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
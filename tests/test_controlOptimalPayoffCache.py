@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+The key and the grid of the payoff surface
+"""
+
+# built-in
+import unittest
+from datetime import timedelta
+import numpy as np
+
+# controlOptimal
+import controlOptimalParams as pms
+import controlOptimalPayoffCache as cache
+
+
+class TestPayoffSurface(unittest.TestCase):
+    def setUp(self):
+        self.simulation_step = pms.SIMULATION_STEP
+        self.dynamic_type = pms.DYNAMIC_TYPE
+        pms.DYNAMIC_TYPE = pms.CONTINUOUS
+
+    def tearDown(self):
+        pms.SIMULATION_STEP = self.simulation_step
+        pms.DYNAMIC_TYPE = self.dynamic_type
+
+    def test_key(self):
+        key = cache.get_parameters_hash()
+        pms.SIMULATION_STEP = timedelta(seconds=0.25)
+        self.assertNotEqual(cache.get_parameters_hash(), key)
+
+    def test_resource_grid(self):
+        grid = cache.get_resource_grid(cache.get_extraction_grid().size)
+        np.testing.assert_allclose(
+            grid, np.arange(grid.size) * pms.DECISION_STEP)
+        self.assertGreaterEqual(
+            grid[-1], pms.RESOURCE_INITIAL_STOCK + pms.RESOURCE_GROWTH *
+            pms.CONTINUOUS_TIME_DURATION.total_seconds())
+
+    def test_get(self):
+        surface = cache.PayoffSurface.build()
+        self.assertTrue(surface.usable)
+        resource = np.array([0.5, 12.34, 15., 25.])
+        extraction = np.array([0., 0.3, 0.56, 1.5])
+        exact = pms.get_infinite_payoff_array(12.5, resource, extraction)
+        np.testing.assert_allclose(surface.get(12.5, resource, extraction),
+                                   exact, atol=surface.error_bound)
+        self.assertAlmostEqual(surface.get(12.5, 12.34, 0.3), exact[1],
+                               delta=surface.error_bound)
+        # off the grid of the slider, the exact formula
+        self.assertEqual(surface.get(12.5, 12.34, 0.305),
+                         pms.get_infinite_payoff(12.5, 12.34, 0.305))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+The column of the replayed extractions of the simulated players
+"""
+
+# built-in
+import os
+import shutil
+import tempfile
+import unittest
+
+# controlOptimal
+import controlOptimalParams as pms
+from controlOptimalPolicies import PolicyBatch, RandomPolicy, ReplayPolicy
+
+
+class Member(object):
+    def __init__(self, resource=10.):
+        self.resource = resource
+
+    def get_policy_state(self):
+        return 5., self.resource, 0.
+
+
+class TestReplayPolicy(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, "replay.csv")
+        with open(path, "w") as replay_file:
+            replay_file.write("0,0.1,0.2,0.3\n")
+        self.batch = PolicyBatch(ReplayPolicy(path))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_column_of_the_member(self):
+        members = [Member() for _ in range(4)]
+        for member in members:
+            self.batch.register(member)
+        # decided alone or with others, a member keeps its column
+        self.assertEqual(
+            [self.batch.decide([m])[0] for m in members],
+            [0.1, 0.2, 0.3, 0.1])
+        self.assertEqual(self.batch.decide(members[2:]).tolist(), [0.3, 0.1])
+
+    def test_position_without_batch(self):
+        policy = self.batch.policy
+        self.assertEqual(policy.decide(5., [10.] * 4, 0.).tolist(),
+                         [0.1, 0.2, 0.3, 0.1])
+
+
+class TestRandomPolicy(unittest.TestCase):
+    def test_bounds(self):
+        # DECISION_MAX is never drawn
+        extraction = RandomPolicy().decide(
+            0., [10.] * 3, 0., uniform=[0., 0.5, 0.999999])
+        self.assertEqual(extraction[0], pms.DECISION_MIN)
+        self.assertAlmostEqual(extraction[2],
+                               pms.DECISION_MAX - pms.DECISION_STEP)
+        extraction = RandomPolicy(seed=1).decide(0., [10.] * 10000, 0.)
+        self.assertLess(extraction.max(), pms.DECISION_MAX)
+
+
+if __name__ == "__main__":
+    unittest.main()
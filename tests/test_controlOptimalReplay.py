@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+The replay of a part played by the tick engine, with a late tick
+"""
+
+# built-in
+import unittest
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import create_engine
+
+# le2m
+from server.servbase import Base
+from server.servparties import Partie
+
+# controlOptimal
+import controlOptimalParams as pms
+import controlOptimalWire as wire
+from controlOptimalDbWriter import get_row
+from controlOptimalEngine import TickEngine
+from controlOptimalPart import ExtractionsCO, PartieCO, RepetitionsCO
+from controlOptimalReplay import Recording, Replay
+
+
+class Period(object):
+    def __init__(self, repetitions_id):
+        self.id = repetitions_id
+
+
+class Remote(object):
+    def callRemote(self, *args):
+        return None
+
+
+class Writer(object):
+    def __init__(self):
+        self.rows = []
+
+    def add_object(self, obj):
+        self.rows.append(get_row(obj))
+
+
+class Player(object):
+    """
+    The methods of PartieCO used by the tick engine, without the database
+    and the screen of the server
+    """
+    new_extraction = PartieCO.__dict__["new_extraction"]
+    store_current_extraction = PartieCO.__dict__["store_current_extraction"]
+    update_data = PartieCO.__dict__["update_data"]
+    send_updates = PartieCO.__dict__["send_updates"]
+    measure_round_trip = PartieCO.__dict__["measure_round_trip"]
+
+    def __init__(self, partie_id, writer):
+        self.partie_id = partie_id
+        self.joueur = u"j{}".format(partie_id)
+        self.remote = Remote()
+        self.writer = writer
+        self.wire_version = wire.WIRE_BATCH
+        self.pending_updates = []
+        self.current_extraction = None
+        self.current_extraction_applied = False
+        self.currentperiod = None
+        self.info_pending = None
+        self.info_call = None
+
+    def display_info(self):
+        pass
+
+
+class TestReplay(unittest.TestCase):
+    PARAMS = {"DYNAMIC_TYPE": pms.CONTINUOUS, "GROUP_RESOURCE": False,
+              "SIMULATION_STEP": timedelta(seconds=0.25),
+              "CONTINUOUS_TIME_DURATION": timedelta(seconds=5)}
+
+    def setUp(self):
+        self.params = {k: getattr(pms, k) for k in self.PARAMS}
+        for k, v in self.PARAMS.items():
+            setattr(pms, k, v)
+
+    def tearDown(self):
+        for k, v in self.params.items():
+            setattr(pms, k, v)
+
+    def play(self):
+        """
+        Two players, the tick 8 (2 s) is late: it runs after an extraction
+        made at 2.1 s on the clock of the server
+        :return: the database
+        """
+        writer = Writer()
+        players = [Player(1, writer), Player(2, writer)]
+        engine = TickEngine(players)
+        for player in players:
+            player.currentperiod = Period(player.partie_id)
+            player.new_extraction(1., 3.2)
+        engine.update_data()
+        engine.new_period(1)
+        for player in players:
+            player.currentperiod = Period(10 + player.partie_id)
+        nb_ticks = int(round(pms.CONTINUOUS_TIME_DURATION.total_seconds() /
+                             pms.get_tick_duration()))
+        decisions = {3: [(0, 0.5, 0.7)], 8: [(0, 2., 2.1), (1, 0.2, 2.1)],
+                     13: [(1, 1.5, 3.1)]}
+        for tick in range(1, nb_ticks + 1):
+            for index, extraction, the_time in decisions.get(tick, []):
+                players[index].new_extraction(extraction, the_time)
+            engine.update_data(round(tick * pms.get_tick_duration(), 3))
+        for player in players:
+            player.store_current_extraction()
+
+        database = create_engine("sqlite://")
+        Base.metadata.create_all(database)
+        with database.begin() as connection:
+            for player in players:
+                connection.execute(Partie.__table__.insert().values(
+                    id=player.partie_id))
+                connection.execute(PartieCO.__table__.insert().values(
+                    partie_id=player.partie_id,
+                    CO_dynamic_type=pms.CONTINUOUS, CO_sequence=1,
+                    CO_group=0, CO_gain_ecus=float(engine.get_curves(
+                        player.engine_index)[pms.PAYOFF][1][-1])))
+                for period in (0, 1):
+                    connection.execute(RepetitionsCO.__table__.insert().values(
+                        id=10 * period + player.partie_id,
+                        partie_partie_id=player.partie_id, CO_period=period))
+            connection.execute(ExtractionsCO.__table__.insert(), writer.rows)
+        return database
+
+    def test_late_tick(self):
+        with self.play().connect() as connection:
+            recording = Recording(connection, pms.CONTINUOUS)
+        self.assertEqual(recording.nb_extractions, 6)
+        replay = Replay(recording).run()
+        diverging = replay.get_divergences()[2]
+        self.assertEqual(int(diverging.sum()), 0)
+        np.testing.assert_allclose(replay.gain_ecus, recording.gain_ecus,
+                                   atol=1e-9)
+
+        # from the clock of the server, the extractions of the late tick
+        # are put in force one tick later
+        recording.tick_time[:] = np.nan
+        replay = Replay(recording).run()
+        self.assertGreater(int(replay.get_divergences()[2].sum()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
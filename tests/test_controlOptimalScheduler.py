@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+The steps of the fixed-step scheduler, with a fake clock and a fake timer
+"""
+
+# built-in
+import unittest
+from datetime import timedelta
+
+# controlOptimal
+import controlOptimalScheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTimer(object):
+    """
+    Records the delay of the timer instead of starting it
+    """
+
+    def __init__(self):
+        self.delay = None
+
+    def start(self, delay):
+        self.delay = delay
+
+    def stop(self):
+        self.delay = None
+
+
+class TestFixedStepScheduler(unittest.TestCase):
+    STEP = 0.25
+    DURATION = 60.
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.monotonic = controlOptimalScheduler.monotonic
+        controlOptimalScheduler.monotonic = self.clock
+        self.times = []
+        self.finished = []
+        self.scheduler = controlOptimalScheduler.FixedStepScheduler(
+            timedelta(seconds=self.STEP), int(self.DURATION / self.STEP),
+            self.times.append, lambda: self.finished.append(self.clock.now))
+        self.timer = self.scheduler.timer = FakeTimer()
+        self.scheduler.start()
+        self.origin = self.clock.now
+
+    def tearDown(self):
+        controlOptimalScheduler.monotonic = self.monotonic
+
+    def fire(self, late=0.):
+        """
+        The timer fires, late seconds after the delay it was given
+        """
+        self.clock.now += self.timer.delay / 1000. + late
+        self.scheduler._wake_up()
+
+    def test_no_drift(self):
+        # each fire about 4 ms late: the next delay is shortened, the steps
+        # stay on start + k * step
+        late = 1. / 256
+        self.assertEqual(self.timer.delay, 250)
+        self.fire(late)
+        self.assertEqual(self.times, [0.25])
+        self.assertEqual(self.timer.delay, 247)
+        for _ in range(9):
+            self.fire(late)
+        self.assertEqual(self.times, [round(k * self.STEP, 3)
+                                      for k in range(1, 11)])
+        # late by one fire only (plus the rounding of the delay to the
+        # millisecond above), not by the sum of them
+        self.assertLess(abs(self.clock.now - self.origin - 10 * self.STEP -
+                            late), 0.001)
+        self.assertEqual(self.scheduler.catch_ups, 0)
+
+    def test_catch_up(self):
+        self.fire()
+        # a fire 1.125 s late: the 4 steps due are run in order
+        self.fire(1.125)
+        self.assertEqual(self.times, [0.25, 0.5, 0.75, 1., 1.25, 1.5])
+        self.assertEqual(self.scheduler.catch_ups, 4)
+        # and the next one is back on the grid
+        self.assertEqual(self.timer.delay, 125)
+        self.fire()
+        self.assertEqual(self.times[-1], 1.75)
+
+    def test_last_step(self):
+        self.fire(5.)
+        while self.timer.delay is not None:
+            self.fire(1. / 128)
+        nb_steps = int(self.DURATION / self.STEP)
+        self.assertEqual(self.times, [round(k * self.STEP, 3)
+                                      for k in range(1, nb_steps + 1)])
+        self.assertEqual(self.times[-1], self.DURATION)
+        self.assertEqual(len(self.finished), 1)
+        self.assertFalse(self.scheduler.running)
+
+
+if __name__ == "__main__":
+    unittest.main()
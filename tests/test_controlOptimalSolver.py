@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+The optimal solution against the dynamic of the TickEngine
+"""
+
+# built-in
+import math
+import unittest
+import numpy as np
+
+# controlOptimal
+import controlOptimalParams as pms
+import controlOptimalSolver as solver
+
+NB_TICKS = 4000  # exp(-r t) is negligible after
+
+
+class TestSolver(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.solution = solver.solve()
+
+    def test_converged(self):
+        self.assertTrue(self.solution.converged)
+        self.assertLess(self.solution.error_bound, 1e-6)
+
+    def test_trajectory(self):
+        # with ticks of one second the trajectory stays on the grid, its
+        # discounted payoff is the value
+        trajectory = self.solution.get_trajectory(nb_ticks=NB_TICKS)
+        self.assertAlmostEqual(
+            trajectory["cumulative_payoff"][-1],
+            float(self.solution.get_value(pms.RESOURCE_INITIAL_STOCK)),
+            places=5)
+        self.assertTrue(np.all(trajectory["resource"] >= 0))
+
+    def test_better_than_constant(self):
+        optimal = float(self.solution.get_value(pms.RESOURCE_INITIAL_STOCK))
+        for extraction in [0.2, pms.RESOURCE_GROWTH, 1.]:
+            resource, total = pms.RESOURCE_INITIAL_STOCK, 0.
+            for tick in range(NB_TICKS):
+                e = 0. if extraction > resource else extraction
+                total += math.exp(- pms.param_r * tick) * \
+                    float(pms.get_instant_payoff(resource, e)[2])
+                resource += pms.RESOURCE_GROWTH - e
+            self.assertGreater(optimal, total)
+
+    def test_efficiency(self):
+        optimal = float(self.solution.get_value(pms.RESOURCE_INITIAL_STOCK))
+        self.assertAlmostEqual(self.solution.get_efficiency(optimal / 2), 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
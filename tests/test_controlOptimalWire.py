@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+The formats of the update_data messages
+"""
+
+# built-in
+import pickle
+import unittest
+
+# controlOptimal
+import controlOptimalParams as pms
+import controlOptimalWire as wire
+
+
+class Extraction(object):
+    """
+    The columns of ExtractionsCO read by encode
+    """
+
+    def __init__(self, group_extraction=None):
+        self.id = 12
+        self.repetitions_id = 3
+        self.CO_extraction = 0.56
+        self.CO_extraction_time = 10.25
+        self.CO_resource = 14.8
+        self.CO_benefice = 1.1177
+        self.CO_cost = 0.
+        self.CO_payoff = 1.1177
+        self.CO_group_extraction = group_extraction
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class TestWire(unittest.TestCase):
+    def setUp(self):
+        self.group_resource = pms.GROUP_RESOURCE
+
+    def tearDown(self):
+        pms.GROUP_RESOURCE = self.group_resource
+
+    def round_trip(self, version, extraction):
+        # the message goes through a pickle, as through pb
+        return wire.decode(version, pickle.loads(pickle.dumps(
+            wire.encode(version, extraction))))
+
+    def test_round_trip(self):
+        pms.GROUP_RESOURCE = False
+        extraction = Extraction()
+        expected = (0.56, 14.8, 0., 1.1177, 0.56)
+        for version in wire.SUPPORTED_VERSIONS:
+            self.assertEqual(self.round_trip(version, extraction), expected)
+
+    def test_round_trip_group(self):
+        pms.GROUP_RESOURCE = True
+        extraction = Extraction(group_extraction=1.7)
+        expected = (0.56, 14.8, 0., 1.1177, 1.7)
+        for version in wire.SUPPORTED_VERSIONS:
+            self.assertEqual(self.round_trip(version, extraction), expected)
+
+    def test_tuple_is_compact(self):
+        pms.GROUP_RESOURCE = False
+        self.assertEqual(len(wire.encode(wire.WIRE_TUPLE, Extraction())),
+                         len(wire.FIELDS))
+
+    def test_negotiate(self):
+        self.assertEqual(wire.negotiate(None), wire.WIRE_DICT)
+        self.assertEqual(wire.negotiate([]), wire.WIRE_DICT)
+        self.assertEqual(wire.negotiate([wire.WIRE_DICT, wire.WIRE_TUPLE]),
+                         wire.WIRE_TUPLE)
+        self.assertEqual(wire.negotiate(wire.SUPPORTED_VERSIONS + [99]),
+                         max(wire.SUPPORTED_VERSIONS))
+
+
+if __name__ == "__main__":
+    unittest.main()